@@ -1,6 +1,7 @@
 import logging
 
 from django.contrib import admin
+from django.db.models import Sum, Max, F, FloatField, ExpressionWrapper
 
 from django.conf.urls import url, include
 from django.shortcuts import redirect
@@ -33,7 +34,86 @@ class GroupProjectBindingAdmin(admin.ModelAdmin):
 
 @admin.register(Container)
 class ContainerAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'image', 'user', 'state', 'n_projects', 'marked_to_remove')
+    list_display = ('id', 'name', 'image', 'user', 'state', 'engine', 'n_projects', 'marked_to_remove')
+
+@admin.register(SpawnJob)
+class SpawnJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'container', 'phase', 'message', 'created_at', 'updated_at')
+    list_filter = ('phase', )
+
+@admin.register(ArchiveJob)
+class ArchiveJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'folder', 'target', 'state', 'message', 'bytes_in', 'bytes_out', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('state', )
+    search_fields = ('folder', )
+    actions = [ 'requeue' ]
+
+    def requeue(self, request, queryset):
+        n = queryset.filter(state = ArchiveJob.ST_FAILED).update(state = ArchiveJob.ST_QUEUED, message = None)
+        self.message_user(request, "%d failed jobs queued again" % n)
+    requeue.short_description = "Queue failed jobs again"
+
+@admin.register(DiskUsage)
+class DiskUsageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'path', 'user', 'project', 'course', 'megabytes', 'files', 'quota', 'over_quota', 'measured_at')
+    list_filter = ('kind', )
+    search_fields = ('path', 'user__username', 'project__name', 'course__name')
+    ordering = ('-size', )
+
+    def megabytes(self, instance):
+        return "%.1f" % instance.megabytes
+
+    def over_quota(self, instance):
+        return instance.over_quota
+    over_quota.boolean = True
+
+@admin.register(ContainerMountPlan)
+class ContainerMountPlanAdmin(admin.ModelAdmin):
+    list_display = ('id', 'container', 'volume', 'is_stale', 'folders', 'updated_at')
+    search_fields = ('container__name', 'container__user__username')
+    actions = [ 'invalidate' ]
+
+    def is_stale(self, instance):
+        return instance.is_stale
+    is_stale.boolean = True
+
+    def invalidate(self, request, queryset):
+        n = queryset.update(folders = None)
+        self.message_user(request, "%d mount plans are recomputed when written next time" % n)
+    invalidate.short_description = "Recompute the plans"
+
+@admin.register(ContainerResourceSample)
+class ContainerResourceSampleAdmin(admin.ModelAdmin):
+    list_display = ('id', 'timestamp', 'resolution', 'container', 'user', 'image', 'course', 'cpu', 'memory', 'memory_max', 'net_rx', 'net_tx', 'blk_read', 'blk_write')
+    list_filter = ('resolution', 'image', 'course')
+    search_fields = ('user__username', )
+    date_hierarchy = 'timestamp'
+    summaries = [ ('User', 'user__username'), ('Image', 'image__name'), ('Course', 'course__name') ]
+
+    def changelist_view(self, request, extra_context = None):
+        response = super(ContainerResourceSampleAdmin, self).changelist_view(request, extra_context = extra_context)
+        try:
+            queryset = response.context_data['cl'].queryset
+        except (AttributeError, KeyError):
+            return response
+        # the same period is present in several resolutions, summaries are calculated from one of them
+        if not 'resolution__exact' in request.GET:
+            queryset = queryset.filter(resolution = ContainerResourceSample.RES_1H)
+        response.context_data['summaries'] = [ (title, self.summarize(queryset, field)) for title, field in self.summaries ]
+        return response
+
+    @staticmethod
+    def summarize(queryset, field):
+        weighted = lambda f: Sum(ExpressionWrapper(F(f) * F('n_samples'), output_field = FloatField())) / Sum('n_samples')
+        rows = queryset.values(field).annotate(
+            n_samples = Sum('n_samples'),
+            cpu = ExpressionWrapper(weighted('cpu'), output_field = FloatField()),
+            memory = ExpressionWrapper(weighted('memory'), output_field = FloatField()),
+            memory_max = Max('memory_max'),
+            net = Sum('net_rx') + Sum('net_tx'),
+            blk = Sum('blk_read') + Sum('blk_write'),
+        ).order_by('-memory')
+        return [ dict(row, group = row[field]) for row in rows ]
 
 @admin.register(ContainerEnvironment)
 class ContainerEnvironmentAdmin(admin.ModelAdmin):
@@ -58,7 +138,7 @@ class CourseContainerBindingAdmin(admin.ModelAdmin):
 
 @admin.register(Course)
 class CourseAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'folder', 'description', 'image')
+    list_display = ('id', 'name', 'folder', 'description', 'image', 'mem_limit', 'cpu_limit', 'idle_timeout')
 
 @admin.register(UserCourseCodeBinding)
 class UserCourseCodeBindingAdmin(admin.ModelAdmin):
@@ -134,11 +214,11 @@ class VolumeContainerBindingAdmin(admin.ModelAdmin):
 
 @admin.register(Image)
 class ImageAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name')
+    list_display = ('id', 'name', 'present', 'warmpool_size', 'mem_limit', 'cpu_limit', 'idle_timeout')
 
 @admin.register(Group)
 class GroupAdmin(admin.ModelAdmin):
-    list_display = ('id', 'groupid', 'name' )
+    list_display = ('id', 'groupid', 'name', 'project', 'course', 'role', 'is_active' )
 
 @admin.register(UserGroupBinding)
 class UserGroupBindingAdmin(admin.ModelAdmin):
@@ -0,0 +1,39 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hub.models import Group, Project, UserProjectBinding, Course, UserCourseBinding
+from kooplex.lib.filesystem import grantacl_rolegroup, rolegroup_folders
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Convert the per-user ACLs of project shares and course folders to role group ACLs and ldap group memberships'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry', help = "Dry run: list the role groups and their members, and do not touch ldap or the filesystem", action = "store_true")
+
+    def handle(self, *args, **options):
+        logger.info("call %s %s" % (args, options))
+        plan = []
+        for project in Project.objects.all():
+            users = [ b.user for b in UserProjectBinding.objects.filter(project = project).select_related('user__profile') ]
+            plan.append(({ 'project': project }, users))
+        for course in Course.objects.all():
+            bindings = UserCourseBinding.objects.filter(course = course).select_related('user__profile')
+            plan.append(({ 'course': course, 'role': Group.RL_TEACHER }, [ b.user for b in bindings if b.is_teacher ]))
+            plan.append(({ 'course': course, 'role': Group.RL_STUDENT }, [ b.user for b in bindings if not b.is_teacher ]))
+        for kw, users in plan:
+            if not users:
+                continue
+            if options['dry']:
+                print ("%s: %s" % (kw, ", ".join([ u.username for u in users ])))
+                continue
+            uids = [ u.profile.userid for u in users ]
+            # a new group grants itself and drops the per-user entries in a single walk
+            group, created = Group.get_or_create_rolegroup(revoke_uids = uids, **kw)
+            if not created:
+                grantacl_rolegroup(group, revoke_uids = uids)
+            for user in users:
+                group.bind(user)
+            logger.info("%s: %d members migrated in %s" % (group, len(users), [ f for f, _ in rolegroup_folders(group) ]))
@@ -0,0 +1,39 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hub.models import ArchiveJob
+from kooplex.lib.archivequeue import archive, queued_jobs
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Compress the folders of queued archive jobs with a pool of background workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', help = "Number of folders to archive concurrently", type = int, default = 2)
+        parser.add_argument('--poll', help = "Seconds to wait between polling the job queue (default: 5)", type = float, default = 5.)
+        parser.add_argument('--once', help = "Process the queue and exit", action = "store_true")
+
+    def handle(self, *args, **options):
+        logger.info("call %s %s" % (args, options))
+        # jobs interrupted by a previous run of the worker
+        n = ArchiveJob.objects.filter(state = ArchiveJob.ST_RUNNING).update(state = ArchiveJob.ST_QUEUED)
+        if n:
+            logger.warning("%d interrupted archive jobs queued again" % n)
+        workers = options['workers']
+        running = set()
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            while True:
+                running = set([ f for f in running if not f.done() ])
+                free = workers - len(running)
+                if free > 0:
+                    for job in queued_jobs(free):
+                        if job.claim():
+                            logger.debug("picked up %s" % job)
+                            running.add(pool.submit(archive, job))
+                if options['once'] and not running and not ArchiveJob.objects.filter(state = ArchiveJob.ST_QUEUED).exists():
+                    break
+                time.sleep(options['poll'])
@@ -0,0 +1,35 @@
+import time
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hub.models import ContainerResourceSample
+from kooplex.settings import KOOPLEX
+from kooplex.lib.resourceusage import Collector
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Sample the resource usage of running containers and downsample the time series'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry', help = "Dry run: print the samples, and do not store them", action = "store_true")
+        parser.add_argument('--interval', help = "Seconds between samples, 0 to take a single sample and exit", type = float, default = KOOPLEX.get('stats', {}).get('interval', 60))
+        parser.add_argument('--workers', help = "Number of containers to query concurrently", type = int, default = None)
+
+    def handle(self, *args, **options):
+        logger.info("call %s %s" % (args, options))
+        collector = Collector(workers = options['workers'])
+        while True:
+            t0 = time.time()
+            samples = collector.collect()
+            if options['dry']:
+                for s in samples:
+                    print ("%s cpu %.2f memory %.0f MB net %d/%d blk %d/%d" % (s.container, s.cpu, s.memory, s.net_rx, s.net_tx, s.blk_read, s.blk_write))
+            else:
+                ContainerResourceSample.objects.bulk_create(samples, batch_size = 1000)
+                n = ContainerResourceSample.downsample()
+                logger.info("%d samples stored, %d aggregates created in %.1f s" % (len(samples), n, time.time() - t0))
+            if options['interval'] <= 0:
+                break
+            time.sleep(max(options['interval'] - (time.time() - t0), 0))
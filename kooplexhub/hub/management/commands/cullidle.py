@@ -0,0 +1,28 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kooplex.lib.culler import Culler
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Pause idle containers, and stop those idle for longer than the threshold of their image or course'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry', help = "Dry run: list idle containers, and do not actually stop them", action = "store_true")
+        parser.add_argument('--nopause', help = "Skip the pause tier, stop idle containers right away", action = "store_true")
+        parser.add_argument('--remove', help = "Remove idle containers after stopping them", action = "store_true")
+        parser.add_argument('--workers', help = "Number of concurrent requests and container stops", type = int, default = None)
+        parser.add_argument('--timeout', help = "Seconds to wait for a notebook server to report its activity", type = float, default = None)
+
+    def handle(self, *args, **options):
+        logger.info("call %s %s" % (args, options))
+        culler = Culler(workers = options['workers'], timeout = options['timeout'], pause = not options['nopause'])
+        idle = culler.idle_containers()
+        for container, minutes, threshold, action in idle:
+            print ("%s idle for %d minutes (threshold %d): %s" % (container, minutes, threshold, action))
+        if options['dry']:
+            return
+        n = culler.cull_all(idle, remove = options['remove'])
+        logger.info("%d of %d idle containers culled" % (n, len(idle)))
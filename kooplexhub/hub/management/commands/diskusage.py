@@ -0,0 +1,20 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kooplex.lib.diskusage import index
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Index the disk usage of homes, project folders, courses and reports, and warn about soft quotas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry', help = "Dry run: print the rollups, and do not store them", action = "store_true")
+        parser.add_argument('--full', help = "Ignore the cache and stat every file", action = "store_true")
+
+    def handle(self, *args, **options):
+        logger.info("call %s %s" % (args, options))
+        over = index(full = options['full'], dry = options['dry'])
+        for usage in over:
+            print ("%s is over its soft quota of %d MB" % (usage, usage.quota))
@@ -0,0 +1,127 @@
+import time
+import queue
+import logging
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from hub.models import Container
+
+from kooplex.lib import Docker, now
+
+logger = logging.getLogger(__name__)
+
+# docker container event -> state in the hub
+EVENT_STATE = {
+    'create': Container.ST_NOTRUNNING,
+    'start': Container.ST_RUNNING,
+    'pause': Container.ST_PAUSED,
+    'unpause': Container.ST_RUNNING,
+    'die': Container.ST_NOTRUNNING,
+    'destroy': Container.ST_NOTPRESENT,
+}
+
+# docker container state as reported by a listing -> state in the hub
+DOCKER_STATE = {
+    'created': Container.ST_NOTRUNNING,
+    'running': Container.ST_RUNNING,
+    'paused': Container.ST_PAUSED,
+    'restarting': Container.ST_RUNNING,
+    'exited': Container.ST_NOTRUNNING,
+    'dead': Container.ST_NOTRUNNING,
+}
+
+class Command(BaseCommand):
+    help = 'Follow the docker events stream and keep container states in the database up to date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry', help = "Dry run: print state changes, and do not actually update the database", action = "store_true")
+        parser.add_argument('--interval', help = "Seconds to aggregate events before a bulk database update (default: 1)", type = float, default = 1.)
+        parser.add_argument('--once', help = "Synchronize states with a single listing and exit", action = "store_true")
+
+    def handle(self, *args, **options):
+        logger.info("call %s %s" % (args, options))
+        docker = Docker()
+        since = int(time.time())
+        self.synchronize(docker, options['dry'])
+        if options['once']:
+            return
+        events = queue.Queue()
+        readers = []
+        for engine in docker.engines:
+            reader = threading.Thread(target = self.read_events, args = (docker, engine, since, events), daemon = True)
+            reader.start()
+            readers.append(reader)
+        pending = {}
+        deadline = time.time() + options['interval']
+        while [ r for r in readers if r.is_alive() ] or not events.empty():
+            try:
+                engine, event = events.get(timeout = max(deadline - time.time(), 0))
+                self.collect(engine, event, pending)
+            except queue.Empty:
+                pass
+            if time.time() >= deadline:
+                self.apply(docker, pending, options['dry'])
+                pending = {}
+                deadline = time.time() + options['interval']
+        self.apply(docker, pending, options['dry'])
+        raise CommandError("docker events stream closed")
+
+    def read_events(self, docker, engine, since, events):
+        try:
+            # each thread needs its own connection to the engine
+            for event in Docker().events(since = since, engine = engine):
+                events.put((engine, event))
+        except Exception as e:
+            logger.error("docker events stream of engine %s broken -- %s" % (engine, e))
+
+    def collect(self, engine, event, pending):
+        action = event.get('Action', event.get('status', ''))
+        if not action in EVENT_STATE:
+            return
+        attributes = event.get('Actor', {}).get('Attributes', {})
+        name = attributes.get('name')
+        if name is None:
+            return
+        message = "docker event: %s" % action
+        if 'exitCode' in attributes:
+            message += " (exit code %s)" % attributes['exitCode']
+        # only the latest event per container matters
+        pending[(engine, name)] = (EVENT_STATE[action], message)
+
+    def synchronize(self, docker, dry):
+        pending = {}
+        for engine in docker.engines:
+            try:
+                states = docker.list_containerstates(engine)
+            except Exception as e:
+                logger.error("cannot list containers of engine %s -- %s" % (engine, e))
+                continue
+            for c in docker.containers_on(engine):
+                if c.name in states:
+                    state = DOCKER_STATE.get(states[c.name], Container.ST_NOTRUNNING)
+                    message = "docker state: %s" % states[c.name]
+                else:
+                    state = Container.ST_NOTPRESENT
+                    message = "docker state: missing"
+                if state != c.state:
+                    pending[(engine, c.name)] = (state, message)
+        self.apply(docker, pending, dry)
+
+    def apply(self, docker, pending, dry):
+        if not pending:
+            return
+        groups = {}
+        for (engine, name), (state, message) in pending.items():
+            groups.setdefault((engine, state, message), []).append(name)
+        for (engine, state, message), names in groups.items():
+            if dry:
+                for name in names:
+                    print ("%s@%s -> %s (%s)" % (name, engine, state, message))
+                continue
+            # NOTE: queryset update bypasses the pre_save signals, which would talk back to the docker engine
+            containers = docker.containers_on(engine).filter(name__in = names).exclude(state = state)
+            n = Container.objects.filter(id__in = list(containers.values_list('id', flat = True))).update(state = state, last_message = message, last_message_at = now())
+            logger.info("%d containers set to %s -- %s" % (n, state, message))
+        connection.close()
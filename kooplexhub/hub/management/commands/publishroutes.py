@@ -0,0 +1,33 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kooplex.lib import routemap
+from kooplex.lib.proxy import desired_routes
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Regenerate the routing map file of running containers and reports in a single step'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry', help = "Dry run: print the differences to the published routing map, and do not write it", action = "store_true")
+
+    def handle(self, *args, **options):
+        logger.info("call %s %s" % (args, options))
+        routes = desired_routes()
+        version, published = routemap.read()
+        added = [ path for path in routes if not path in published ]
+        changed = [ path for path in routes if path in published and published[path] != routes[path] ]
+        removed = [ path for path in published if not path in routes ]
+        if options['dry']:
+            for path in sorted(added):
+                print ("+ %s --> %s" % (path, routes[path]))
+            for path in sorted(changed):
+                print ("~ %s --> %s [was %s]" % (path, routes[path], published[path]))
+            for path in sorted(removed):
+                print ("- %s" % path)
+            print ("version %d: %d to add, %d to change, %d to remove" % (version, len(added), len(changed), len(removed)))
+            return
+        version = routemap.publish(routes)
+        print ("version %d published: %d routes, %d added, %d changed, %d removed" % (version, len(routes), len(added), len(changed), len(removed)))
@@ -6,7 +6,7 @@ from django.core.management.base import BaseCommand, CommandError
 
 from hub.models import Container, Report
 
-from kooplex.lib.proxy import getroutes, addroute, droproutes
+from kooplex.lib.proxy import getroutes, addroute, droproutes, diff_routes, reconcile_routes
 from kooplex.settings import KOOPLEX
 
 logger = logging.getLogger(__name__)
@@ -16,9 +16,13 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--dry', help = "Dry run: list proxy tergets to load", action = "store_true")
+        parser.add_argument('--reconcile', help = "Only add, change and delete the routes that differ from the desired routing table, nobody gets disconnected", action = "store_true")
+        parser.add_argument('--workers', help = "Number of concurrent route changes in reconcile mode", type = int, default = 16)
     
     def handle(self, *args, **options):
         logger.info("call %s %s" % (args, options))
+        if options['reconcile']:
+            return self.handle_reconcile(options['dry'], options['workers'])
         if options['dry']:
             print ("dry run")
             resp = getroutes()
@@ -40,3 +44,18 @@ class Command(BaseCommand):
             else:
                 addroute(r)
 
+
+    def handle_reconcile(self, dry, workers):
+        if dry:
+            add, change, delete = diff_routes()
+        else:
+            add, change, delete, n_failed = reconcile_routes(workers = workers)
+        for path, (_, target) in sorted(add.items()):
+            print ("+ %s --> %s" % (path, target))
+        for path, (old, target) in sorted(change.items()):
+            print ("~ %s --> %s [was %s]" % (path, target, old))
+        for path in sorted(delete):
+            print ("- %s" % path)
+        print ("%d to add, %d to change, %d to delete" % (len(add), len(change), len(delete)))
+        if not dry and n_failed:
+            raise CommandError("%d route changes failed" % n_failed)
@@ -0,0 +1,66 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kooplex.settings import KOOPLEX
+from hub.models import Container
+from kooplex.lib import Docker
+from kooplex.lib.admission import Admission
+from kooplex.lib.spawner import spawn, queued_jobs
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Start queued containers with a pool of background workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', help = "Number of containers to start concurrently", type = int, default = KOOPLEX.get('spawner', {}).get('workers', 8))
+        parser.add_argument('--poll', help = "Seconds to wait between polling the job queue (default: .5)", type = float, default = .5)
+    
+    def handle(self, *args, **options):
+        logger.info("call %s %s" % (args, options))
+        workers = options['workers']
+        running = set()
+        docker = Docker()
+        admissions = {}
+        # jobs placed by this loop, the persisted engine is reused until they are claimed
+        placed = set()
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            while True:
+                running = set([ f for f in running if not f.done() ])
+                free = workers - len(running)
+                blocked = set()
+                jobs = list(queued_jobs()) if free > 0 else []
+                if free > 0:
+                    placed.intersection_update([ job.id for job in jobs ])
+                for job in jobs:
+                    if free == 0:
+                        break
+                    container = job.container
+                    if job.id in placed and container.engine in docker.engines:
+                        engine = container.engine
+                    else:
+                        engine = docker.place(container)
+                        # recorded for the bookkeeping of the engine and the queue position of the job
+                        Container.objects.filter(id = container.id).update(engine = engine)
+                        placed.add(job.id)
+                    if engine in blocked:
+                        continue
+                    if not engine in admissions:
+                        admissions[engine] = Admission(docker, engine)
+                    admission = admissions[engine]
+                    if not admission.admit(container):
+                        if admission.mode == 'reject':
+                            if job.claim():
+                                job.set_phase(job.PH_FAILED, 'Rejected, the compute node is at its capacity')
+                            continue
+                        # keep the order of the queue of this engine, the others may go on
+                        blocked.add(engine)
+                        continue
+                    if job.claim():
+                        logger.debug("picked up %s on %s" % (job, engine))
+                        running.add(pool.submit(spawn, job, engine))
+                        free -= 1
+                time.sleep(options['poll'])
@@ -0,0 +1,43 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from hub.models import Image
+
+from kooplex.lib import Docker
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Top up the pools of pre-created containers of each image on each docker engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry', help = "Dry run: list pool sizes and do not create or remove containers", action = "store_true")
+    
+    def handle(self, *args, **options):
+        logger.info("call %s %s" % (args, options))
+        docker = Docker()
+        for engine in docker.engines:
+            for image in Image.objects.all():
+                self.topup(docker, engine, image, options['dry'])
+
+    def topup(self, docker, engine, image, dry):
+        warm = list(docker.list_warmcontainers(image, engine))
+        target = image.warmpool_size if image.present else 0
+        if len(warm) == target:
+            return
+        print ("%s@%s: %d warm containers, target %d" % (image, engine, len(warm), target))
+        if dry:
+            return
+        for _ in range(len(warm), target):
+            try:
+                docker_id = docker.create_warmcontainer(image, engine)
+                logger.info("%s@%s: new warm container %s" % (image, engine, docker_id))
+            except Exception as e:
+                logger.error("%s@%s: cannot create warm container -- %s" % (image, engine, e))
+                print ("oops %s@%s -- %s" % (image, engine, e))
+                break
+        for item in warm[target:]:
+            try:
+                docker.remove_warmcontainer(item, engine)
+            except Exception as e:
+                logger.error("%s@%s: cannot remove warm container %s -- %s" % (image, engine, item['Names'], e))
@@ -3,7 +3,7 @@ from .group import Group, UserGroupBinding
 
 from .image import Image
 from .volume import Volume, VolumeOwnerBinding, ExtraFields, UserPrivilegeVolumeBinding, VolumeProjectBinding
-from .container import Container, ContainerEnvironment, ProjectContainerBinding, CourseContainerBinding, VolumeContainerBinding, ReportContainerBinding
+from .container import Container, ContainerEnvironment, ProjectContainerBinding, CourseContainerBinding, VolumeContainerBinding, ReportContainerBinding, SpawnJob
 
 from .versioncontrol import VCRepository, VCToken, VCProject, VCProjectProjectBinding
 from .filesync import FSServer, FSToken, FSLibrary, FSLibraryProjectBinding
@@ -15,4 +15,9 @@ from .report import Report
 from .course import CourseCode, Course, UserCourseBinding, UserCourseCodeBinding
 from .assignment import Assignment, UserAssignmentBinding
 
+from .resourceusage import ContainerResourceSample
+from .archivejob import ArchiveJob
+from .diskusage import DiskUsage
+from .mountplan import ContainerMountPlan
+
 
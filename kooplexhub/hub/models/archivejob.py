@@ -0,0 +1,56 @@
+import logging
+
+from django.db import models
+from django.utils import timezone
+
+from kooplex.lib import now
+
+logger = logging.getLogger(__name__)
+
+ST_LOOKUP = {
+    'queued': 'Waiting for an archiver worker.',
+    'running': 'Compressing the folder.',
+    'done': 'Archive is written, the folder is removed.',
+    'failed': 'Archiving failed, the folder is kept in the pending area.',
+}
+
+class ArchiveJob(models.Model):
+    ST_QUEUED = 'queued'
+    ST_RUNNING = 'running'
+    ST_DONE = 'done'
+    ST_FAILED = 'failed'
+    STATE_LIST = [ ST_QUEUED, ST_RUNNING, ST_DONE, ST_FAILED ]
+
+    folder = models.CharField(max_length = 512, null = False, help_text = 'the original location')
+    pending = models.CharField(max_length = 512, null = False, help_text = 'the folder renamed in the pending area')
+    target = models.CharField(max_length = 512, null = False)
+    state = models.CharField(max_length = 16, choices = [ (x, ST_LOOKUP[x]) for x in STATE_LIST ], default = ST_QUEUED)
+    message = models.CharField(max_length = 512, null = True, blank = True)
+    bytes_in = models.BigIntegerField(null = True, blank = True)
+    bytes_out = models.BigIntegerField(null = True, blank = True)
+    created_at = models.DateTimeField(default = timezone.now)
+    started_at = models.DateTimeField(null = True, blank = True)
+    finished_at = models.DateTimeField(null = True, blank = True)
+
+    def __str__(self):
+        return "<ArchiveJob %s: %s>" % (self.folder, self.state)
+
+    def claim(self):
+        """
+        @summary: make sure only one worker picks up the job
+        @returns: whether the job was still queued
+        """
+        n = ArchiveJob.objects.filter(id = self.id, state = self.ST_QUEUED).update(state = self.ST_RUNNING, started_at = now())
+        if n:
+            self.state = self.ST_RUNNING
+        return n == 1
+
+    def set_state(self, state, message = None, **kw):
+        self.state = state
+        self.message = message
+        for attr, value in kw.items():
+            setattr(self, attr, value)
+        if state in [ self.ST_DONE, self.ST_FAILED ]:
+            self.finished_at = now()
+        self.save()
+        logger.debug(self)
@@ -36,11 +36,11 @@ class Assignment(models.Model):
         return standardize_str(self.name)
 
     def list_students_bindable(self):
+        bound = UserAssignmentBinding.objects.filter(assignment = self).values_list('user_id', flat = True)
+        bindings = UserCourseCodeBinding.objects.filter(coursecode = self.coursecode, is_teacher = False).exclude(user_id__in = list(bound)).select_related('user__profile')
         students = []
-        for usercoursecodebinding in UserCourseCodeBinding.objects.filter(coursecode = self.coursecode, is_teacher = False):
-            try:
-                UserAssignmentBinding.objects.get(assignment = self, user = usercoursecodebinding.user)
-            except UserAssignmentBinding.DoesNotExist:
+        for usercoursecodebinding in bindings:
+            if not usercoursecodebinding.user in students:
                 students.append(usercoursecodebinding.user)
         return students
 
@@ -59,9 +59,13 @@ class Assignment(models.Model):
                 yield a
 
     def bind_students(self):
+        from kooplex.lib.filesystem import handout_assignment
         student_list = self.list_students_bindable()
+        bindings = [ UserAssignmentBinding(user = student, assignment = self, expires_at = self.expires_at) for student in student_list ]
+        # bulk_create does not send post_save, the snapshot is handed out to all the students in parallel
+        UserAssignmentBinding.objects.bulk_create(bindings)
+        handout_assignment(self, bindings)
         for student in student_list:
-            UserAssignmentBinding.objects.create(user = student, assignment = self, expires_at = self.expires_at)
             logger.info("handout %s -> %s" % (self, student))
         return student_list
 
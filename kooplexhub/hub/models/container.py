@@ -29,23 +29,28 @@ ST_LOOKUP = {
     'np': 'Not present in docker engine.',
     'man': 'Manifested but not running.',
     'run': 'Running in docker engine.',
+    'pau': 'Paused in docker engine.',
 }
 
 class Container(models.Model):
     ST_NOTPRESENT = 'np'
     ST_NOTRUNNING = 'man'
     ST_RUNNING = 'run'
-    STATE_LIST = [ ST_NOTPRESENT, ST_NOTRUNNING, ST_RUNNING ]
+    ST_PAUSED = 'pau'
+    STATE_LIST = [ ST_NOTPRESENT, ST_NOTRUNNING, ST_RUNNING, ST_PAUSED ]
 
     name = models.CharField(max_length = 200, null = False)
     user = models.ForeignKey(User, null = False)
     image = models.ForeignKey(Image, null = True)
     launched_at = models.DateTimeField(default = timezone.now)
     marked_to_remove = models.BooleanField(default = False)
+    docker_id = models.CharField(max_length = 64, null = True, default = None)
+    engine = models.CharField(max_length = 64, null = True, default = None)
 
     state = models.CharField(max_length = 16, choices = [ (x, ST_LOOKUP[x]) for x in STATE_LIST ], default = ST_NOTPRESENT)
     last_message = models.CharField(max_length = 512, null = True)
     last_message_at = models.DateTimeField(default = None, null = True)
+    paused_at = models.DateTimeField(default = None, null = True)
 
 
     def __lt__(self, c):
@@ -66,19 +71,29 @@ class Container(models.Model):
     def is_stopped(self):
         return self.state == self.ST_NOTRUNNING
 
+    @property
+    def is_paused(self):
+        return self.state == self.ST_PAUSED
+
     @property
     def uptime(self):
         timenow = now()
         delta = timenow - self.launched_at
         return delta if self.is_running else -1
 
+    def _target(self, port):
+        dockerconf = KOOPLEX.get('docker', {})
+        engineconf = dockerconf.get('engines', {}).get(self.engine or dockerconf.get('default_engine'), {})
+        info = { 'containername': self.name, 'port': port }
+        return engineconf.get('pattern_target', 'http://%(containername)s:%(port)d') % info
+
     @property
     def url(self):
-        return "http://%s:%d" % (self.name, KOOPLEX.get('spawner', {}).get('port', 8000))
+        return self._target(KOOPLEX.get('spawner', {}).get('port', 8000))
 
     @property
     def url_test(self):
-        return "http://%s:%d" % (self.name, KOOPLEX.get('spawner', {}).get('port_test', 9000))
+        return self._target(KOOPLEX.get('spawner', {}).get('port_test', 9000))
 
     @property
     def url_external(self):
@@ -169,9 +184,45 @@ class Container(models.Model):
         for volume in VolumeContainerBinding.list_containervolumes(container = self):
             yield volume
 
+    @property
+    def resource_limits(self):
+        """
+        @summary: the memory (MB) and cpu (cores) limits of the container, course settings override image settings, which override the defaults
+        """
+        return Container.get_resource_limits(self.image, self.course)
+
+    @staticmethod
+    def get_resource_limits(image, course):
+        dockerconf = KOOPLEX.get('docker', {})
+        mem_limit = dockerconf.get('mem_limit', 2048)
+        cpu_limit = dockerconf.get('cpu_limit', 1.)
+        for source in [ image, course ]:
+            if source is None:
+                continue
+            if source.mem_limit:
+                mem_limit = source.mem_limit
+            if source.cpu_limit:
+                cpu_limit = source.cpu_limit
+        return mem_limit, cpu_limit
+
+    @property
+    def idle_timeout(self):
+        """
+        @summary: the minutes of inactivity after which the culler stops the container
+        """
+        return Container.get_idle_timeout(self.image, self.course)
+
+    @staticmethod
+    def get_idle_timeout(image, course):
+        idle_timeout = KOOPLEX.get('culler', {}).get('idle_timeout', 24 * 60)
+        for source in [ image, course ]:
+            if source is not None and source.idle_timeout:
+                idle_timeout = source.idle_timeout
+        return idle_timeout
+
     def wait_until_ready(self):
-        from kooplex.lib import keeptrying
-        return keeptrying(method = requests.get, times = 10, url = self.api)
+        from kooplex.lib.retry import get_policy
+        return get_policy('notebook').call(requests.get, url = self.api)
 
     @property
     def n_projects(self):
@@ -236,10 +287,34 @@ class Container(models.Model):
         self.state = self.ST_RUNNING
         self.save()
 
+    def docker_start_async(self):
+        """
+        @summary: hand over starting the container to the spawner workers, a paused container is resumed right away
+        @returns: the spawn job, or None if the container is already running
+        """
+        if self.is_running:
+            return None
+        if self.is_paused:
+            self.docker_start()
+            return None
+        return SpawnJob.submit(self)
+
+    @property
+    def spawnjob(self):
+        return SpawnJob.objects.filter(container = self).order_by('-created_at').first()
+
+    @property
+    def is_spawning(self):
+        return SpawnJob.objects.filter(container = self, phase__in = SpawnJob.PHASE_ACTIVE).exists()
+
     def docker_stop(self):
         self.state = self.ST_NOTRUNNING
         self.save()
 
+    def docker_pause(self):
+        self.state = self.ST_PAUSED
+        self.save()
+
     def docker_remove(self):
         self.state = self.ST_NOTPRESENT
         self.save()
@@ -273,26 +348,8 @@ class Container(models.Model):
         return os.path.join(self.url, 'notebook', self.proxy_path)
 
     def managemount(self):
-        import threading
-        if hasattr(self, '_timer'):
-            logger.debug("still aggregating...")
-            return
-        else:
-            logger.debug("bla")
-            self._timer = threading.Timer(1, self._managemount)
-            self._timer.start()
-            logger.debug("Aggregating timer started.")
-
-    def _managemount(self):
-        from kooplex.lib import Docker
-        try: 
-            logger.debug("Aggregating timer expired.")
-            assert self.is_created, "%s is not manifested in docker engine"
-            Docker().managemount(self)
-        except Exception as e: 
-            logger.error("cannot manage mapping in container %s -- %s" % (self, e)) 
-        finally:
-            del self._timer
+        from kooplex.lib.coalescer import mount_coalescer
+        mount_coalescer.request(self)
 
     def refresh_state(self):
         from kooplex.lib import Docker 
@@ -301,6 +358,78 @@ class Container(models.Model):
         except TypeError:
             pass
 
+PH_LOOKUP = {
+    'queued': 'Waiting for a spawner worker.',
+    'creating': 'Creating the container in docker engine.',
+    'starting': 'Starting the container.',
+    'routing': 'Registering the container in the proxy.',
+    'ready': 'Container is running.',
+    'failed': 'Container failed to start.',
+}
+
+class SpawnJob(models.Model):
+    PH_QUEUED = 'queued'
+    PH_CREATING = 'creating'
+    PH_STARTING = 'starting'
+    PH_ROUTING = 'routing'
+    PH_READY = 'ready'
+    PH_FAILED = 'failed'
+    PHASE_LIST = [ PH_QUEUED, PH_CREATING, PH_STARTING, PH_ROUTING, PH_READY, PH_FAILED ]
+    PHASE_ACTIVE = [ PH_QUEUED, PH_CREATING, PH_STARTING, PH_ROUTING ]
+
+    container = models.ForeignKey(Container, null = False)
+    phase = models.CharField(max_length = 16, choices = [ (x, PH_LOOKUP[x]) for x in PHASE_LIST ], default = PH_QUEUED)
+    message = models.CharField(max_length = 512, null = True)
+    created_at = models.DateTimeField(default = timezone.now)
+    updated_at = models.DateTimeField(default = timezone.now)
+
+    def __str__(self):
+        return "<SpawnJob %s: %s>" % (self.container, self.phase)
+
+    @property
+    def is_active(self):
+        return self.phase in self.PHASE_ACTIVE
+
+    @staticmethod
+    def submit(container):
+        for job in SpawnJob.objects.filter(container = container, phase__in = SpawnJob.PHASE_ACTIVE):
+            logger.debug("%s is already in progress" % job)
+            return job
+        job = SpawnJob.objects.create(container = container)
+        logger.info("%s submitted" % job)
+        return job
+
+    def claim(self):
+        """
+        @summary: make sure only one worker picks up the job
+        @returns: whether the job was still queued
+        """
+        n = SpawnJob.objects.filter(id = self.id, phase = self.PH_QUEUED).update(phase = self.PH_CREATING, updated_at = now())
+        if n:
+            self.phase = self.PH_CREATING
+        return n == 1
+
+    @property
+    def position(self):
+        """
+        @summary: the position of a queued job in the queue of its engine, 1 is the next to start
+        """
+        if self.phase != self.PH_QUEUED:
+            return 0
+        jobs = SpawnJob.objects.filter(phase = self.PH_QUEUED, created_at__lte = self.created_at)
+        # the engine is recorded when the spawner tries to admit the job
+        if self.container.engine:
+            jobs = jobs.filter(container__engine = self.container.engine)
+        return jobs.count()
+
+    def set_phase(self, phase, message = None):
+        self.phase = phase
+        self.message = message
+        self.updated_at = now()
+        self.save()
+        logger.debug(self)
+
+
 class ContainerEnvironment(models.Model):
     name = models.CharField(max_length = 200, null = False)
     value = models.CharField(max_length = 200, null = False)
@@ -322,6 +451,12 @@ def container_state_change(sender, instance, **kwargs):
     docker = Docker()
     # FIXME
     #assert instance.n_projects > 0 or instance.course or instance.report or instance.state == Container.ST_NOTPRESENT, 'container %s with 0 projects' % instance
+    if old_instance.state == Container.ST_NOTPRESENT and instance.state == Container.ST_RUNNING:
+        docker.place(instance)
+    # a paused container holds on to its resources, resuming it needs no admission
+    if instance.state == Container.ST_RUNNING and old_instance.state != Container.ST_PAUSED:
+        from kooplex.lib.admission import Admission
+        assert Admission(docker, instance.engine).admit(instance), "The compute node is at its capacity, try again later"
     if old_instance.state == Container.ST_NOTPRESENT and instance.state == Container.ST_RUNNING:
         docker.run_container(instance)
         addroute(instance)
@@ -345,6 +480,30 @@ def container_state_change(sender, instance, **kwargs):
         removeroute(instance)
         docker.remove_container(instance)
         instance.marked_to_remove = False
+    elif old_instance.state == Container.ST_RUNNING and instance.state == Container.ST_PAUSED:
+        removeroute(instance)
+        docker.pause_container(instance)
+        instance.paused_at = now()
+    elif old_instance.state == Container.ST_PAUSED and instance.state == Container.ST_RUNNING:
+        docker.unpause_container(instance)
+        addroute(instance)
+        instance.paused_at = None
+    elif old_instance.state == Container.ST_PAUSED and instance.state == Container.ST_NOTRUNNING:
+        docker.unpause_container(instance)
+        docker.stop_container(instance)
+        instance.paused_at = None
+        if instance.marked_to_remove:
+            docker.remove_container(instance)
+            instance.marked_to_remove = False
+            instance.state = Container.ST_NOTPRESENT
+    elif old_instance.state == Container.ST_PAUSED and instance.state == Container.ST_NOTPRESENT:
+        docker.unpause_container(instance)
+        docker.stop_container(instance)
+        docker.remove_container(instance)
+        instance.paused_at = None
+        instance.marked_to_remove = False
+    elif instance.state == Container.ST_PAUSED:
+        raise AssertionError("Only a running container can be paused, %s is %s" % (instance, ST_LOOKUP[old_instance.state]))
     else:
          logger.critical(msg)
 
@@ -21,6 +21,9 @@ class Course(models.Model):
     folder = models.CharField(max_length = 64, null = False)
     description = models.TextField(max_length = 512, blank = True)
     image = models.ForeignKey(Image, null = True)
+    mem_limit = models.IntegerField(null = True, blank = True, default = None, help_text = 'MB')
+    cpu_limit = models.FloatField(null = True, blank = True, default = None, help_text = 'cores')
+    idle_timeout = models.IntegerField(null = True, blank = True, default = None, help_text = 'minutes')
 
     def __str__(self):
         #return "Course: %s" % self.name #FIXME: OperationalError at /admin/hub/course/31/change/ (1366, "Incorrect string value: '\\xC5\\xB1s\\xC3\\xA9g...' for column 'object_repr' at row 1")
@@ -310,22 +313,22 @@ def garbagedir_course(sender, instance, **kwargs):
 
 @receiver(post_save, sender = UserCourseBinding)
 def mkdir_usercourse(sender, instance, created, **kwargs):
-    from kooplex.lib.filesystem import mkdir_course_workdir, grantacl_course_workdir, grantacl_course_share
+    from kooplex.lib.filesystem import mkdir_course_workdir
+    from .group import Group
     if created:
-        grantacl_course_share(instance)
         mkdir_course_workdir(instance)
-        grantacl_course_workdir(instance)
-        if instance.is_teacher == False:
-            for binding in UserCourseBinding.objects.filter(course = instance.course, is_teacher = True):
-                grantacl_course_workdir(binding)
+        role = Group.RL_TEACHER if instance.is_teacher else Group.RL_STUDENT
+        Group.get_rolegroup(course = instance.course, role = role).bind(instance.user)
 
 
 @receiver(pre_delete, sender = UserCourseBinding)
 def movedir_usercourse(sender, instance, **kwargs):
-    from kooplex.lib.filesystem import archive_course_workdir, revokeacl_course_workdir, revokeacl_course_share
+    from kooplex.lib.filesystem import archive_course_workdir
+    from .group import Group
     archive_course_workdir(instance)
-    revokeacl_course_workdir(instance)
-    revokeacl_course_share(instance)
+    role = Group.RL_TEACHER if instance.is_teacher else Group.RL_STUDENT
+    for group in Group.objects.filter(course = instance.course, role = role):
+        group.unbind(instance.user)
 
 
 
@@ -0,0 +1,68 @@
+import hashlib
+import logging
+
+from django.db import models
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from .project import Project
+from .course import Course
+
+from kooplex.settings import KOOPLEX
+
+logger = logging.getLogger(__name__)
+
+KIND_LOOKUP = {
+    'home': 'Home folder of a user.',
+    'workdir': 'Private workdir of a user in a project.',
+    'share': 'Shared folder of a project.',
+    'course': 'Public and private folders of a course.',
+    'courseworkdir': 'Workdirs of the students of a course.',
+    'report': 'Published reports of a user.',
+}
+
+class DiskUsage(models.Model):
+    KD_HOME = 'home'
+    KD_WORKDIR = 'workdir'
+    KD_SHARE = 'share'
+    KD_COURSE = 'course'
+    KD_COURSEWORKDIR = 'courseworkdir'
+    KD_REPORT = 'report'
+    KIND_LIST = [ KD_HOME, KD_WORKDIR, KD_SHARE, KD_COURSE, KD_COURSEWORKDIR, KD_REPORT ]
+
+    kind = models.CharField(max_length = 16, choices = [ (x, KIND_LOOKUP[x]) for x in KIND_LIST ], null = False)
+    path = models.CharField(max_length = 512, null = False)
+    # a long path does not fit in an index key, its digest identifies the row
+    path_hash = models.CharField(max_length = 64, null = False, unique = True)
+    user = models.ForeignKey(User, null = True, blank = True)
+    project = models.ForeignKey(Project, null = True, blank = True)
+    course = models.ForeignKey(Course, null = True, blank = True)
+    size = models.BigIntegerField(default = 0, help_text = 'bytes allocated, hardlinked files are shared among their links')
+    files = models.BigIntegerField(default = 0)
+    measured_at = models.DateTimeField(default = timezone.now)
+
+    def __str__(self):
+        return "<DiskUsage %s: %.1f MB>" % (self.path, self.megabytes)
+
+    @staticmethod
+    def hash_path(path):
+        return hashlib.sha256(path.encode('utf8')).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.path_hash = DiskUsage.hash_path(self.path)
+        super(DiskUsage, self).save(*args, **kwargs)
+
+    @property
+    def megabytes(self):
+        return self.size / 1024. / 1024.
+
+    @property
+    def quota(self):
+        """
+        @summary: the soft quota in MB, None if there is no quota
+        """
+        return KOOPLEX.get('diskusage', {}).get('soft_quota', {}).get(self.kind)
+
+    @property
+    def over_quota(self):
+        return self.quota is not None and self.megabytes > self.quota
@@ -1,6 +1,6 @@
 import logging
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.db.models.signals import post_save, pre_delete, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
@@ -10,12 +10,65 @@ from kooplex.settings import KOOPLEX
 logger = logging.getLogger(__name__)
 
 class Group(models.Model):
-    groupid = models.IntegerField(null = False)
-    name = models.CharField(max_length = 32, null = False)
+    RL_MEMBER = 'member'
+    RL_TEACHER = 'teacher'
+    RL_STUDENT = 'student'
+    ROLE_LIST = [ RL_MEMBER, RL_TEACHER, RL_STUDENT ]
+
+    groupid = models.IntegerField(null = False, unique = True)
+    name = models.CharField(max_length = 32, null = False, unique = True)
+    project = models.ForeignKey('Project', null = True, blank = True, default = None)
+    course = models.ForeignKey('Course', null = True, blank = True, default = None)
+    role = models.CharField(max_length = 16, choices = [ (x, x) for x in ROLE_LIST ], null = True, blank = True, default = None)
+    is_active = models.BooleanField(default = True)
 
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def next_groupid():
+        last_gid = Group.objects.all().aggregate(models.Max('groupid'))['groupid__max']
+        return KOOPLEX.get('min_groupid', 10000) if last_gid is None else last_gid + 1
+
+    @staticmethod
+    def get_or_create_rolegroup(project = None, course = None, role = RL_MEMBER, revoke_uids = [], attempts = 5):
+        """
+        @summary: the group representing a role in a project or in a course, created on demand
+        @param revoke_uids: per-user acl entries the new group replaces, dropped in the same walk that grants the group
+        @returns: the group and whether it was created
+        """
+        assert (project is None) != (course is None), "Either a project or a course is expected"
+        name = "project-%d" % project.id if project else "course-%d-%s" % (course.id, role)
+        for attempt in range(attempts):
+            try:
+                return Group.objects.get(name = name), False
+            except Group.DoesNotExist:
+                pass
+            group = Group(name = name, groupid = Group.next_groupid(), project = project, course = course, role = role)
+            group.revoke_uids = revoke_uids
+            try:
+                # a concurrent caller may take the same gid or create the same group
+                with transaction.atomic():
+                    group.save()
+                logger.info("created group: %s" % group)
+                return group, True
+            except IntegrityError as e:
+                logger.warning("group %s gid %d clashes, attempt %d -- %s" % (name, group.groupid, attempt + 1, e))
+        raise IntegrityError("Cannot create group %s in %d attempts" % (name, attempts))
+
+    @staticmethod
+    def get_rolegroup(project = None, course = None, role = RL_MEMBER):
+        group, _ = Group.get_or_create_rolegroup(project = project, course = course, role = role)
+        return group
+
+    def bind(self, user):
+        binding, created = UserGroupBinding.objects.get_or_create(group = self, user = user)
+        return binding
+
+    def unbind(self, user):
+        for binding in UserGroupBinding.objects.filter(group = self, user = user):
+            binding.delete()
+
 class UserGroupBinding(models.Model):
     user = models.ForeignKey(User, null = False)
     group = models.ForeignKey(Group, null = False)
@@ -32,6 +85,12 @@ def ldap_create_group(sender, instance, created, **kwargs):
         except Exception as e:
             logger.error("cannot create group %s in ldap -- %s" % (instance, e))
 
+@receiver(post_save, sender = Group)
+def grantacl_group(sender, instance, created, **kwargs):
+    from kooplex.lib.filesystem import grantacl_rolegroup
+    if created and instance.role:
+        grantacl_rolegroup(instance, revoke_uids = getattr(instance, 'revoke_uids', []))
+
 @receiver(post_delete, sender = Group)
 def ldap_remove_group2(sender, instance, **kwargs):
     from kooplex.lib.ldap import Ldap
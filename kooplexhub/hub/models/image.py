@@ -10,6 +10,10 @@ class Image(models.Model):
     name = models.CharField(max_length = 32)
     present = models.BooleanField(default = True)
     description = models.CharField(max_length = 250, default="description missing")
+    warmpool_size = models.IntegerField(default = 0)
+    mem_limit = models.IntegerField(null = True, blank = True, default = None, help_text = 'MB')
+    cpu_limit = models.FloatField(null = True, blank = True, default = None, help_text = 'cores')
+    idle_timeout = models.IntegerField(null = True, blank = True, default = None, help_text = 'minutes')
 
     def __str__(self):
         return self.name
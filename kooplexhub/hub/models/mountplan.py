@@ -0,0 +1,151 @@
+import logging
+
+from django.db import models, transaction
+from django.utils import timezone
+from django.dispatch import receiver
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from .volume import Volume
+from .container import Container, ProjectContainerBinding, CourseContainerBinding, VolumeContainerBinding
+from .versioncontrol import VCProject, VCProjectProjectBinding
+from .filesync import FSLibrary, FSLibraryProjectBinding
+from .project import Project, UserProjectBinding
+from .course import UserCourseBinding
+from .assignment import UserAssignmentBinding
+
+from kooplex.lib import now
+
+logger = logging.getLogger(__name__)
+
+VOLUMES_PROJECT = [ Volume.SHARE, Volume.WORKDIR, Volume.GIT, Volume.FILESYNC ]
+VOLUMES_COURSE = [ Volume.COURSE_SHARE, Volume.COURSE_WORKDIR, Volume.COURSE_ASSIGNMENTDIR ]
+
+class ContainerMountPlan(models.Model):
+    """
+    @summary: the folders of a volume mounted in a container. The binding receivers only mark the affected rows stale,
+    they are recomputed when the mount configuration is written next time.
+    """
+    container = models.ForeignKey(Container, null = False)
+    volume = models.ForeignKey(Volume, null = False)
+    folders = models.TextField(null = True, blank = True, default = None, help_text = 'one folder per line, null if stale')
+    updated_at = models.DateTimeField(default = timezone.now)
+
+    class Meta:
+        unique_together = [ ('container', 'volume') ]
+
+    def __str__(self):
+        return "<ContainerMountPlan %s-%s>" % (self.container, self.volume)
+
+    @property
+    def is_stale(self):
+        return self.folders is None
+
+    @property
+    def folder_list(self):
+        return self.folders.split('\n') if self.folders else []
+
+    @staticmethod
+    def refresh(container, volumetypes = None):
+        """
+        @summary: compute and store the plan of a container
+        @param volumetypes: only recompute these types of volumes
+        @returns: the new rows
+        """
+        from kooplex.lib.fs_dirname import Dirname
+        timestamp = now()
+        rows = [ ContainerMountPlan(container = container, volume = volume, folders = '\n'.join(folders), updated_at = timestamp) for volume, folders in Dirname.container_mountplan(container, volumetypes) ]
+        with transaction.atomic():
+            old = ContainerMountPlan.objects.filter(container = container)
+            if volumetypes is not None:
+                old = old.filter(volume__volumetype__in = volumetypes)
+            old.delete()
+            ContainerMountPlan.objects.bulk_create(rows)
+        logger.debug("%s mount plan of %s is recomputed" % (container, volumetypes if volumetypes else 'all volumes'))
+        return rows
+
+    @staticmethod
+    def stored(container):
+        """
+        @summary: the plan of a container, the volumes bound without a row or with a stale row are recomputed
+        @returns: a list of (volume, list of folders)
+        """
+        bindings = list(VolumeContainerBinding.objects.filter(container = container).select_related('volume'))
+        rows = dict([ (row.volume_id, row) for row in ContainerMountPlan.objects.filter(container = container) ])
+        stale = set([ b.volume.volumetype for b in bindings if not b.volume_id in rows or rows[b.volume_id].is_stale ])
+        if stale:
+            rows.update([ (row.volume_id, row) for row in ContainerMountPlan.refresh(container, stale) ])
+        return [ (b.volume, rows[b.volume_id].folder_list) for b in bindings if b.volume_id in rows ]
+
+    @staticmethod
+    def invalidate(volumetypes, **container_filter):
+        """
+        @summary: mark the plans of the matching containers stale, deleting bindings can cascade so nothing is inserted here
+        """
+        n = ContainerMountPlan.objects.filter(volume__volumetype__in = volumetypes, **dict([ ('container__%s' % k, v) for k, v in container_filter.items() ])).update(folders = None)
+        logger.debug("%d mount plans %s stale, containers %s" % (n, volumetypes, container_filter))
+
+
+@receiver(post_delete, sender = VolumeContainerBinding)
+def mountplan_unbind_volume(sender, instance, **kwargs):
+    ContainerMountPlan.objects.filter(container_id = instance.container_id, volume_id = instance.volume_id).delete()
+
+@receiver(post_save, sender = ProjectContainerBinding)
+@receiver(post_delete, sender = ProjectContainerBinding)
+def mountplan_projectcontainerbinding(sender, instance, **kwargs):
+    ContainerMountPlan.invalidate(VOLUMES_PROJECT, id = instance.container_id)
+
+@receiver(post_save, sender = CourseContainerBinding)
+@receiver(post_delete, sender = CourseContainerBinding)
+def mountplan_coursecontainerbinding(sender, instance, **kwargs):
+    ContainerMountPlan.invalidate(VOLUMES_COURSE, id = instance.container_id)
+
+@receiver(post_save, sender = Project)
+def mountplan_project(sender, instance, created, **kwargs):
+    # a renamed project renames its share and the workdirs
+    if not created:
+        ContainerMountPlan.invalidate(VOLUMES_PROJECT, projectcontainerbinding__project_id = instance.id)
+
+@receiver(post_save, sender = UserProjectBinding)
+@receiver(post_delete, sender = UserProjectBinding)
+def mountplan_userprojectbinding(sender, instance, **kwargs):
+    # folder names depend on the creator, the version control folders served on the collaborators
+    ContainerMountPlan.invalidate(VOLUMES_PROJECT, projectcontainerbinding__project_id = instance.project_id)
+
+@receiver(post_save, sender = VCProjectProjectBinding)
+@receiver(post_delete, sender = VCProjectProjectBinding)
+def mountplan_vcprojectprojectbinding(sender, instance, **kwargs):
+    ContainerMountPlan.invalidate([ Volume.GIT ], projectcontainerbinding__project_id = instance.project_id)
+
+@receiver(post_save, sender = FSLibraryProjectBinding)
+@receiver(post_delete, sender = FSLibraryProjectBinding)
+def mountplan_fslibraryprojectbinding(sender, instance, **kwargs):
+    ContainerMountPlan.invalidate([ Volume.FILESYNC ], projectcontainerbinding__project_id = instance.project_id)
+
+@receiver(post_save, sender = VCProject)
+def mountplan_vcproject(sender, instance, created, **kwargs):
+    # cloning or removing the cache sets clone_folder
+    if not created:
+        ContainerMountPlan.invalidate([ Volume.GIT ], projectcontainerbinding__project__vcprojectprojectbinding__vcproject_id = instance.id)
+
+@receiver(post_save, sender = FSLibrary)
+def mountplan_fslibrary(sender, instance, created, **kwargs):
+    # starting the synchronization sets sync_folder
+    if not created:
+        ContainerMountPlan.invalidate([ Volume.FILESYNC ], projectcontainerbinding__project__fslibraryprojectbinding__fslibrary_id = instance.id)
+
+@receiver(post_save, sender = UserCourseBinding)
+@receiver(post_delete, sender = UserCourseBinding)
+def mountplan_usercoursebinding(sender, instance, **kwargs):
+    ContainerMountPlan.invalidate(VOLUMES_COURSE, user_id = instance.user_id, coursecontainerbinding__course_id = instance.course_id)
+
+@receiver(pre_save, sender = UserAssignmentBinding)
+def mountplan_previous_corrector(sender, instance, **kwargs):
+    instance._corrector_id_old = UserAssignmentBinding.objects.filter(id = instance.id).values_list('corrector_id', flat = True).first() if instance.id else None
+
+@receiver(post_save, sender = UserAssignmentBinding)
+@receiver(post_delete, sender = UserAssignmentBinding)
+def mountplan_userassignmentbinding(sender, instance, **kwargs):
+    # the state or the corrector may have changed, the correction folders of the student and of the old and new correctors are recomputed
+    users = set([ instance.user_id, instance.corrector_id, getattr(instance, '_corrector_id_old', None) ])
+    users.discard(None)
+    ContainerMountPlan.invalidate([ Volume.COURSE_ASSIGNMENTDIR ], user_id__in = list(users), coursecontainerbinding__course__coursecode__assignment__id = instance.assignment_id)
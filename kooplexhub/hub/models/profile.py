@@ -44,6 +44,11 @@ class Profile(models.Model):
     def groupid(self):
         return KOOPLEX.get('ldap', {}).get('gid_users', 1000)
 
+    @property
+    def diskusage(self):
+        from .diskusage import DiskUsage
+        return DiskUsage.objects.filter(user = self.user).select_related('project').order_by('kind', 'path')
+
     @property
     def projectbindings(self):
         from .project import UserProjectBinding
@@ -39,13 +39,15 @@ class Project(models.Model):
     def __lt__(self, p):
         return self.name < p.name
 
+    _creator = None
     @property
     def creator(self):
-        try:
-            return UserProjectBinding.objects.get(project = self, role = UserProjectBinding.RL_CREATOR).user
-        except UserProjectBinding.DoesNotExist:
-            logger.warning('no creator for %s' % self)
-            return
+        if self._creator is None:
+            try:
+                self._creator = UserProjectBinding.objects.get(project = self, role = UserProjectBinding.RL_CREATOR).user
+            except UserProjectBinding.DoesNotExist:
+                logger.warning('no creator for %s' % self)
+        return self._creator
 
     @property
     def cleanname(self):
@@ -97,6 +99,11 @@ class Project(models.Model):
             if volume.volumetype == Volume.STORAGE:
                 yield volume
 
+    @property
+    def diskusage(self):
+        from .diskusage import DiskUsage
+        return DiskUsage.objects.filter(project = self).select_related('user').order_by('kind', 'path')
+
     @property
     def containers(self):
         from .container import ProjectContainerBinding
@@ -270,15 +277,14 @@ def garbagedir_share(sender, instance, **kwargs):
 
 
 @receiver(post_save, sender = UserProjectBinding)
-def grantaccess_share(sender, instance, created, **kwargs):
-    from kooplex.lib.filesystem import grantaccess_share
+def bind_projectgroup(sender, instance, created, **kwargs):
     if created:
-        grantaccess_share(instance)
+        Group.get_rolegroup(project = instance.project).bind(instance.user)
 
 @receiver(pre_delete, sender = UserProjectBinding)
-def revokeaccess_share(sender, instance, **kwargs):
-    from kooplex.lib.filesystem import revokeaccess_share
-    revokeaccess_share(instance)
+def unbind_projectgroup(sender, instance, **kwargs):
+    for group in Group.objects.filter(project = instance.project, role = Group.RL_MEMBER):
+        group.unbind(instance.user)
 
 
 @receiver(post_save, sender = UserProjectBinding)
@@ -0,0 +1,119 @@
+import logging
+import datetime
+
+from django.db import models
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+from .image import Image
+from .course import Course
+from .container import Container
+
+from kooplex.settings import KOOPLEX
+from kooplex.lib import now
+
+logger = logging.getLogger(__name__)
+
+
+RES_LOOKUP = {
+    'raw': 'Single measurement.',
+    '5min': 'Aggregate of 5 minutes.',
+    '1h': 'Aggregate of an hour.',
+}
+
+class ContainerResourceSample(models.Model):
+    RES_RAW = 'raw'
+    RES_5MIN = '5min'
+    RES_1H = '1h'
+    RESOLUTION_LIST = [ RES_RAW, RES_5MIN, RES_1H ]
+    # resolution -> (the finer resolution it aggregates, bucket seconds)
+    DOWNSAMPLING = [
+        (RES_5MIN, RES_RAW, 300),
+        (RES_1H, RES_5MIN, 3600),
+    ]
+
+    # the container may be gone, the user, image and course are kept to summarize the usage
+    container = models.ForeignKey(Container, null = True, on_delete = models.SET_NULL)
+    user = models.ForeignKey(User, null = False)
+    image = models.ForeignKey(Image, null = True, on_delete = models.SET_NULL)
+    course = models.ForeignKey(Course, null = True, on_delete = models.SET_NULL)
+    resolution = models.CharField(max_length = 8, choices = [ (x, RES_LOOKUP[x]) for x in RESOLUTION_LIST ], default = RES_RAW)
+    timestamp = models.DateTimeField(default = timezone.now, db_index = True)
+    n_samples = models.IntegerField(default = 1)
+    rolled_up = models.BooleanField(default = False)
+
+    cpu = models.FloatField(default = 0, help_text = 'cores, average')
+    memory = models.FloatField(default = 0, help_text = 'MB, average')
+    memory_max = models.FloatField(default = 0, help_text = 'MB, peak')
+    net_rx = models.BigIntegerField(default = 0, help_text = 'bytes received in the period')
+    net_tx = models.BigIntegerField(default = 0, help_text = 'bytes sent in the period')
+    blk_read = models.BigIntegerField(default = 0, help_text = 'bytes read in the period')
+    blk_write = models.BigIntegerField(default = 0, help_text = 'bytes written in the period')
+    # the cumulative counters reported by docker, the periodic values are their differences
+    counters = models.CharField(max_length = 128, null = True, blank = True)
+
+    class Meta:
+        index_together = [ ('resolution', 'rolled_up', 'timestamp') ]
+
+    def __str__(self):
+        return "<ContainerResourceSample %s@%s %s>" % (self.container_id, self.timestamp, self.resolution)
+
+    @staticmethod
+    def retention():
+        """
+        @summary: how long samples of each resolution are kept, None means forever
+        """
+        statsconf = KOOPLEX.get('stats', {})
+        return {
+            ContainerResourceSample.RES_RAW: datetime.timedelta(days = statsconf.get('keep_raw', 1)),
+            ContainerResourceSample.RES_5MIN: datetime.timedelta(days = statsconf.get('keep_5min', 30)),
+            ContainerResourceSample.RES_1H: None,
+        }
+
+    @staticmethod
+    def downsample():
+        """
+        @summary: aggregate the samples of completed buckets into the coarser resolutions, and drop the samples beyond retention
+        @returns: the number of new aggregated samples
+        """
+        n_created = 0
+        timenow = now()
+        for resolution, source, seconds in ContainerResourceSample.DOWNSAMPLING:
+            epoch = int(timenow.timestamp()) // seconds * seconds
+            complete = datetime.datetime.fromtimestamp(epoch, tz = timezone.utc)
+            pending = ContainerResourceSample.objects.filter(resolution = source, rolled_up = False, timestamp__lt = complete)
+            buckets = {}
+            ids = []
+            for s in pending.values('id', 'container_id', 'user_id', 'image_id', 'course_id', 'timestamp', 'n_samples', 'cpu', 'memory', 'memory_max', 'net_rx', 'net_tx', 'blk_read', 'blk_write'):
+                ids.append(s['id'])
+                start = int(s['timestamp'].timestamp()) // seconds * seconds
+                key = (s['container_id'], s['user_id'], s['image_id'], s['course_id'], start)
+                buckets.setdefault(key, []).append(s)
+            aggregates = []
+            for (container_id, user_id, image_id, course_id, start), samples in buckets.items():
+                n = sum([ s['n_samples'] for s in samples ])
+                aggregates.append(ContainerResourceSample(
+                    container_id = container_id, user_id = user_id, image_id = image_id, course_id = course_id,
+                    resolution = resolution,
+                    timestamp = datetime.datetime.fromtimestamp(start, tz = timezone.utc),
+                    n_samples = n,
+                    cpu = sum([ s['cpu'] * s['n_samples'] for s in samples ]) / n,
+                    memory = sum([ s['memory'] * s['n_samples'] for s in samples ]) / n,
+                    memory_max = max([ s['memory_max'] for s in samples ]),
+                    net_rx = sum([ s['net_rx'] for s in samples ]),
+                    net_tx = sum([ s['net_tx'] for s in samples ]),
+                    blk_read = sum([ s['blk_read'] for s in samples ]),
+                    blk_write = sum([ s['blk_write'] for s in samples ]),
+                ))
+            ContainerResourceSample.objects.bulk_create(aggregates, batch_size = 1000)
+            for i in range(0, len(ids), 1000):
+                ContainerResourceSample.objects.filter(id__in = ids[i:i + 1000]).update(rolled_up = True)
+            logger.debug("%d %s samples aggregated into %d %s samples" % (len(ids), source, len(aggregates), resolution))
+            n_created += len(aggregates)
+        for resolution, keep in ContainerResourceSample.retention().items():
+            if keep is None:
+                continue
+            # only the samples already aggregated may go
+            n, _ = ContainerResourceSample.objects.filter(resolution = resolution, rolled_up = True, timestamp__lt = timenow - keep).delete()
+            logger.debug("%d %s samples expired" % (n, resolution))
+        return n_created
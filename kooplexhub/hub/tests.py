@@ -1,3 +1,140 @@
+from contextlib import contextmanager
+
 from django.test import TestCase
+from django.contrib.auth.models import User
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+
+from hub.models import Profile, Project, UserProjectBinding, Volume
+from hub.models import Container, ProjectContainerBinding, VolumeContainerBinding, CourseContainerBinding
+from hub.models import Course, CourseCode, UserCourseBinding, Assignment, UserAssignmentBinding
+from hub.models import ContainerMountPlan
+from hub.models import VCRepository, VCToken, VCProject, VCProjectProjectBinding
+from hub.models import FSServer, FSToken, FSLibrary, FSLibraryProjectBinding
+from kooplex.lib import now
+from kooplex.lib.fs_dirname import Dirname
+
+@contextmanager
+def signals_muted():
+    """
+    @summary: the receivers talk to ldap, docker and the filesystem, fixtures are saved without them
+    """
+    signals = [ pre_save, post_save, pre_delete, post_delete ]
+    receivers = [ signal.receivers for signal in signals ]
+    for signal in signals:
+        signal.receivers = []
+        signal.sender_receivers_cache.clear()
+    try:
+        yield
+    finally:
+        for signal, saved in zip(signals, receivers):
+            signal.receivers = saved
+            signal.sender_receivers_cache.clear()
+
+
+class MountPlanTest(TestCase):
+    def setUp(self):
+        with signals_muted():
+            self.creator = self._user('creator', 20001)
+            self.user = self._user('student', 20002)
+            self.teacher = self._user('teacher', 20003)
+            self.volumes = dict([ (vt, Volume.objects.create(name = vt, displayname = vt, volumetype = vt)) for vt in [ Volume.HOME, Volume.SHARE, Volume.WORKDIR, Volume.GIT, Volume.FILESYNC, Volume.COURSE_ASSIGNMENTDIR ] ])
+            repository = VCRepository.objects.create(url = 'https://git.example.org')
+            server = FSServer.objects.create(url = 'https://sync.example.org')
+            self.vctokens = dict([ (u.id, VCToken.objects.create(user = u, repository = repository, username = u.username, token = 'x', fn_rsa = 'id_rsa')) for u in [ self.creator, self.user ] ])
+            self.fstokens = dict([ (u.id, FSToken.objects.create(user = u, syncserver = server, token = 'x')) for u in [ self.creator, self.user ] ])
+
+    def _user(self, username, userid):
+        user = User.objects.create(username = username, first_name = username, last_name = 'Test')
+        Profile.objects.create(user = user, userid = userid)
+        return user
+
+    def _container(self, user, n_projects):
+        with signals_muted():
+            container = Container.objects.create(name = "%s-%d" % (user.username, n_projects), user = user)
+            for vt in [ Volume.HOME, Volume.SHARE, Volume.WORKDIR, Volume.GIT, Volume.FILESYNC ]:
+                VolumeContainerBinding.objects.create(volume = self.volumes[vt], container = container)
+            for i in range(n_projects):
+                project = Project.objects.create(name = "project %d %d" % (n_projects, i))
+                UserProjectBinding.objects.create(user = self.creator, project = project, role = UserProjectBinding.RL_CREATOR)
+                UserProjectBinding.objects.create(user = user, project = project, role = UserProjectBinding.RL_COLLABORATOR)
+                ProjectContainerBinding.objects.create(project = project, container = container)
+                # the clone of the creator is served unless the user has an own one, every second project
+                owners = [ self.creator, user ] if i % 2 else [ self.creator ]
+                for owner in owners:
+                    VCProjectProjectBinding.objects.create(project = project, vcproject = self._vcproject(owner, project))
+                    FSLibraryProjectBinding.objects.create(project = project, fslibrary = self._fslibrary(owner, project))
+        return Container.objects.get(id = container.id)
+
+    def _vcproject(self, owner, project):
+        name = "%s-%d" % (owner.username, project.id)
+        return VCProject.objects.create(token = self.vctokens[owner.id], project_name = name, project_id = project.id, project_fullname = name, project_owner = owner.username, project_ssh_url = 'git@git.example.org:%s.git' % name, cloned = True, clone_folder = "clone-%s" % name)
+
+    def _fslibrary(self, owner, project):
+        name = "%s-%d" % (owner.username, project.id)
+        return FSLibrary.objects.create(token = self.fstokens[owner.id], library_name = name, library_id = name, sync_folder = "sync-%s" % name)
+
+    def _assignment(self, course, corrector, student):
+        coursecode = CourseCode.objects.create(courseid = "code-%s" % course.folder, course = course)
+        assignment = Assignment.objects.create(name = "hw %s" % course.folder, coursecode = coursecode, creator = corrector, description = '', folder = 'hw', valid_from = now())
+        return UserAssignmentBinding.objects.create(user = student, assignment = assignment, state = UserAssignmentBinding.ST_CORRECTING, corrector = corrector, submitted_at = now())
+
+    def test_projects_constant_queries(self):
+        for n_projects in [ 2, 6 ]:
+            container = self._container(self.user, n_projects)
+            # volumes, user, project bindings and their creators, version control bindings and creators, filesync bindings
+            with self.assertNumQueries(7):
+                plan = dict([ (volume.volumetype, folders) for volume, folders in Dirname.container_mountplan(container) ])
+            self.assertEqual(len(plan[Volume.SHARE]), n_projects)
+            self.assertEqual(len(plan[Volume.WORKDIR]), n_projects)
+            for folder in plan[Volume.SHARE]:
+                self.assertIn("/creator-project", folder)
+            # one clone per project, the own one where there is, only the own libraries
+            self.assertEqual(len(plan[Volume.GIT]), n_projects)
+            self.assertEqual(len([ f for f in plan[Volume.GIT] if "clone-student-" in f ]), n_projects // 2)
+            self.assertEqual(len(plan[Volume.FILESYNC]), n_projects // 2)
+            for folder in plan[Volume.FILESYNC]:
+                self.assertIn("sync-student-", folder)
+
+    def test_assignment_correction_folders(self):
+        with signals_muted():
+            course = Course.objects.create(name = 'Course', folder = 'course')
+            other = Course.objects.create(name = 'Other', folder = 'other')
+            UserCourseBinding.objects.create(user = self.teacher, course = course, is_teacher = True)
+            mine = self._assignment(course, self.teacher, self.user)
+            self._assignment(other, self.teacher, self.user)
+            self._assignment(course, self.creator, self.user)
+            container = Container.objects.create(name = 'teacher-course', user = self.teacher)
+            VolumeContainerBinding.objects.create(volume = self.volumes[Volume.COURSE_ASSIGNMENTDIR], container = container)
+            CourseContainerBinding.objects.create(course = course, container = container)
+        container = Container.objects.get(id = container.id)
+        # volumes, user course binding, user assignment bindings
+        with self.assertNumQueries(3):
+            plan = Dirname.container_mountplan(container)
+        self.assertEqual(plan[0][1], [ Dirname.assignmentcorrectdir(mine) ])
+
+    def test_stored_plan(self):
+        container = self._container(self.user, 5)
+        expected = [ (volume.id, folders) for volume, folders in Dirname.container_mountplan(container) ]
+        self.assertEqual([ (volume.id, folders) for volume, folders in ContainerMountPlan.stored(container) ], expected)
+        # volume bindings and the stored rows
+        with self.assertNumQueries(2):
+            plan = ContainerMountPlan.stored(container)
+        self.assertEqual([ (volume.id, folders) for volume, folders in plan ], expected)
+        ContainerMountPlan.invalidate([ Volume.SHARE ], id = container.id)
+        self.assertEqual(ContainerMountPlan.objects.filter(container = container, folders__isnull = True).count(), 1)
+        self.assertEqual([ (volume.id, folders) for volume, folders in ContainerMountPlan.stored(container) ], expected)
+        self.assertFalse(ContainerMountPlan.objects.filter(container = container, folders__isnull = True).exists())
 
-# Create your tests here.
+    def test_stored_plan_follows_clone_and_sync_folders(self):
+        container = self._container(self.user, 2)
+        ContainerMountPlan.stored(container)
+        vcproject = VCProject.objects.get(token__user = self.user)
+        vcproject.clone_folder = 'clone-moved'
+        vcproject.save()
+        fslibrary = FSLibrary.objects.get(token__user = self.user)
+        fslibrary.sync_folder = 'sync-moved'
+        fslibrary.save()
+        plan = dict([ (volume.volumetype, folders) for volume, folders in ContainerMountPlan.stored(container) ])
+        self.assertIn(Dirname.vcpcache(vcproject), plan[Volume.GIT])
+        self.assertEqual(plan[Volume.FILESYNC], [ Dirname.fscache(fslibrary) ])
+        self.assertEqual(plan, dict([ (volume.volumetype, folders) for volume, folders in Dirname.container_mountplan(container) ]))
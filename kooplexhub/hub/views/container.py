@@ -5,6 +5,7 @@ from django.conf.urls import url
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.shortcuts import render, redirect
+from django.http import JsonResponse
 import django_tables2 as tables
 from django_tables2 import RequestConfig
 
@@ -64,7 +65,11 @@ def startprojectcontainer(request, project_id, next_page):
     user = request.user
     try:
         container = Container.get_userprojectcontainer(user = user, project_id = project_id, create = True)
-        container.docker_start()
+        job = container.docker_start_async()
+        if job is not None and job.position > 1:
+            messages.warning(request, 'Container %s is queued at position %d, the compute node is busy' % (container.name, job.position))
+        else:
+            messages.info(request, 'Container %s is being started' % container.name)
         showpass(request, container)
     except Container.DoesNotExist:
         messages.error(request, 'Project does not exist')
@@ -81,7 +86,11 @@ def startcoursecontainer(request, course_id, next_page):
     container = None
     try:
         container = Container.get_usercoursecontainer(user = user, course_id = course_id, create = True)
-        container.docker_start()
+        job = container.docker_start_async()
+        if job is not None and job.position > 1:
+            messages.warning(request, 'Container %s is queued at position %d, the compute node is busy' % (container.name, job.position))
+        else:
+            messages.info(request, 'Container %s is being started' % container.name)
         showpass(request, container)
     except Container.DoesNotExist:
         messages.error(request, 'Course does not exist')
@@ -97,7 +106,11 @@ def startcontainer(request, container_id, next_page):
     user = request.user
     try:
         container = Container.objects.get(user = user, id = container_id)
-        container.docker_start()
+        job = container.docker_start_async()
+        if job is not None and job.position > 1:
+            messages.warning(request, 'Container %s is queued at position %d, the compute node is busy' % (container.name, job.position))
+        else:
+            messages.info(request, 'Container %s is being started' % container.name)
         showpass(request, container)
     except Container.DoesNotExist:
         messages.error(request, 'Container does not exist')
@@ -107,6 +120,31 @@ def startcontainer(request, container_id, next_page):
     return redirect(next_page)
 
 
+@login_required
+def containerstatus(request, container_id):
+    """Reports the progress of starting a container"""
+    user = request.user
+    try:
+        container = Container.objects.get(user = user, id = container_id)
+    except Container.DoesNotExist:
+        return JsonResponse({ 'error': 'Container does not exist' }, status = 404)
+    status = {
+        'id': container.id,
+        'state': container.state,
+        'phase': None,
+        'message': container.last_message,
+    }
+    job = container.spawnjob
+    if job is not None:
+        status.update({
+            'phase': job.phase,
+            'position': job.position,
+            'message': job.message if job.message else job.get_phase_display(),
+            'updated_at': job.updated_at.isoformat(),
+        })
+    return JsonResponse(status)
+
+
 @login_required
 def opencontainer(request, container_id, next_page):
     """Opens a container"""
@@ -120,12 +158,27 @@ def opencontainer(request, container_id, next_page):
     return redirect(next_page)
 
 
+@login_required
+def pausecontainer(request, container_id, next_page):
+    """Pauses a container, it resumes quickly with its kernels alive"""
+    user = request.user
+    try:
+        container = Container.objects.get(id = container_id, user = user, state = Container.ST_RUNNING)
+        container.docker_pause()
+    except Container.DoesNotExist:
+        messages.error(request, 'Container is missing or stopped')
+    except Exception as e:
+        logger.error('Cannot pause the container %s -- %s' % (container, e))
+        messages.error(request, 'Cannot pause the container -- %s' % e)
+    return redirect(next_page)
+
+
 @login_required
 def stopcontainer(request, container_id, next_page):
     """Stops a container"""
     user = request.user
     try:
-        container = Container.objects.get(id = container_id, user = user, state = Container.ST_RUNNING)
+        container = Container.objects.get(id = container_id, user = user, state__in = [ Container.ST_RUNNING, Container.ST_PAUSED ])
         container.docker_stop()
     except Container.DoesNotExist:
         messages.error(request, 'Container is missing or stopped')
@@ -226,6 +279,8 @@ urlpatterns = [
     url(r'^list/?$', listcontainers, name = 'list'), 
     url(r'^start/(?P<container_id>\d+)/(?P<next_page>\w+:?\w*)$', startcontainer, name = 'start'),
     url(r'^open/(?P<container_id>\d+)/(?P<next_page>\w+:?\w*)$', opencontainer, name = 'open'),
+    url(r'^status/(?P<container_id>\d+)$', containerstatus, name = 'status'),
+    url(r'^pause/(?P<container_id>\d+)/(?P<next_page>\w+:?\w*)$', pausecontainer, name = 'pause'),
     url(r'^stop/(?P<container_id>\d+)/(?P<next_page>\w+:?\w*)$', stopcontainer, name = 'stop'),
     url(r'^remove/(?P<container_id>\d+)/(?P<next_page>\w+:?\w*)$', removecontainer, name = 'remove'),
     url(r'^destroy/(?P<container_id>\d+)/(?P<next_page>\w+:?\w*)$', destroycontainer, name = 'destroy'),
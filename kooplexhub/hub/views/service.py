@@ -11,9 +11,11 @@ from django_tables2 import RequestConfig
 #from django.utils.translation import gettext_lazy as _
 #from django.db.models import Q
 #
-from kooplex.lib import list_projects, impersonator_clone, impersonator_removecache
+from kooplex.lib import list_projects, impersonator_clone, impersonator_removecache, impersonator_batch
+from kooplex.lib.filesystem import mkdir_vcpcache, rmclonescript_vcpcache
 from kooplex.lib import list_libraries, impersonator_sync
 from kooplex.lib import now
+from kooplex.settings import KOOPLEX
 #
 #from hub.forms import FormProject
 #from hub.forms import table_collaboration, T_JOINABLEPROJECT
@@ -206,9 +208,16 @@ def vc_commit(request):
     request_rmcache = request.POST.getlist('removecache')
     clone_folders = []
     rmcache = []
+    batch_clone = KOOPLEX.get('impersonator', {}).get('batch_clone', False)
+    tickets = []
     for r_id in request_clone:
         try:
             r = VCProject.objects.get(token__user = user, cloned = False, id = r_id)
+            if batch_clone:
+                r.clone_folder = r.uniquename
+                mkdir_vcpcache(r)
+                tickets.append(impersonator_batch.put(r))
+                continue
             r.clone_folder = impersonator_clone(r)
             r.cloned = True
             r.save()
@@ -216,6 +225,21 @@ def vc_commit(request):
         except Exception as e:
             logger.error(e)
             messages.error(request, "clone oops -- {}".format(e))
+    if tickets:
+        try:
+            impersonator_batch.flush()
+        except Exception as e:
+            logger.error(e)
+        # only the projects shipped are recorded as cloned, the rest can be requested again
+        for ticket in tickets:
+            r = ticket.vcproject
+            if ticket.wait(timeout = KOOPLEX.get('impersonator', {}).get('batch_interval', 2) * 5):
+                r.cloned = True
+                r.save()
+                clone_folders.append(r.clone_folder)
+            else:
+                rmclonescript_vcpcache(r)
+                messages.error(request, "clone oops -- {}: {}".format(r.project_name, ticket.error))
     for r_id in request_rmcache:
         try:
             r = VCProject.objects.get(token__user = user, cloned = True, id = r_id)
@@ -1,6 +1,6 @@
 from .libbase import standardize_str, deaccent_str, keeptrying, bash, now, translate_date, human_localtime
 from .docker import Docker
-from .versioncontrol import list_projects, impersonator_clone, impersonator_removecache
+from .versioncontrol import list_projects, impersonator_clone, impersonator_removecache, impersonator_batch
 from .filesync import list_libraries, seafilepw_update, impersonator_sync
 from .fs_filename import Filename
 from .fs_dirname import Dirname
@@ -0,0 +1,166 @@
+"""
+@author: Jozsef Steger
+@summary: edit POSIX ACLs in-process by rewriting the system.posix_acl_* extended attributes
+
+A batch of edits is applied to each file and directory of a tree in a single, parallel walk,
+directories also get the edits in their default ACL, so new files inherit them.
+"""
+import os
+import stat
+import errno
+import struct
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from kooplex.settings import KOOPLEX
+
+logger = logging.getLogger(__name__)
+
+XATTR_ACCESS = 'system.posix_acl_access'
+XATTR_DEFAULT = 'system.posix_acl_default'
+ACL_XATTR_VERSION = 2
+ACL_UNDEFINED_ID = 0xffffffff
+
+TAG_USER_OBJ = 0x01
+TAG_USER = 0x02
+TAG_GROUP_OBJ = 0x04
+TAG_GROUP = 0x08
+TAG_MASK = 0x10
+TAG_OTHER = 0x20
+
+PERM_BITS = { 'r': 4, 'w': 2, 'x': 1 }
+
+# perms is a setfacl like string, e.g. rwX, or None to remove the entry
+AclEdit = namedtuple('AclEdit', [ 'tag', 'qualifier', 'perms' ])
+
+def acl_user(uid, perms):
+    return AclEdit(TAG_USER, uid, perms)
+
+def acl_group(gid, perms):
+    return AclEdit(TAG_GROUP, gid, perms)
+
+def _decode(blob):
+    version, = struct.unpack_from('<I', blob)
+    assert version == ACL_XATTR_VERSION, "Unsupported ACL version %d" % version
+    return dict([ ((tag, qualifier), perm) for tag, perm, qualifier in struct.iter_unpack('<HHI', blob[4:]) ])
+
+def _encode(entries):
+    blob = [ struct.pack('<I', ACL_XATTR_VERSION) ]
+    for (tag, qualifier) in sorted(entries):
+        blob.append(struct.pack('<HHI', tag, entries[(tag, qualifier)], qualifier))
+    return b''.join(blob)
+
+def _from_mode(mode):
+    return {
+        (TAG_USER_OBJ, ACL_UNDEFINED_ID): (mode >> 6) & 7,
+        (TAG_GROUP_OBJ, ACL_UNDEFINED_ID): (mode >> 3) & 7,
+        (TAG_OTHER, ACL_UNDEFINED_ID): mode & 7,
+    }
+
+def _getacl(path, name):
+    try:
+        return _decode(os.getxattr(path, name, follow_symlinks = False))
+    except OSError as e:
+        if e.errno == errno.ENODATA:
+            return None
+        raise
+
+def _perm(perms, st):
+    bits = 0
+    for p in perms:
+        if p in PERM_BITS:
+            bits |= PERM_BITS[p]
+        elif p == 'X' and (stat.S_ISDIR(st.st_mode) or st.st_mode & 0o111):
+            bits |= 1
+    return bits
+
+def _edit(entries, edits, st):
+    for edit in edits:
+        key = (edit.tag, edit.qualifier)
+        if edit.perms is None:
+            entries.pop(key, None)
+        else:
+            entries[key] = _perm(edit.perms, st)
+    # the mask is the union of the group class, like setfacl recalculates it
+    group_class = [ perm for (tag, _), perm in entries.items() if tag in [ TAG_USER, TAG_GROUP_OBJ, TAG_GROUP ] ]
+    if [ tag for tag, _ in entries if tag in [ TAG_USER, TAG_GROUP ] ]:
+        mask = 0
+        for perm in group_class:
+            mask |= perm
+        entries[(TAG_MASK, ACL_UNDEFINED_ID)] = mask
+    else:
+        entries.pop((TAG_MASK, ACL_UNDEFINED_ID), None)
+    return entries
+
+def apply_entry(path, edits, default = True, st = None):
+    """
+    @summary: apply a batch of edits to the ACL of a single file or directory
+    @returns: the number of extended attributes rewritten
+    """
+    st = st if st else os.lstat(path)
+    if stat.S_ISLNK(st.st_mode):
+        return 0
+    n = 0
+    current = _getacl(path, XATTR_ACCESS)
+    entries = _edit(dict(current if current else _from_mode(st.st_mode)), edits, st)
+    if entries != (current if current else _from_mode(st.st_mode)):
+        os.setxattr(path, XATTR_ACCESS, _encode(entries), follow_symlinks = False)
+        n += 1
+    if default and stat.S_ISDIR(st.st_mode):
+        current_default = _getacl(path, XATTR_DEFAULT)
+        if current_default:
+            base = dict(current_default)
+        else:
+            base = dict([ (key, perm) for key, perm in entries.items() if key[0] in [ TAG_USER_OBJ, TAG_GROUP_OBJ, TAG_OTHER ] ])
+        entries_default = _edit(dict(base), edits, st)
+        named = [ key for key in entries_default if key[0] in [ TAG_USER, TAG_GROUP ] ]
+        named_before = [ key for key in (current_default if current_default else {}) if key[0] in [ TAG_USER, TAG_GROUP ] ]
+        if named_before and not named:
+            # like setfacl -x, no default ACL is kept when its last named entry is revoked
+            os.removexattr(path, XATTR_DEFAULT, follow_symlinks = False)
+            n += 1
+        elif named and entries_default != current_default:
+            os.setxattr(path, XATTR_DEFAULT, _encode(entries_default), follow_symlinks = False)
+            n += 1
+    return n
+
+def _scan(folder, edits, default):
+    """
+    @summary: apply the edits to the files of a directory
+    @returns: the subdirectories to continue with, and the number of extended attributes rewritten
+    """
+    subdirs = []
+    n = 0
+    with os.scandir(folder) as it:
+        for entry in it:
+            try:
+                st = entry.stat(follow_symlinks = False)
+                n += apply_entry(entry.path, edits, default, st)
+                if stat.S_ISDIR(st.st_mode):
+                    subdirs.append(entry.path)
+            except OSError as e:
+                logger.error("Cannot set acl of %s -- %s" % (entry.path, e))
+    return subdirs, n
+
+def apply_acl(folder, edits, recursive = True, default = True, workers = None):
+    """
+    @summary: apply a batch of edits to a whole tree in one walk, directories are scanned by parallel threads
+    @param edits: the entries to set or to remove
+    @type edits: list of AclEdit
+    @returns: the number of extended attributes rewritten
+    """
+    workers = workers if workers else KOOPLEX.get('acl', {}).get('workers', 8)
+    n = apply_entry(folder, edits, default)
+    if not recursive or not os.path.isdir(folder):
+        return n
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        pending = set([ pool.submit(_scan, folder, edits, default) ])
+        while pending:
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                subdirs, n_scan = future.result()
+                n += n_scan
+                pending.update([ pool.submit(_scan, subdir, edits, default) for subdir in subdirs ])
+    logger.debug("%d acl attributes rewritten in %s -- %s" % (n, folder, edits))
+    return n
@@ -0,0 +1,57 @@
+"""
+@author: Jozsef Steger
+@summary: admission control of container starts based on the committed resources of each docker engine
+"""
+import logging
+
+from kooplex.settings import KOOPLEX
+from hub.models import Container, CourseContainerBinding, SpawnJob
+
+logger = logging.getLogger(__name__)
+
+class Admission:
+    """
+    @summary: compare the resources committed to running and starting containers with the capacity of the engine,
+    scaled by the configured overcommit ratios
+    """
+    dockerconf = KOOPLEX.get('docker', {})
+
+    def __init__(self, docker, engine = None):
+        self.docker = docker
+        self.engine = engine if engine in docker.engines else docker.default_engine
+        memory, cpu = docker.capacity(self.engine)
+        self.mem_capacity = memory * self.dockerconf.get('overcommit_memory', 1.)
+        self.cpu_capacity = cpu * self.dockerconf.get('overcommit_cpu', 1.)
+
+    @property
+    def mode(self):
+        return self.dockerconf.get('admission', 'queue')
+
+    def committed(self, exclude = None):
+        """
+        @summary: sum up the resource limits of running and paused containers and of those being started on the engine
+        @returns: memory (MB) and cpu (cores)
+        """
+        starting = SpawnJob.objects.filter(phase__in = [ SpawnJob.PH_CREATING, SpawnJob.PH_STARTING, SpawnJob.PH_ROUTING ]).values_list('container_id', flat = True)
+        containers = Container.objects.filter(state__in = [ Container.ST_RUNNING, Container.ST_PAUSED ]) | Container.objects.filter(id__in = list(starting))
+        containers = containers & self.docker.containers_on(self.engine)
+        if exclude is not None:
+            containers = containers.exclude(id = exclude.id)
+        containers = list(containers.select_related('image'))
+        courses = dict([ (b.container_id, b.course) for b in CourseContainerBinding.objects.filter(container__in = containers).select_related('course') ])
+        mem_committed, cpu_committed = 0, 0.
+        for container in containers:
+            mem_limit, cpu_limit = Container.get_resource_limits(container.image, courses.get(container.id))
+            mem_committed += mem_limit
+            cpu_committed += cpu_limit
+        return mem_committed, cpu_committed
+
+    def admit(self, container):
+        """
+        @summary: check whether the container fits in the remaining capacity
+        """
+        mem_limit, cpu_limit = container.resource_limits
+        mem_committed, cpu_committed = self.committed(exclude = container)
+        admitted = mem_committed + mem_limit <= self.mem_capacity and cpu_committed + cpu_limit <= self.cpu_capacity
+        logger.debug("%s admitted on %s: %s -- memory %d+%d/%d MB, cpu %.1f+%.1f/%.1f" % (container, self.engine, admitted, mem_committed, mem_limit, self.mem_capacity, cpu_committed, cpu_limit, self.cpu_capacity))
+        return admitted
@@ -0,0 +1,36 @@
+"""
+@author: Jozsef Steger
+@summary: compress the folders moved to the pending area in the background, outside the signal handlers
+"""
+import os
+import shutil
+import logging
+from distutils import dir_util
+
+from django.db import connection
+
+from hub.models import ArchiveJob
+from kooplex.lib.archiver import archive_folder
+
+logger = logging.getLogger(__name__)
+
+def archive(job):
+    """
+    @summary: archive the pending folder of a job and remove it, a failed job keeps its folder for a retry
+    @param job: the archive job, already claimed by the caller
+    @type job: hub.models.ArchiveJob
+    """
+    try:
+        dir_util.mkpath(os.path.dirname(job.target))
+        stats = archive_folder(job.pending, job.target)
+        shutil.rmtree(job.pending)
+        job.set_state(ArchiveJob.ST_DONE, "%d members in %.1f s" % (stats.files, stats.elapsed), bytes_in = stats.bytes_in, bytes_out = stats.bytes_out)
+        logger.info("%s archived" % job)
+    except Exception as e:
+        logger.error("Cannot archive %s -- %s" % (job, e))
+        job.set_state(ArchiveJob.ST_FAILED, str(e)[:512])
+    finally:
+        connection.close()
+
+def queued_jobs(limit):
+    return ArchiveJob.objects.filter(state = ArchiveJob.ST_QUEUED).order_by('created_at')[:limit]
@@ -0,0 +1,182 @@
+"""
+@author: Jozsef Steger
+@summary: write tar archives of directory trees compressed by several threads
+
+The tar stream is generated while walking the directory and fed to the compressor of the configured codec:
+    gz: the stream is cut into chunks compressed in parallel, each of them becomes a gzip member,
+        the concatenation is a regular gzip file readable by gunzip and tarfile
+    zst: zstandard with its own worker threads, if the zstandard module is installed
+The parameters come from KOOPLEX['archive']: codec, workers, level, chunk_size and exclude patterns.
+"""
+import os
+import gzip
+import time
+import fnmatch
+import tarfile
+import logging
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from kooplex.settings import KOOPLEX
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+archiveconf = KOOPLEX.get('archive', {})
+
+CODECS = [ 'gz', 'zst' ]
+
+ArchiveStats = namedtuple('ArchiveStats', [ 'files', 'bytes_in', 'bytes_out', 'elapsed' ])
+
+def codec():
+    """
+    @summary: the codec in use, gz if zstandard is configured but not installed
+    """
+    name = archiveconf.get('codec', 'gz')
+    assert name in CODECS, "Unknown archive codec %s" % name
+    if name == 'zst' and zstandard is None:
+        logger.warning("zstandard module is missing, falling back to gz")
+        return 'gz'
+    return name
+
+def extension(name = None):
+    return "tar.%s" % (name if name else codec())
+
+
+class CountingWriter:
+    """
+    @summary: count the bytes written to the underlying file
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.bytes_out = 0
+
+    def write(self, data):
+        self.bytes_out += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+class ParallelGzipWriter:
+    """
+    @summary: compress the chunks of a stream as independent gzip members in a thread pool, and write them in order
+    """
+    def __init__(self, fileobj, workers = 4, level = 6, chunk_size = 4 * 1024 * 1024):
+        self.fileobj = fileobj
+        self.level = level
+        self.chunk_size = chunk_size
+        self.max_pending = 2 * workers
+        self.bytes_in = 0
+        self._buffer = bytearray()
+        self._pending = deque()
+        # zlib releases the GIL while compressing
+        self._pool = ThreadPoolExecutor(max_workers = workers)
+
+    def _submit(self, chunk):
+        self._pending.append(self._pool.submit(gzip.compress, chunk, self.level))
+        # bound the memory: wait for the oldest chunk
+        while len(self._pending) > self.max_pending:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.chunk_size:
+            self._submit(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def close(self):
+        try:
+            if self._buffer or not self.bytes_in:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().result())
+        finally:
+            self._pool.shutdown()
+
+
+class ZstdWriter:
+    def __init__(self, fileobj, workers = 4, level = 3):
+        self.bytes_in = 0
+        self._writer = zstandard.ZstdCompressor(level = level, threads = workers).stream_writer(fileobj, closefd = False)
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        return self._writer.write(data)
+
+    def close(self):
+        self._writer.close()
+
+
+def _compressor(fileobj, name, workers):
+    if name == 'zst':
+        return ZstdWriter(fileobj, workers = workers, level = archiveconf.get('level', 3))
+    return ParallelGzipWriter(fileobj, workers = workers, level = archiveconf.get('level', 6), chunk_size = archiveconf.get('chunk_size', 4 * 1024 * 1024))
+
+def _excluded(path, patterns):
+    name = os.path.basename(path)
+    for pattern in patterns:
+        if fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+def archive_folder(folder, target, exclude = [], workers = None):
+    """
+    @summary: archive a directory tree, the archive is renamed in place only when it is complete
+    @param target: the archive file, its extension should follow the codec (see extension())
+    @param exclude: shell patterns matched against the path in the archive and against the file name
+    @returns: ArchiveStats
+    """
+    name = codec()
+    workers = workers if workers else archiveconf.get('workers', 4)
+    patterns = list(archiveconf.get('exclude', [])) + list(exclude)
+    t0 = time.time()
+    n = [ 0 ]
+    def member_filter(tarinfo):
+        if tarinfo.name != '.' and _excluded(tarinfo.name[2:] if tarinfo.name.startswith('./') else tarinfo.name, patterns):
+            return None
+        n[0] += 1
+        return tarinfo
+    tmp = "%s.part" % target
+    try:
+        with open(tmp, 'wb') as f:
+            counter = CountingWriter(f)
+            compressor = _compressor(counter, name, workers)
+            try:
+                # stream mode, members are written as the walk reaches them
+                with tarfile.open(fileobj = compressor, mode = 'w|') as archive:
+                    archive.add(folder, arcname = '.', recursive = True, filter = member_filter)
+            finally:
+                compressor.close()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    stats = ArchiveStats(n[0], compressor.bytes_in, counter.bytes_out, time.time() - t0)
+    logger.info("archived %s -> %s: %d members, %.1f MB -> %.1f MB in %.1f s (%.1f MB/s, %s, %d workers)" % (folder, target, stats.files, stats.bytes_in / 1e6, stats.bytes_out / 1e6, stats.elapsed, stats.bytes_in / 1e6 / max(stats.elapsed, 1e-3), name, workers))
+    return stats
+
+def open_archive(path):
+    """
+    @summary: open an archive for reading, whichever codec it was written with
+    """
+    if path.endswith('.zst'):
+        assert zstandard is not None, "zstandard module is needed to read %s" % path
+        f = open(path, 'rb')
+        return tarfile.open(fileobj = zstandard.ZstdDecompressor().stream_reader(f, closefd = True), mode = 'r|')
+    return tarfile.open(path, mode = 'r')
+
+def extract_archive(path, target):
+    with open_archive(path) as archive:
+        archive.extractall(path = target)
@@ -7,7 +7,8 @@ import requests
 import logging
 
 from kooplex.settings import KOOPLEX
-from kooplex.lib import keeptrying, standardize_str
+from kooplex.lib import standardize_str
+from kooplex.lib.retry import get_policy
 
 logger = logging.getLogger(__name__)
 
@@ -42,7 +43,7 @@ auth_basic_user_file /etc/passwords/%s;
 
     }
     logging.debug("+ %s ---> %s" % (kw['url'], kw['data']))
-    keeptrying(requests.post, 50, **kw)
+    get_policy('reportapi').call(requests.post, endpoint = reportconf.get('api_url','localhost'), **kw)
 
 def remove_report_nginx_api(report):
     str_name = standardize_str(report.proxy_path)
@@ -54,4 +55,4 @@ def remove_report_nginx_api(report):
 
     }
     logging.debug("- %s ---> %s" % (kw['url'], kw['data']))
-    return keeptrying(requests.delete, 5, **kw)
+    return get_policy('reportapi').call(requests.delete, endpoint = reportconf.get('api_url','localhost'), **kw)
@@ -0,0 +1,71 @@
+"""
+@author: Jozsef Steger
+@summary: aggregate mount configuration requests of containers within a time window
+"""
+import logging
+import threading
+
+from django.db import connection
+
+from kooplex.settings import KOOPLEX
+from kooplex.lib.docker import Docker
+
+logger = logging.getLogger(__name__)
+
+class MountCoalescer:
+    """
+    @summary: a process-wide debouncer. Requests are keyed by container id, and when the time window
+    expires a single mount configuration is written for each affected container.
+    """
+    def __init__(self, window):
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+        self.n_requests = 0
+        self.n_writes = 0
+
+    def request(self, container):
+        with self._lock:
+            self._pending[container.id] = self._pending.get(container.id, 0) + 1
+            self.n_requests += 1
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self._expire)
+                self._timer.daemon = True
+                self._timer.start()
+                logger.debug("Aggregating timer started.")
+            else:
+                logger.debug("still aggregating...")
+
+    def _expire(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        """
+        @summary: write the mount configuration of all containers requested so far
+        @returns: the number of requests merged
+        """
+        from hub.models import Container
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        docker = Docker()
+        for container in Container.objects.filter(id__in = pending.keys()):
+            try: 
+                assert container.is_created, "%s is not manifested in docker engine" % container
+                docker.managemount(container)
+                self.n_writes += 1
+            except Exception as e: 
+                logger.error("cannot manage mapping in container %s -- %s" % (container, e)) 
+        n_merged = sum(pending.values())
+        logger.info("%d mount requests merged into %d containers" % (n_merged, len(pending)))
+        return n_merged
+
+mount_coalescer = MountCoalescer(window = KOOPLEX.get('docker', {}).get('mountconf_window', 1))
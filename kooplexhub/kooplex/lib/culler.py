@@ -0,0 +1,153 @@
+"""
+@author: Jozsef Steger
+@summary: find running containers nobody has used for a while, pause them first and stop them later
+"""
+import os
+import json
+import datetime
+import logging
+import pytz
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
+from kooplex.settings import KOOPLEX
+from kooplex.lib import now
+from kooplex.lib.proxy import getroutes
+from hub.models import Container, CourseContainerBinding, SpawnJob
+
+logger = logging.getLogger(__name__)
+
+def parse_timestamp(ts):
+    """
+    @summary: parse the UTC timestamps reported by the notebook server and the proxy, e.g. 2019-03-01T10:00:00.123456Z
+    @returns: a tz-aware datetime or None if the timestamp is missing or malformed
+    """
+    if not ts:
+        return None
+    try:
+        ts = ts.rstrip('Z').split('+')[0].split('.')[0]
+        return pytz.utc.localize(datetime.datetime.strptime(ts, '%Y-%m-%dT%H:%M:%S'))
+    except ValueError:
+        logger.warning("Cannot parse timestamp %s" % ts)
+        return None
+
+class Culler:
+    """
+    @summary: collect the last activity of running containers with a bounded pool of concurrent HTTP requests
+    """
+    cullerconf = KOOPLEX.get('culler', {})
+
+    def __init__(self, workers = None, timeout = None, pause = True):
+        self.workers = workers if workers else self.cullerconf.get('workers', 32)
+        self.timeout = timeout if timeout else self.cullerconf.get('timeout', 5)
+        # minutes of inactivity before a container is paused, falsy turns the pause tier off
+        self.pause_after = self.cullerconf.get('pause_after', 30) if pause else None
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections = self.workers, pool_maxsize = self.workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def proxy_activity(self):
+        """
+        @summary: the last activity of each proxy route, retrieved in a single request
+        @returns: a dictionary of proxy path -> tz-aware datetime
+        """
+        try:
+            routes = json.loads(getroutes().content.decode())
+        except Exception as e:
+            logger.warning("Cannot retrieve proxy routes -- %s" % e)
+            return {}
+        return dict([ (path.strip('/'), parse_timestamp(route.get('last_activity'))) for path, route in routes.items() ])
+
+    def notebook_activity(self, container):
+        """
+        @summary: the last activity reported by the notebook server running in the container, kernel activity included
+        """
+        kw = {
+            'url': os.path.join(container.api, 'api', 'status'),
+            'headers': { 'Authorization': 'token %s' % container.user.profile.token },
+            'timeout': self.timeout,
+        }
+        try:
+            response = self.session.get(**kw)
+            response.raise_for_status()
+            return parse_timestamp(response.json().get('last_activity'))
+        except Exception as e:
+            logger.debug("No notebook activity of %s -- %s" % (container, e))
+            return None
+
+    def running_containers(self):
+        spawning = SpawnJob.objects.filter(phase__in = SpawnJob.PHASE_ACTIVE).values_list('container_id', flat = True)
+        containers = list(Container.objects.filter(state = Container.ST_RUNNING).exclude(id__in = list(spawning)).select_related('image', 'user__profile'))
+        courses = dict([ (b.container_id, b.course) for b in CourseContainerBinding.objects.filter(container__in = containers).select_related('course') ])
+        return [ (container, courses.get(container.id)) for container in containers ]
+
+    def paused_containers(self):
+        containers = list(Container.objects.filter(state = Container.ST_PAUSED).select_related('image'))
+        courses = dict([ (b.container_id, b.course) for b in CourseContainerBinding.objects.filter(container__in = containers).select_related('course') ])
+        return [ (container, courses.get(container.id)) for container in containers ]
+
+    def idle_containers(self):
+        """
+        @summary: find the running containers idle for longer than the pause tier or their image or course threshold,
+        and the paused ones which reached the threshold meanwhile
+        @returns: a list of (container, idle minutes, threshold minutes, action), action is either pause or stop
+        """
+        proxy = self.proxy_activity()
+        candidates = self.running_containers()
+        with ThreadPoolExecutor(max_workers = self.workers) as pool:
+            notebook = list(pool.map(self.notebook_activity, [ container for container, _ in candidates ]))
+        timenow = now()
+        idle = []
+        for (container, course), t_notebook in zip(candidates, notebook):
+            activity = [ t for t in [ t_notebook, proxy.get(container.proxy_path) ] if t is not None ]
+            if not activity:
+                logger.warning("Activity of %s is unknown, leaving it alone" % container)
+                continue
+            minutes = (timenow - max(activity)).total_seconds() / 60
+            threshold = Container.get_idle_timeout(container.image, course)
+            logger.debug("%s idle for %d minutes, threshold %d" % (container, minutes, threshold))
+            if minutes > threshold:
+                idle.append((container, minutes, threshold, 'stop'))
+            elif self.pause_after and minutes > self.pause_after:
+                idle.append((container, minutes, threshold, 'pause'))
+        # a paused notebook server does not answer, its inactivity is counted from the pause
+        for container, course in self.paused_containers():
+            paused_at = container.paused_at if container.paused_at else container.last_message_at
+            if paused_at is None:
+                continue
+            minutes = (timenow - paused_at).total_seconds() / 60 + (self.pause_after if self.pause_after else 0)
+            threshold = Container.get_idle_timeout(container.image, course)
+            if minutes > threshold:
+                idle.append((container, minutes, threshold, 'stop'))
+        return idle
+
+    def cull(self, container, minutes, action, remove = False):
+        """
+        @summary: pause, or stop and optionally remove, an idle container through the usual state change
+        """
+        try:
+            if action == 'pause':
+                container.docker_pause()
+                reason = "Paused after %d minutes of inactivity" % minutes
+            else:
+                if remove:
+                    container.marked_to_remove = True
+                container.docker_stop()
+                reason = "Culled after %d minutes of inactivity" % minutes
+            # the state change chain records the docker response, the reason is put in place afterwards
+            Container.objects.filter(id = container.id).update(last_message = reason, last_message_at = now())
+            logger.info("%s %s" % (container, reason))
+            return True
+        except Exception as e:
+            logger.error("Cannot cull %s -- %s" % (container, e))
+            return False
+        finally:
+            connection.close()
+
+    def cull_all(self, idle, remove = False):
+        with ThreadPoolExecutor(max_workers = self.workers) as pool:
+            futures = [ pool.submit(self.cull, container, minutes, action, remove) for container, minutes, _, action in idle ]
+        return len([ f for f in futures if f.result() ])
@@ -0,0 +1,162 @@
+"""
+@author: Jozsef Steger
+@summary: index the disk usage of the volumes incrementally
+
+Each directory is cached with its modification time, the size of its own files and the names of its subdirectories.
+A directory of unchanged modification time is not listed again and its files are not stat-ed, only its subdirectories
+are visited. Writing a file in place does not touch the modification time of its directory, a full scan catches those.
+The allocated size of a file with several hardlinks is shared equally among its links.
+"""
+import os
+import json
+import stat
+import logging
+import tempfile
+
+from kooplex.settings import KOOPLEX
+from kooplex.lib import now
+from kooplex.lib.filesystem import Dirname
+
+logger = logging.getLogger(__name__)
+
+usageconf = KOOPLEX.get('diskusage', {})
+
+MOUNTPOINTS = [ 'home', 'workdir', 'share', 'course', 'usercourse', 'report' ]
+
+class Indexer:
+    def __init__(self, cache = None, full = False):
+        self.cache_path = cache if cache else usageconf.get('cache', '/tmp/kooplex-diskusage.json')
+        self.full = full
+        self.cache = {} if full else self._load()
+        self.cache_new = {}
+        self.totals = {}
+        self.n_listed = 0
+        self.n_cached = 0
+
+    def _load(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning("Cannot read the cache %s, full scan -- %s" % (self.cache_path, e))
+            return {}
+
+    def save(self):
+        folder = os.path.dirname(self.cache_path)
+        fd, tmp = tempfile.mkstemp(dir = folder, prefix = '.%s.' % os.path.basename(self.cache_path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.cache_new, f)
+            os.replace(tmp, self.cache_path)
+        except:
+            os.unlink(tmp)
+            raise
+
+    def _scan(self, path, mtime):
+        entry = self.cache.get(path)
+        if entry and entry[0] == mtime:
+            _, own_size, own_files, children = entry
+            self.n_cached += 1
+        else:
+            own_size = 0
+            own_files = 0
+            children = []
+            with os.scandir(path) as it:
+                for dirent in it:
+                    try:
+                        if dirent.is_dir(follow_symlinks = False):
+                            children.append(dirent.name)
+                            continue
+                        st = dirent.stat(follow_symlinks = False)
+                        own_size += st.st_blocks * 512 // st.st_nlink
+                        own_files += 1
+                    except OSError as e:
+                        logger.debug("skip %s -- %s" % (dirent.path, e))
+            self.n_listed += 1
+        self.cache_new[path] = [ mtime, own_size, own_files, children ]
+        size = own_size
+        files = own_files
+        for name in children:
+            child = os.path.join(path, name)
+            try:
+                st = os.lstat(child)
+                if not stat.S_ISDIR(st.st_mode):
+                    continue
+                child_size, child_files = self._scan(child, st.st_mtime_ns)
+                size += child_size + st.st_blocks * 512
+                files += child_files
+            except OSError as e:
+                # removed meanwhile, the parent is listed again next time
+                logger.debug("skip %s -- %s" % (child, e))
+        self.totals[path] = (size, files)
+        return size, files
+
+    def scan(self, root):
+        """
+        @summary: update the totals of all the directories of a tree
+        """
+        self._scan(root, os.lstat(root).st_mtime_ns)
+        logger.info("%s indexed, %d folders listed, %d from cache" % (root, self.n_listed, self.n_cached))
+
+    def total(self, path):
+        return self.totals.get(os.path.normpath(path))
+
+
+def targets():
+    """
+    @summary: the folders to account for and their owners
+    @returns: a generator of (kind, path, owners)
+    """
+    from hub.models import DiskUsage, Profile, UserProjectBinding, Course, UserCourseBinding
+    for profile in Profile.objects.all().select_related('user'):
+        yield DiskUsage.KD_HOME, Dirname.userhome(profile.user), { 'user': profile.user }
+        yield DiskUsage.KD_REPORT, Dirname.reportroot(profile.user), { 'user': profile.user }
+    for binding in UserProjectBinding.objects.all().select_related('user', 'project'):
+        yield DiskUsage.KD_WORKDIR, Dirname.workdir(binding), { 'user': binding.user, 'project': binding.project }
+        if binding.role == UserProjectBinding.RL_CREATOR:
+            yield DiskUsage.KD_SHARE, Dirname.share(binding), { 'project': binding.project }
+    for course in Course.objects.all():
+        yield DiskUsage.KD_COURSE, Dirname.course(course), { 'course': course }
+        yield DiskUsage.KD_COURSEWORKDIR, Dirname.courseworkdir(UserCourseBinding(course = course)), { 'course': course }
+
+def index(full = False, dry = False):
+    """
+    @summary: scan the mountpoints and store the rollups
+    @returns: the rollups over their soft quota
+    """
+    from hub.models import DiskUsage
+    indexer = Indexer(full = full)
+    for key in MOUNTPOINTS:
+        root = Dirname.mountpoint.get(key)
+        if root and os.path.isdir(root):
+            indexer.scan(os.path.normpath(root))
+    timestamp = now()
+    over = []
+    for kind, path, owners in targets():
+        total = indexer.total(path)
+        if total is None:
+            continue
+        size, files = total
+        # the blobs of published reports are stored outside the report root
+        if kind == DiskUsage.KD_REPORT:
+            blobs = indexer.total(Dirname.reportblobs(owners['user']))
+            if blobs:
+                size += blobs[0]
+                files += blobs[1]
+        usage = DiskUsage(kind = kind, path = path, size = size, files = files, measured_at = timestamp, **owners)
+        if usage.over_quota:
+            logger.warning("%s is over its soft quota of %d MB" % (usage, usage.quota))
+            over.append(usage)
+        if dry:
+            print ("%s %s %.1f MB %d files%s" % (kind, path, usage.megabytes, files, " OVER QUOTA" if usage.over_quota else ""))
+            continue
+        fields = dict(kind = kind, path = path, size = size, files = files, measured_at = timestamp, user = None, project = None, course = None)
+        fields.update(owners)
+        DiskUsage.objects.update_or_create(path_hash = DiskUsage.hash_path(path), defaults = fields)
+    if not dry:
+        # the rows not stamped by this scan belong to folders gone
+        DiskUsage.objects.filter(measured_at__lt = timestamp).delete()
+        indexer.save()
+    return over
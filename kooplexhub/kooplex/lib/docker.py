@@ -8,10 +8,12 @@ import os
 import json
 import shlex
 from docker.client import Client
+from docker.errors import NotFound
 
 from kooplex.settings import KOOPLEX
 
 from kooplex.lib import now
+from kooplex.lib.tarstream import ArchiveWriter
 
 logger = logging.getLogger(__name__)
 
@@ -19,22 +21,72 @@ class Docker:
     dockerconf = KOOPLEX.get('docker', {})
 
     def __init__(self):
-        base_url = self.dockerconf.get('base_url', '')
-        self.client = Client(base_url = base_url)
-        logger.debug("Client init")
+        self.engines = self.dockerconf.get('engines', { 'default': { 'base_url': self.dockerconf.get('base_url', '') } })
+        self.default_engine = self.dockerconf.get('default_engine', sorted(self.engines)[0])
+        self._clients = {}
+        self._capacity = {}
         self.check = None
 
+    def get_client(self, engine = None):
+        """
+        @summary: the API client of an engine, connections are opened on first use
+        @param engine: the name of the engine, None or an unknown name stands for the default engine
+        """
+        if not engine in self.engines:
+            engine = self.default_engine
+        if not engine in self._clients:
+            self._clients[engine] = Client(base_url = self.engines[engine].get('base_url', ''))
+            logger.debug("Client init %s" % engine)
+        return self._clients[engine]
+
+    @property
+    def client(self):
+        return self.get_client(self.default_engine)
+
+    def _client(self, container):
+        return self.get_client(container.engine)
+
+    def containers_on(self, engine):
+        """
+        @summary: the containers living on an engine, containers not yet placed belong to the default engine
+        """
+        from hub.models import Container
+        containers = Container.objects.filter(engine = engine)
+        if engine == self.default_engine:
+            containers = containers | Container.objects.filter(engine__isnull = True)
+        return containers
+
+    def place(self, container):
+        """
+        @summary: choose the engine of a container by the configured placement policy, unless it is manifested already
+        @returns: the name of the engine, also recorded in container.engine
+        """
+        from kooplex.lib.placement import get_policy
+        if container.state != container.ST_NOTPRESENT and container.engine in self.engines:
+            return container.engine
+        container.engine = get_policy()(self, container, list(self.engines))
+        logger.info("%s placed on engine %s" % (container, container.engine))
+        return container.engine
+
     def list_imagenames(self):
         logger.debug("Listing image names")
         pattern_imagenamefilter = KOOPLEX.get('docker', {}).get('pattern_imagename_filter', r'^image-%(\w+):\w$')
-        for image in self.client.images(all = True):
-            if image['RepoTags'] is None:
-                continue
-            for tag in image['RepoTags']:
-                if re.match(pattern_imagenamefilter, tag):
-                    _, imagename, _ = re.split(pattern_imagenamefilter, tag)
-                    logger.debug("Found image: %s" % imagename)
-                    yield imagename
+        seen = set()
+        for engine in self.engines:
+            for image in self.get_client(engine).images(all = True):
+                if image['RepoTags'] is None:
+                    continue
+                for tag in image['RepoTags']:
+                    if re.match(pattern_imagenamefilter, tag):
+                        _, imagename, _ = re.split(pattern_imagenamefilter, tag)
+                        if imagename in seen:
+                            continue
+                        seen.add(imagename)
+                        logger.debug("Found image: %s" % imagename)
+                        yield imagename
+
+    def has_image(self, imagename, engine):
+        return len(self.get_client(engine).images(name = imagename)) > 0
 
     def list_volumenames(self):
         logger.debug("Listing volume names")
@@ -44,149 +96,327 @@ class Docker:
 
     def create_volume(self, volume):
         volume_dir = None #self.dockerconf.get('volume_dir', '')
-        if volume_dir:
-            self.client.create_volume(
-                name = volume.name, 
-                driver='local', 
-                driver_opts = {
-                    'device': '%s/%s/'%(volume_dir, volume.name), 
-                    'o': 'bind', 
-                    'type': 'none'}
-                )
-        else:
-            self.client.create_volume(
-                name = volume.name, 
-                )
-        logger.debug("Volume %s created"%volume.name)
+        # containers may be placed on any of the engines, each of them needs to know the volume
+        for engine in self.engines:
+            client = self.get_client(engine)
+            if volume_dir:
+                client.create_volume(
+                    name = volume.name, 
+                    driver='local', 
+                    driver_opts = {
+                        'device': '%s/%s/'%(volume_dir, volume.name), 
+                        'o': 'bind', 
+                        'type': 'none'}
+                    )
+            else:
+                client.create_volume(
+                    name = volume.name, 
+                    )
+            logger.debug("Volume %s created on engine %s" % (volume.name, engine))
         return True #self.get_container(container)
 
     def delete_volume(self, volume):
-        self.client.remove_volume(name = volume.name)
-        logger.debug("Volume %s deleted"%volume.name)
+        for engine in self.engines:
+            self.get_client(engine).remove_volume(name = volume.name)
+            logger.debug("Volume %s deleted from engine %s" % (volume.name, engine))
+
+    def capacity(self, engine = None):
+        """
+        @summary: the physical resources of the docker engine host, asked once for the lifetime of this instance
+        @returns: memory in MB and the number of cpu cores
+        """
+        engine = engine if engine else self.default_engine
+        if not engine in self._capacity:
+            info = self.get_client(engine).info()
+            self._capacity[engine] = (info['MemTotal'] / 2**20, info['NCPU'])
+        return self._capacity[engine]
+
+    def list_containerstates(self, engine = None):
+        """
+        @summary: a single listing of all containers known by the docker engine
+        @returns: a dictionary of container name -> docker state (e.g. running, exited)
+        """
+        states = {}
+        for item in self.get_client(engine).containers(all = True):
+            for name in item['Names']:
+                # docker API prepends '/' in front of container names
+                states[name.lstrip('/')] = item['State']
+        return states
+
+    def events(self, since = None, engine = None):
+        """
+        @summary: subscribe to the container related part of the docker events stream
+        @param since: replay events since this unix timestamp
+        @type since: int
+        """
+        for event in self.get_client(engine).events(since = since, filters = { 'type': 'container' }, decode = True):
+            yield event
 
     def get_container(self, container):
-        for item in self.client.containers(all = True):
-            # docker API prepends '/' in front of container names
-            if '/' + container.name in item['Names']:
-                logger.debug("Get container %s" % container.name)
-                return item
-        return None
+        """
+        @summary: inspect a container by its docker id, fall back to a lookup by name if the id is stale or unknown
+        @param container: the container
+        @type container: hub.models.Container
+        @returns: the docker inspect information or None if the engine does not know the container
+        """
+        if container.docker_id:
+            try:
+                return self._client(container).inspect_container(container.docker_id)
+            except NotFound:
+                logger.debug("Stale docker id %s of container %s" % (container.docker_id, container.name))
+        try:
+            info = self._client(container).inspect_container(container.name)
+        except NotFound:
+            info = None
+        # docker API prepends '/' in front of container names, and would also resolve an id prefix
+        if info is None or info['Name'] != '/' + container.name:
+            container.docker_id = None
+            return None
+        logger.debug("Get container %s" % container.name)
+        container.docker_id = info['Id']
+        return info
 
-    def create_container(self, container):
-        volumes = []    # the list of mount points in the container
-        binds = {}      # a mapping dictionary of the container mounts
-        for volume in container.volumes:
-            logger.debug("container %s, volume %s" % (container, volume))
+    def _id(self, container):
+        return container.docker_id if container.docker_id else container.name
+
+    def _create(self, client, name, imagename, volumes, environment, limits, labels = {}):
+        """
+        @summary: create a container in the docker engine
+        @param volumes: a list of (volume, mode) pairs to mount
+        @param limits: memory (MB) and cpu (cores) limits
+        @returns: the docker id of the new container
+        """
+        mem_limit, cpu_limit = limits
+        mountpoints = []    # the list of mount points in the container
+        binds = {}          # a mapping dictionary of the container mounts
+        for volume, mode in volumes:
             mp = volume.mountpoint
-            volumes.append(mp)
-            binds[volume.name] = { 'bind': mp, 'mode': volume.mode(container.user) }
-        logger.debug("container %s binds %s" % (container, binds))
-        host_config = self.client.create_host_config(
+            mountpoints.append(mp)
+            binds[volume.name] = { 'bind': mp, 'mode': mode }
+        logger.debug("container %s binds %s" % (name, binds))
+        host_config = client.create_host_config(
             binds = binds,
             privileged = True,
-            mem_limit = '2g',
+            mem_limit = '%dm' % mem_limit,
             memswap_limit = '170m',
             mem_swappiness = 0,
 #            oom_kill_disable = True,
             cpu_shares = 2,
+            cpu_period = 100000,
+            cpu_quota = int(cpu_limit * 100000),
         )
         network = self.dockerconf.get('network', 'host')
         networking_config = { 'EndpointsConfig': { network: {} } }
         ports = self.dockerconf.get('container_ports', [ 8000, 9000])
-        imagename = container.image.imagename if container.image else self.dockerconf.get('default_image', 'basic')
         args = {
-            'name': container.name,
+            'name': name,
             'image': imagename,
             'detach': True,
-            'hostname': container.name,
+            'hostname': name,
             'host_config': host_config,
             'networking_config': networking_config,
-            'environment': container.environment,
-            'volumes': volumes,
+            'environment': environment,
+            'volumes': mountpoints,
             'ports': ports,
+            'labels': labels,
         }
-        self.client.create_container(**args)
-        logger.debug("Container created")
+        response = client.create_container(**args)
+        logger.debug("Container %s created %s" % (name, response['Id']))
+        return response['Id']
+
+    def create_container(self, container):
+        volumes = [ (volume, volume.mode(container.user)) for volume in container.volumes ]
+        imagename = container.image.imagename if container.image else self.dockerconf.get('default_image', 'basic')
+        container.docker_id = self._create(self._client(container), container.name, imagename, volumes, container.environment, container.resource_limits)
         self.managemount(container) #FIXME: check if not called twice
         return self.get_container(container)
 
-    def _writefile(self, container_name, path, filename, content):
-        import tarfile
-        import time
-        from io import BytesIO
-        tarstream = BytesIO()
-        tar = tarfile.TarFile(fileobj = tarstream, mode = 'w')
-        tarinfo = tarfile.TarInfo(name = filename)
-        tarinfo.size = len(content)
-        tarinfo.mtime = time.time()
-        tar.addfile(tarinfo, BytesIO(content))
-        tar.close()
-        tarstream.seek(0)
+    def _warmpool_volumes(self):
+        from hub.models import Volume
+        volumetypes = self.dockerconf.get('warmpool_volumetypes', [ Volume.HOME, Volume.GARBAGE, Volume.REPORT, Volume.FILESYNC, Volume.SHARE, Volume.WORKDIR, Volume.GIT ])
+        return list(Volume.objects.filter(volumetype__in = volumetypes))
+
+    def list_warmcontainers(self, image, engine = None):
+        """
+        @summary: list the pre-created, unassigned containers of an image
+        """
+        label = "%s=%s" % (self.dockerconf.get('warmpool_label', 'kooplex.warmpool'), image.name)
+        for item in self.get_client(engine).containers(all = True, filters = { 'label': label, 'status': 'created' }):
+            # a claimed container is renamed, but keeps its label
+            if [ n for n in item['Names'] if n.startswith('/warm-') ]:
+                yield item
+
+    def create_warmcontainer(self, image, engine = None):
+        import uuid
+        name = "warm-%s-%s" % (image.name, uuid.uuid4().hex[:8])
+        volumes = [ (volume, 'rw') for volume in self._warmpool_volumes() ]
+        labels = { self.dockerconf.get('warmpool_label', 'kooplex.warmpool'): image.name }
+        from hub.models import Container
+        limits = Container.get_resource_limits(image, None)
+        return self._create(self.get_client(engine), name, image.imagename, volumes, { 'CONTAINER_NAME': name }, limits, labels = labels)
+
+    def remove_warmcontainer(self, item, engine = None):
+        self.get_client(engine).remove_container(item['Id'])
+        logger.debug("Warm container %s removed" % item['Names'])
+
+    def claim_warmcontainer(self, container):
+        """
+        @summary: take over a pre-created container of the same image, rename it and configure its environment and mounts
+        @returns: the docker inspect information or None if no suitable container was found in the warm pool
+        """
+        image = container.image
+        if image is None or image.warmpool_size == 0:
+            return None
+        # the binds of a warm container are fixed, a claimed one must not keep volumes the user is not granted
+        pool_volumes = set(self._warmpool_volumes())
+        volumes = set(container.volumes)
+        if volumes != pool_volumes:
+            logger.debug("%s cannot be served from the warm pool, volumes differ %s" % (container, volumes.symmetric_difference(pool_volumes)))
+            return None
+        for volume in volumes:
+            if volume.mode(container.user) != 'rw':
+                logger.debug("%s cannot be served from the warm pool, volume %s" % (container, volume))
+                return None
+        for item in self.list_warmcontainers(image, container.engine):
+            try:
+                self._client(container).rename(item['Id'], container.name)
+            except Exception as e:
+                # another process may have claimed it meanwhile
+                logger.debug("Cannot claim %s -- %s" % (item['Names'], e))
+                continue
+            container.docker_id = item['Id']
+            logger.info("%s claimed warm container %s" % (container, item['Names']))
+            mem_limit, cpu_limit = container.resource_limits
+            try:
+                self._client(container).update_container(item['Id'], mem_limit = '%dm' % mem_limit, cpu_quota = int(cpu_limit * 100000))
+            except Exception as e:
+                logger.warning("Cannot apply resource limits of %s -- %s" % (container, e))
+            writer = ArchiveWriter()
+            self._add_environmentconf(container, writer)
+            self._add_mountconf(container, writer)
+            self.put_files(self._id(container), writer, container.engine)
+            return self.get_container(container)
+        logger.warning("Warm pool of image %s is exhausted" % image)
+        return None
+
+    def put_files(self, container_name, writer, engine = None):
+        """
+        @summary: upload several files into a container in a single request
+        @param writer: the files to upload, their names are absolute paths in the container
+        @type writer: kooplex.lib.tarstream.ArchiveWriter
+        @param engine: the engine the container lives on
+        """
         try:
-            status = self.client.put_archive(container = container_name, path = path, data = tarstream)
-            logger.info("container %s put_archive %s/%s returns %s" % (container_name, path, filename, status))
+            status = self.get_client(engine).put_archive(container = container_name, path = '/', data = writer.stream())
+            logger.info("container %s put_archive %s returns %s" % (container_name, writer.names, status))
         except Exception as e:
-            logger.error("container %s put_archive %s/%s fails -- %s" % (container_name, path, filename, e))
+            logger.error("container %s put_archive %s fails -- %s" % (container_name, writer.names, e))
 
+    def _writefile(self, container_name, path, filename, content):
+        writer = ArchiveWriter()
+        writer.add_data(os.path.join(path, filename), content)
+        self.put_files(container_name, writer)
 
-    def managemount(self, container):
-        from kooplex.lib.fs_dirname import Dirname
-        
-        path, filename = os.path.split(self.dockerconf.get('mountconf', '/tmp/mount.conf'))
+    def _add_mountconf(self, container, writer):
+        from hub.models import ContainerMountPlan
         mapper = []
-        for v in container.volumes:
-            mapper.extend([ "%s:%s" % (v.volumetype, d) for d in Dirname.containervolume_listfolders(container, v) ])
+        for v, folders in ContainerMountPlan.stored(container):
+            mapper.extend([ "%s:%s" % (v.volumetype, d) for d in folders ])
         #NOTE: mounter uses read to process the mapper configuration, thus we need to make sure '\n' terminates the config mapper file
         mapper.append('')
         logger.debug("container %s map %s" % (container, mapper))
-        file_data = "\n".join(mapper).encode('utf8')
-        self._writefile(container.name, path, filename, file_data)
+        writer.add_data(self.dockerconf.get('mountconf', '/tmp/mount.conf'), "\n".join(mapper).encode('utf8'))
+
+    def _add_environmentconf(self, container, writer):
+        envs = [ 'export %s=%s' % (k, shlex.quote(str(v))) for k, v in container.environment.items() ]
+        envs.append('')
+        logger.debug("container %s environment %s" % (container, envs))
+        writer.add_data(self.dockerconf.get('environmentconf', '/tmp/environment.conf'), "\n".join(envs).encode('utf8'))
 
-    def trigger_impersonator(self, vcproject):       #FIXME: dont call it 1-by-1
+    def managemount(self, container):
+        writer = ArchiveWriter()
+        self._add_mountconf(container, writer)
+        self.put_files(self._id(container), writer, container.engine)
+
+    def manageenvironment(self, container):
+        writer = ArchiveWriter()
+        self._add_environmentconf(container, writer)
+        self.put_files(self._id(container), writer, container.engine)
+
+    def trigger_impersonator(self, vcprojects):
+        """
+        @summary: ask the impersonator to run the clone scripts of several version control projects at once
+        @param vcprojects: the projects to clone, a single VCProject is also accepted
+        @type vcprojects: iterable of hub.models.VCProject
+        """
         from kooplex.lib.fs_dirname import Dirname
+        from hub.models import VCProject
+        if isinstance(vcprojects, VCProject):
+            vcprojects = [ vcprojects ]
         container_name = self.dockerconf.get('impersonator', 'impersonator')
         path, filename = os.path.split(self.dockerconf.get('gitcommandconf', '/tmp/gitcommand.conf'))
         cmdmaps = []
-        token = vcproject.token
-        fn_clonesh = os.path.join(Dirname.vcpcache(vcproject), "clone.sh")
-        fn_key = os.path.join(Dirname.userhome(vcproject.token.user), '.ssh', token.fn_rsa)
-        cmdmaps.append("%s:%s:%s:%s" % (token.user.username, fn_key, token.repository.domain, fn_clonesh))
+        for vcproject in vcprojects:
+            token = vcproject.token
+            fn_clonesh = os.path.join(Dirname.vcpcache(vcproject), "clone.sh")
+            fn_key = os.path.join(Dirname.userhome(token.user), '.ssh', token.fn_rsa)
+            cmdmaps.append("%s:%s:%s:%s" % (token.user.username, fn_key, token.repository.domain, fn_clonesh))
         cmdmaps.append('')
+        logger.debug("impersonator commands %s" % cmdmaps)
         file_data = "\n".join(cmdmaps).encode('utf8')
         self._writefile(container_name, path, filename, file_data)
+        return len(cmdmaps) - 1
 
 
     def run_container(self, container):
         docker_container_info = self.get_container(container)
+        if docker_container_info is None:
+            self.place(container)
+            docker_container_info = self.claim_warmcontainer(container)
         if docker_container_info is None:
             logger.debug("Container did not exist, Creating new one")
             docker_container_info = self.create_container(container)
-        container_state = docker_container_info['Status']
-        if container_state == 'Created' or container_state.startswith('Exited'):
+        container_state = docker_container_info['State']['Status']
+        if container_state in [ 'created', 'exited' ]:
             logger.debug("Starting container")
             self.start_container(container)
+        elif container_state == 'paused':
+            self.unpause_container(container)
 
     def refresh_container_state(self, container):
         docker_container_info = self.get_container(container)
-        container_state = docker_container_info['State']
+        container_state = docker_container_info['State']['Status']
         logger.debug("Container state %s" % container_state)
         container.last_message = str(container_state)
         container.last_message_at = now()
         container.save()
 
     def start_container(self, container):
-        self.client.start(container.name)
+        self._client(container).start(self._id(container))
         # we need to retrieve the container state after starting it
         docker_container_info = self.get_container(container)
-        container_state = docker_container_info['State']
+        container_state = docker_container_info['State']['Status']
         logger.debug("Container state %s" % container_state)
         container.last_message = str(container_state)
         container.last_message_at = now()
         assert container_state == 'running', "Container failed to start: %s" % docker_container_info
 
+    def pause_container(self, container):
+        self._client(container).pause(self._id(container))
+        container.last_message = 'Container paused'
+        logger.debug("Container paused %s" % container.name)
+
+    def unpause_container(self, container):
+        try:
+            self._client(container).unpause(self._id(container))
+            container.last_message = 'Container resumed'
+        except Exception as e:
+            logger.warn("docker container cannot be resumed -- %s" % e)
+            container.last_message = str(e)
+
     def stop_container(self, container):
         try:
-            self.client.stop(container.name)
+            self._client(container).stop(self._id(container))
             container.last_message = 'Container stopped'
         except Exception as e:
             logger.warn("docker container not found by API -- %s" % e)
@@ -194,7 +424,8 @@ class Docker:
 
     def remove_container(self, container):
         try:
-            self.client.remove_container(container.name)
+            self._client(container).remove_container(self._id(container))
+            container.docker_id = None
             container.last_message = 'Container removed'
             container.last_message_at = now()
         except Exception as e:
@@ -206,14 +437,14 @@ class Docker:
 #FIXME: az execute2 lesz az igazi...
     def execute(self, container, command):
         logger.info("execution: %s in %s" % (command, container))
-        execution = self.client.exec_create(container = container.name, cmd = shlex.split(command))
-        return self.client.exec_start(execution, detach = False)
+        execution = self._client(container).exec_create(container = container.name, cmd = shlex.split(command))
+        return self._client(container).exec_start(execution, detach = False)
 
     def execute2(self, container, command):
         logger.info("execution: %s in %s" % (command, container))
-        execution = self.client.exec_create(container = container.name, cmd = shlex.split(command))
-        response = self.client.exec_start(exec_id = execution['Id'], stream = False)
-        check = self.client.exec_inspect(exec_id = execution['Id'])
+        execution = self._client(container).exec_create(container = container.name, cmd = shlex.split(command))
+        response = self._client(container).exec_start(exec_id = execution['Id'], stream = False)
+        check = self._client(container).exec_inspect(exec_id = execution['Id'])
         self.check = check
         if check['ExitCode'] != 0:
             logger.error('Execution %s in %s failed -- %s' % (command, container, check))
@@ -9,11 +9,22 @@ import ast
 import time
 import glob
 import base64
+import stat
+import shutil
+import tempfile
 from distutils import dir_util
 from distutils import file_util
-import tarfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
+from django.db import transaction
+
+from kooplex.settings import KOOPLEX
 from kooplex.lib import bash, Dirname, Filename
+from kooplex.lib.acl import apply_acl, acl_user, acl_group
+from kooplex.lib.archiver import archive_folder, extract_archive
+from kooplex.lib.fastcopy import clone_tree
+from kooplex.lib.reportstore import publish_latest, publish_tag, gc
 
 logger = logging.getLogger(__name__)
 
@@ -36,22 +47,20 @@ def _mkdir(path, uid = 0, gid = 0, mode = 0b111101000):
 
 
 def _grantaccess(user, folder, acl = 'rwX'):
-    bash("setfacl -R -m u:%d:%s %s" % (user.profile.userid, acl, folder))
+    apply_acl(folder, [ acl_user(user.profile.userid, acl) ])
 
 def _revokeaccess(user, folder):
-    bash("setfacl -R -x u:%d %s" % (user.profile.userid, folder))
+    apply_acl(folder, [ acl_user(user.profile.userid, None) ])
 
 
-def _archivedir(folder, target, remove = True):
+def _archivedir(folder, target, remove = True, exclude = []):
     if not os.path.exists(folder):
         logger.warning("Folder %s is missing" % folder)
         return
     try:
         assert len(os.listdir(folder)) > 0, "Folder %s is empty" % folder
         dir_util.mkpath(os.path.dirname(target))
-        with tarfile.open(target, mode='w:gz') as archive:
-            archive.add(folder, arcname = '.', recursive = True)
-            logger.debug("tar %s -> %s" % (folder, target))
+        archive_folder(folder, target, exclude = exclude)
     except Exception as e:
         logger.error("Cannot create archive %s -- %s" % (folder, e))
     finally:
@@ -59,6 +68,42 @@ def _archivedir(folder, target, remove = True):
             dir_util.remove_tree(folder)
             logger.debug("Folder %s removed" % folder)
 
+def _pendingdir(folder):
+    """
+    @summary: the pending area on the filesystem of the folder, so that moving the folder there is a rename
+    """
+    mount = os.path.dirname(os.path.abspath(folder))
+    while not os.path.ismount(mount):
+        mount = os.path.dirname(mount)
+    return os.path.join(mount, '.archive-pending')
+
+def _archivedir_async(folder, target):
+    """
+    @summary: move the folder out of its place at once, an archiver worker compresses and removes it later.
+    The move happens when the current transaction commits.
+    """
+    def submit():
+        from hub.models import ArchiveJob
+        if not os.path.exists(folder):
+            logger.warning("Folder %s is missing" % folder)
+            return
+        if len(os.listdir(folder)) == 0:
+            dir_util.remove_tree(folder)
+            logger.debug("Empty folder %s removed" % folder)
+            return
+        dir_pending = _pendingdir(folder)
+        _mkdir(dir_pending, mode = 0o700)
+        pending = os.path.join(dir_pending, "%s.%f" % (os.path.basename(folder), time.time()))
+        try:
+            os.rename(folder, pending)
+        except OSError as e:
+            logger.warning("Cannot move %s to the pending area, archiving in place -- %s" % (folder, e))
+            _archivedir(folder, target)
+            return
+        job = ArchiveJob.objects.create(folder = folder, pending = pending, target = target)
+        logger.info("%s submitted" % job)
+    transaction.on_commit(submit)
+
 def _copy_dir(f_source, f_target, remove = False):
     if not os.path.exists(f_source):
         msg = "Folder %s not found" % f_source
@@ -99,7 +144,7 @@ def mkdir_home(user):
 def garbagedir_home(user):
     dir_home = Dirname.userhome(user)
     garbage = Filename.userhome_garbage(user)
-    _archivedir(dir_home, garbage)
+    _archivedir_async(dir_home, garbage)
 
 ########################################
 
@@ -141,24 +186,30 @@ def mkdir_reportprepare(user):
     _mkdir(dir_reportprepare, uid = user.profile.userid, gid = user.profile.groupid)
 
 def snapshot_report(report):
-    #create permanent dir
     dir_source = os.path.join(Dirname.reportprepare(report.creator), report.folder)
-    dir_target = os.path.join(Dirname.report(report), 'latest')
-    _copy_dir(dir_source, dir_target, remove = False)
-    #create tagged dir, if there is any tag
+    if not os.path.exists(dir_source):
+        msg = "Folder %s not found" % dir_source
+        logger.error(msg)
+        raise Exception(msg)
+    store = Dirname.reportblobs(report.creator)
+    _mkdir(store, mode = 0o700)
+    #create permanent dir, only new or changed files are copied
+    farm, stats = publish_latest(dir_source, Dirname.report(report), store)
+    #create tagged dir, if there is any tag, it links the same files
     if report.tag_name:
-        dir_source = os.path.join(Dirname.reportprepare(report.creator), report.folder)
-        dir_target = Dirname.report_with_tag(report)
-        _copy_dir(dir_source, dir_target, remove = False)
+        publish_tag(farm, Dirname.report_with_tag(report), store)
+    gc(store)
 
     dir_reportroot = Dirname.reportroot(report.creator)
     _grantaccess(report.creator, dir_reportroot, acl = 'rX')
 
 def garbage_report(report):
-    #remove tagged report
+    #remove tagged report, the files still linked by other versions are kept in the store
     dir_source = Dirname.report_with_tag(report)
     garbage = Filename.report_garbage(report)
-    _archivedir(dir_source, garbage, remove = True)
+    _archivedir_async(dir_source, garbage)
+    # blobs released by earlier removals
+    gc(Dirname.reportblobs(report.creator))
 
 def prepare_dashboardreport_withinitcell(report):
     import json
@@ -173,7 +224,17 @@ def prepare_dashboardreport_withinitcell(report):
     d['metadata'].clear()
     d['metadata']['kernelspec'] = kernel
     d['metadata']['language_info'] = language
-    json.dump(d, open(fn, 'w'))
+    # the notebook is a hardlink shared by other versions, replace it instead of writing it in place
+    mode = stat.S_IMODE(os.stat(fn).st_mode)
+    fd, tmp = tempfile.mkstemp(dir = os.path.dirname(fn), prefix = '.%s.' % os.path.basename(fn))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(d, f)
+        os.chmod(tmp, mode)
+        os.replace(tmp, fn)
+    except:
+        os.unlink(tmp)
+        raise
 
 
 
@@ -188,18 +249,7 @@ def mkdir_share(userprojectbinding):
 def garbagedir_share(userprojectbinding):
     dir_share = Dirname.share(userprojectbinding)
     garbage = Filename.share_garbage(userprojectbinding)
-    _archivedir(dir_share, garbage)
-
-
-def grantaccess_share(userprojectbinding):
-    user = userprojectbinding.user
-    dir_share = Dirname.share(userprojectbinding)
-    _grantaccess(user, dir_share)
-
-def revokeaccess_share(userprojectbinding):
-    user = userprojectbinding.user
-    dir_share = Dirname.share(userprojectbinding)
-    _revokeaccess(user, dir_share)
+    _archivedir_async(dir_share, garbage)
 
 
 def mkdir_workdir(userprojectbinding):
@@ -209,32 +259,45 @@ def mkdir_workdir(userprojectbinding):
 def archivedir_workdir(userprojectbinding):
     dir_workdir = Dirname.workdir(userprojectbinding)
     target = Filename.workdir_archive(userprojectbinding)
-    _archivedir(dir_workdir, target)
-
-
-#FIXME: obsoleted
-##def mkdir_vcpcache(vcprojectprojectbinding):
-##    profile = vcprojectprojectbinding.vcproject.token.user.profile
-##    dir_cache = Dirname.vcpcache(vcprojectprojectbinding.vcproject)
-##    _mkdir(dir_cache, uid = profile.userid, gid = profile.groupid)
-##    clonescript_vcpcache(vcprojectprojectbinding)
-
-#FIXME: obsoleted
-##def clonescript_vcpcache(vcprojectprojectbinding):
-##    vcp = vcprojectprojectbinding.vcproject
-##    profile = vcp.token.user.profile
-##    dir_target = Dirname.vcpcache(vcprojectprojectbinding.vcproject)
-##    fn_script = os.path.join(dir_target, "clone.sh")
-##    script = """
-###! /bin/bash
-##
-##set -v
-##
-##mv $0 $(mktemp)
-##
-##git clone ssh://git@%s/%s %s
-##    """ % (vcp.token.repository.domain, vcp.project_name, dir_target)
-##    _createfile(fn_script, script, uid = profile.userid, gid = profile.groupid)
+    _archivedir_async(dir_workdir, target)
+
+
+def mkdir_vcpcache(vcproject):
+    profile = vcproject.token.user.profile
+    dir_cache = Dirname.vcpcache(vcproject)
+    _mkdir(dir_cache, uid = profile.userid, gid = profile.groupid)
+    clonescript_vcpcache(vcproject)
+
+def clonescript_vcpcache(vcproject):
+    import shlex
+    token = vcproject.token
+    profile = token.user.profile
+    dir_target = Dirname.vcpcache(vcproject)
+    fn_script = os.path.join(dir_target, "clone.sh")
+    # the same port and key the impersonator API is given, the prefix of the backend is part of the folder name
+    fn_rsa = '/home/{}/.ssh/{}'.format(token.user.username, token.fn_rsa)
+    ssh_command = "ssh -p %d -i %s -o StrictHostKeyChecking=no" % (token.repository.ssh_port, shlex.quote(fn_rsa))
+    script = """
+#! /bin/bash
+
+set -v
+
+mv $0 $(mktemp)
+
+GIT_SSH_COMMAND=%s git clone %s %s
+    """ % (shlex.quote(ssh_command), shlex.quote(vcproject.project_ssh_url), shlex.quote(dir_target))
+    _createfile(fn_script, script, uid = profile.userid, gid = profile.groupid)
+
+def rmclonescript_vcpcache(vcproject):
+    """
+    @summary: undo mkdir_vcpcache of a clone that was not shipped to the impersonator
+    """
+    dir_target = Dirname.vcpcache(vcproject)
+    try:
+        os.remove(os.path.join(dir_target, "clone.sh"))
+        os.rmdir(dir_target)
+    except OSError as e:
+        logger.warning("Cannot clean up %s -- %s" % (dir_target, e))
 
 def archivedir_vcpcache(vcproject):
     dir_cache = Dirname.vcpcache(vcproject)
@@ -253,33 +316,10 @@ def mkdir_course_share(course):
         logger.error("Cannot create course dir, KOOPLEX['mountpoint']['course'] is missing")
 
 
-def grantacl_course_share(usercoursebinding):
-    try:
-        dir_coursepublic = Dirname.coursepublic(usercoursebinding.course)
-        dir_courseprivate = Dirname.courseprivate(usercoursebinding.course)
-        if usercoursebinding.is_teacher:
-            _grantaccess(usercoursebinding.user, dir_coursepublic)
-            _grantaccess(usercoursebinding.user, dir_courseprivate)
-        else:
-            _grantaccess(usercoursebinding.user, dir_coursepublic, acl = 'rX')
-    except Exception as e:
-        logger.error("Cannot grant acl %s -- %s" % (usercoursebinding, e))
-
-def revokeacl_course_share(usercoursebinding):
-    try:
-        dir_coursepublic = Dirname.coursepublic(usercoursebinding.course)
-        dir_courseprivate = Dirname.courseprivate(usercoursebinding.course)
-        if usercoursebinding.is_teacher:
-            _revokeaccess(usercoursebinding.user, dir_courseprivate)
-        _revokeaccess(usercoursebinding.user, dir_coursepublic)
-    except Exception as e:
-        logger.error("Cannot revoke acl %s -- %s" % (usercoursebinding, e))
-
-
 def garbagedir_course_share(course):
     dir_course = Dirname.course(course)
     garbage = Filename.course_garbage(course)
-    _archivedir(dir_course, garbage)
+    _archivedir_async(dir_course, garbage)
 
 
 def mkdir_course_workdir(usercoursebinding):
@@ -292,21 +332,33 @@ def mkdir_course_workdir(usercoursebinding):
         logger.error("Cannot create course dir, KOOPLEX['mountpoint']['usercourse'] is missing")
 
 
-def grantacl_course_workdir(usercoursebinding):
-    try:
-        if usercoursebinding.is_teacher:
-            dir_usercourse = Dirname.courseworkdir(usercoursebinding)
-            _grantaccess(usercoursebinding.user, dir_usercourse, acl = 'rX') #NOTE: formerly rw access was granted
-    except Exception as e:
-        logger.error("Cannot grant acl %s -- %s" % (usercoursebinding, e))
-
-def revokeacl_course_workdir(usercoursebinding):
-    try:
-        if usercoursebinding.is_teacher:
-            dir_usercourse = Dirname.courseworkdir(usercoursebinding)
-            _revokeaccess(usercoursebinding.user, dir_usercourse)
-    except Exception as e:
-        logger.error("Cannot revoke acl %s -- %s" % (usercoursebinding, e))
+def rolegroup_folders(group):
+    """
+    @summary: the folders a project or course role group has access to
+    @returns: a list of (folder, acl)
+    """
+    from hub.models import UserProjectBinding, UserCourseBinding
+    if group.project:
+        return [ (Dirname.share(UserProjectBinding(project = group.project)), 'rwX') ]
+    if group.role == group.RL_TEACHER:
+        return [
+            (Dirname.coursepublic(group.course), 'rwX'),
+            (Dirname.courseprivate(group.course), 'rwX'),
+            (Dirname.courseworkdir(UserCourseBinding(course = group.course)), 'rX'), #NOTE: formerly rw access was granted
+        ]
+    return [ (Dirname.coursepublic(group.course), 'rX') ]
+
+def grantacl_rolegroup(group, revoke_uids = []):
+    """
+    @summary: grant a role group access to its folders, membership is then managed in ldap only
+    @param revoke_uids: per-user entries to drop in the same walk
+    """
+    for folder, acl in rolegroup_folders(group):
+        try:
+            edits = [ acl_group(group.groupid, acl) ] + [ acl_user(uid, None) for uid in revoke_uids ]
+            apply_acl(folder, edits)
+        except Exception as e:
+            logger.error("Cannot grant acl %s on %s -- %s" % (group, folder, e))
 
 
 def archive_course_workdir(usercoursebinding):
@@ -314,7 +366,7 @@ def archive_course_workdir(usercoursebinding):
         return
     dir_usercourse = Dirname.usercourseworkdir(usercoursebinding)
     archive = Filename.courseworkdir_archive(usercoursebinding)
-    _archivedir(dir_usercourse, archive)
+    _archivedir_async(dir_usercourse, archive)
 
 
 def rmdir_course_workdir(course):
@@ -338,20 +390,70 @@ def garbage_assignmentsnapshot(assignment):
         file_util.move_file(archive, garbage)
     except Exception as e:
         logger.error("move %s -> %s fails -- %s" % (archive, garbage, e))
+    dir_template = Dirname.assignmenttemplate(assignment)
+    if os.path.exists(dir_template):
+        shutil.rmtree(dir_template)
+        logger.debug("Folder %s removed" % dir_template)
 
-def cp_assignmentsnapshot(userassignmentbinding):
+def _assignmenttemplate(assignment):
+    """
+    @summary: extract the snapshot of an assignment once, only root can access the template
+    """
+    dir_template = Dirname.assignmenttemplate(assignment)
+    if os.path.isdir(dir_template):
+        return dir_template
+    _mkdir(os.path.dirname(dir_template), mode = 0o700)
+    dir_tmp = "%s.%f.tmp" % (dir_template, time.time())
+    extract_archive(Filename.assignmentsnapshot(assignment), dir_tmp)
+    try:
+        os.rename(dir_tmp, dir_template)
+        logger.info("Assignment %s template extracted in %s" % (assignment, dir_template))
+    except OSError:
+        # a concurrent handout was faster
+        shutil.rmtree(dir_tmp)
+    return dir_template
+
+def handout_assignment(assignment, userassignmentbindings, workers = None):
+    """
+    @summary: copy the extracted snapshot of an assignment to the workdir of students in parallel.
+    The copies share data blocks with the template on reflink capable filesystems, they never share inodes.
+    """
     from hub.models import UserCourseBinding
+    if not userassignmentbindings:
+        return
+    t0 = time.time()
+    workers = workers if workers else KOOPLEX.get('handout', {}).get('workers', 8)
     try:
-        assignment = userassignmentbinding.assignment
-        archivefile = Filename.assignmentsnapshot(assignment)
-        dir_target = Dirname.assignmentworkdir(userassignmentbinding)
-        with tarfile.open(archivefile, mode = 'r') as archive:
-            archive.extractall(path = dir_target)
-        _revokeaccess(userassignmentbinding.user, dir_target)
-        for binding in UserCourseBinding.objects.filter(course = assignment.coursecode.course, is_teacher = True):
-            _grantaccess(binding.user, dir_target, acl = 'rX')
+        dir_template = _assignmenttemplate(assignment)
     except Exception as e:
-        logger.error("Cannot cp snapshot dir %s -- %s" % (userassignmentbinding, e))
+        logger.error("Cannot extract snapshot of %s -- %s" % (assignment, e))
+        return
+    teachers = [ acl_user(binding.user.profile.userid, 'rX') for binding in UserCourseBinding.objects.filter(course = assignment.coursecode.course, is_teacher = True).select_related('user__profile') ]
+    tasks = []
+    for binding in userassignmentbindings:
+        try:
+            tasks.append((binding, Dirname.assignmentworkdir(binding), [ acl_user(binding.user.profile.userid, None) ] + teachers))
+        except Exception as e:
+            logger.error("Cannot cp snapshot dir %s -- %s" % (binding, e))
+    def handout(task):
+        binding, dir_target, edits = task
+        try:
+            stats = clone_tree(dir_template, dir_target)
+            apply_acl(dir_target, edits, workers = 2)
+            return stats
+        except Exception as e:
+            logger.error("Cannot cp snapshot dir %s -- %s" % (binding, e))
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        results = [ stats for stats in pool.map(handout, tasks) if stats ]
+    elapsed = time.time() - t0
+    n_bytes = sum([ stats.bytes for stats in results ])
+    methods = Counter()
+    for stats in results:
+        methods.update(stats.methods)
+    logger.info("handout %s: %d of %d students, %d files, %.1f MB in %.1f s (%.1f MB/s) %s" % (assignment, len(results), len(userassignmentbindings), sum([ stats.files for stats in results ]), n_bytes / 1e6, elapsed, n_bytes / 1e6 / max(elapsed, 1e-3), dict(methods)))
+
+def cp_assignmentsnapshot(userassignmentbinding):
+    handout_assignment(userassignmentbinding.assignment, [ userassignmentbinding ], workers = 1)
 
 def cp_userassignment(userassignmentbinding):
     dir_source = Dirname.assignmentworkdir(userassignmentbinding)
@@ -362,10 +464,8 @@ def cp_userassignment2correct(userassignmentbinding):
     try:
         archivefile = Filename.assignmentcollection(userassignmentbinding)
         dir_target = Dirname.assignmentcorrectdir(userassignmentbinding)
-        with tarfile.open(archivefile, mode='r') as archive:
-            archive.extractall(path = dir_target)
-        _grantaccess(userassignmentbinding.corrector, dir_target, acl = 'rwX')
-        _grantaccess(userassignmentbinding.user, dir_target, acl = 'rX')
+        extract_archive(archivefile, dir_target)
+        apply_acl(dir_target, [ acl_user(userassignmentbinding.corrector.profile.userid, 'rwX'), acl_user(userassignmentbinding.user.profile.userid, 'rX') ])
     except Exception as e:
         logger.error("Cannot copy correct dir %s -- %s" % (userassignmentbinding, e))
 
@@ -25,6 +25,11 @@ class Dirname:
     def reportprepare(user):
         return os.path.join(Dirname.reportroot(user), '_prepare')
 
+    @staticmethod
+    def reportblobs(user):
+        # on the report filesystem, so that versions can hardlink the files, but out of the mounted report root
+        return os.path.join(Dirname.mountpoint['report'], '.blobs', user.username)
+
     @staticmethod
     def report(report):
         return os.path.join(Dirname.reportroot(report.creator), standardize_str(report.name))
@@ -73,6 +78,11 @@ class Dirname:
     def assignmentsource(assignment):
         return os.path.join(Dirname.courseprivate(assignment.coursecode.course), assignment.folder)
 
+    @staticmethod
+    def assignmenttemplate(assignment):
+        # on the filesystem of the course workdirs, so that copies can share data blocks
+        return os.path.join(Dirname.mountpoint['usercourse'], '.assignmenttemplate', assignment.coursecode.course.folder, '%s.%d' % (assignment.safename, assignment.created_at.timestamp()))
+
     @staticmethod
     def assignmentworkdir(userassignmentbinding):
         from hub.models import UserCourseBinding
@@ -90,66 +100,42 @@ class Dirname:
 
 
     @staticmethod
-    def containervolume_listfolders(container, volume):
-        from hub.models import UserCourseBinding, UserAssignmentBinding
-        def get_usercoursebinding_userstate():
-            try:
-                usercoursebinding = UserCourseBinding.objects.get(user = container.user, course = container.course)
-            except UserCourseBinding.DoesNotExist:
-                logger.error("Silly situation, cannot map %s %s COZ user course binding instance is missing" % (volume, container))
-                return None, None
-            if container.course in container.user.profile.courses_taught():
-                return usercoursebinding, 'teacher'
-            elif container.course in container.user.profile.courses_attend():
-                return usercoursebinding, 'student'
-            else:
-                logger.error("Silly situation, cannot map %s %s" % (volume, container))
-                return None, None
+    def containervolume_listfolders(container, volume, context = None):
+        context = context if context else MountContext(container)
 
         if volume.volumetype == volume.HOME:
             yield Dirname.userhome(container.user)
         elif volume.volumetype == volume.GARBAGE:
             yield Dirname.usergarbage(container.user)
         elif volume.volumetype == volume.SHARE:
-            for upb in container.userprojectbindings:
+            for upb in context.userprojectbindings:
                 yield Dirname.share(upb)
         elif volume.volumetype == volume.WORKDIR:
-            for upb in container.userprojectbindings:
+            for upb in context.userprojectbindings:
                 yield Dirname.workdir(upb)
         elif volume.volumetype == volume.GIT:
-            for vcppb in container.vcprojectprojectbindings:
+            for vcppb in context.vcprojectprojectbindings:
                 yield Dirname.vcpcache(vcppb.vcproject)
         elif volume.volumetype == volume.FILESYNC:
-            for fslpb in container.fslibraryprojectbindings:
+            for fslpb in context.fslibraryprojectbindings:
                 yield Dirname.fscache(fslpb.fslibrary)
         elif volume.volumetype == volume.COURSE_SHARE:
-            if container.course in container.user.profile.courses_taught():
-                yield Dirname.course(container.course)
-            elif container.course in container.user.profile.courses_attend():
-                yield Dirname.coursepublic(container.course)
+            if context.userstatus == 'teacher':
+                yield Dirname.course(context.course)
+            elif context.userstatus == 'student':
+                yield Dirname.coursepublic(context.course)
             else:
                 logger.error("Silly situation, cannot map %s %s" % (volume, container))
-        elif volume.volumetype == volume.COURSE_WORKDIR and container.course:
-            usercoursebinding, userstatus = get_usercoursebinding_userstate()
-            if userstatus == 'teacher':
-                yield Dirname.courseworkdir(usercoursebinding)
-            elif userstatus == 'student':
-                yield Dirname.usercourseworkdir(usercoursebinding)
+        elif volume.volumetype == volume.COURSE_WORKDIR and context.course:
+            if context.userstatus == 'teacher':
+                yield Dirname.courseworkdir(context.usercoursebinding)
+            elif context.userstatus == 'student':
+                yield Dirname.usercourseworkdir(context.usercoursebinding)
             else:
                 yield "OOPS_%s" % volume.volumetype
-        elif volume.volumetype == volume.COURSE_ASSIGNMENTDIR and container.course:
-            _, userstatus = get_usercoursebinding_userstate()
-            if userstatus == 'teacher':
-                for binding in UserAssignmentBinding.objects.all():
-                    if binding.state == UserAssignmentBinding.ST_QUEUED or binding.corrector is None or binding.assignment.coursecode.course != container.course:
-                        continue
-                    if binding.corrector != container.user:
-                        continue
-                    yield Dirname.assignmentcorrectdir(binding)
-            elif userstatus == 'student':
-                for binding in UserAssignmentBinding.objects.filter(user = container.user):
-                    if binding.state == UserAssignmentBinding.ST_QUEUED or binding.corrector is None or binding.assignment.coursecode.course != container.course:
-                        continue
+        elif volume.volumetype == volume.COURSE_ASSIGNMENTDIR and context.course:
+            if context.userstatus in [ 'teacher', 'student' ]:
+                for binding in context.userassignmentbindings:
                     yield Dirname.assignmentcorrectdir(binding)
             else:
                 yield "OOPS_%s" % volume.volumetype
@@ -158,4 +144,110 @@ class Dirname:
         else:
             yield "MISSING_DIRNAME_%s" % volume.volumetype
 
+    @staticmethod
+    def container_mountplan(container, volumetypes = None):
+        """
+        @summary: the folders to mount for each volume of a container, the number of queries does not depend on the number of bindings
+        @param volumetypes: restrict the plan to these types of volumes, only the bindings they depend on are fetched
+        @returns: a list of (volume, list of folders)
+        """
+        from hub.models import VolumeContainerBinding
+        context = MountContext(container)
+        bindings = VolumeContainerBinding.objects.filter(container = container)
+        if volumetypes is not None:
+            bindings = bindings.filter(volume__volumetype__in = volumetypes)
+        volumes = [ binding.volume for binding in bindings.select_related('volume') ]
+        return [ (volume, list(Dirname.containervolume_listfolders(container, volume, context))) for volume in volumes ]
+
+
+class MountContext:
+    """
+    @summary: the bindings a mount plan of a container depends on, each of them is fetched by a single query when first needed
+    """
+    def __init__(self, container):
+        self.container = container
+        self._cache = {}
+
+    def _get(self, key, method):
+        if not key in self._cache:
+            self._cache[key] = method()
+        return self._cache[key]
+
+    @property
+    def userprojectbindings(self):
+        def fetch():
+            from hub.models import UserProjectBinding, ProjectContainerBinding
+            project_ids = ProjectContainerBinding.objects.filter(container = self.container).values('project_id')
+            bindings = list(UserProjectBinding.objects.filter(user_id = self.container.user_id, project_id__in = project_ids).select_related('project', 'user'))
+            # the folder names depend on the creator of the project
+            creators = dict([ (b.project_id, b.user) for b in UserProjectBinding.objects.filter(project_id__in = project_ids, role = UserProjectBinding.RL_CREATOR).select_related('user') ])
+            for binding in bindings:
+                binding.project._creator = creators.get(binding.project_id)
+            return bindings
+        return self._get('upb', fetch)
+
+    @property
+    def vcprojectprojectbindings(self):
+        def fetch():
+            from hub.models import VCProjectProjectBinding, ProjectContainerBinding, UserProjectBinding
+            project_ids = ProjectContainerBinding.objects.filter(container = self.container).values('project_id')
+            creators = dict([ (b.project_id, b.user_id) for b in UserProjectBinding.objects.filter(project_id__in = project_ids, role = UserProjectBinding.RL_CREATOR) ])
+            mine = []
+            serve_history = {}
+            for vcppb in VCProjectProjectBinding.objects.filter(project_id__in = project_ids).select_related('vcproject__token'):
+                owner = vcppb.vcproject.token.user_id
+                if owner == self.container.user_id:
+                    mine.append(vcppb)
+                    serve_history[vcppb.project_id] = None
+                if owner == creators.get(vcppb.project_id):
+                    if not vcppb.project_id in serve_history:
+                        serve_history[vcppb.project_id] = vcppb
+            return mine + [ vcppb for vcppb in serve_history.values() if vcppb is not None ]
+        return self._get('vcppb', fetch)
+
+    @property
+    def fslibraryprojectbindings(self):
+        def fetch():
+            from hub.models import FSLibraryProjectBinding, ProjectContainerBinding
+            project_ids = ProjectContainerBinding.objects.filter(container = self.container).values('project_id')
+            return list(FSLibraryProjectBinding.objects.filter(project_id__in = project_ids, fslibrary__token__user_id = self.container.user_id).select_related('fslibrary'))
+        return self._get('fslpb', fetch)
+
+    @property
+    def usercoursebinding(self):
+        def fetch():
+            from hub.models import UserCourseBinding, CourseContainerBinding
+            course_ids = CourseContainerBinding.objects.filter(container = self.container).values('course_id')
+            for binding in UserCourseBinding.objects.filter(user_id = self.container.user_id, course_id__in = course_ids).select_related('course', 'user'):
+                return binding
+            logger.error("Silly situation, cannot map %s COZ user course binding instance is missing" % self.container)
+        return self._get('ucb', fetch)
+
+    @property
+    def course(self):
+        binding = self.usercoursebinding
+        return binding.course if binding else None
+
+    @property
+    def userstatus(self):
+        binding = self.usercoursebinding
+        if binding is None:
+            return None
+        return 'teacher' if binding.is_teacher else 'student'
+
+    @property
+    def userassignmentbindings(self):
+        """
+        @summary: the correction folders, teachers see the ones they correct, students their own feedbacks
+        """
+        def fetch():
+            from hub.models import UserAssignmentBinding
+            bindings = UserAssignmentBinding.objects.filter(assignment__coursecode__course = self.course, corrector__isnull = False).exclude(state = UserAssignmentBinding.ST_QUEUED)
+            if self.userstatus == 'teacher':
+                bindings = bindings.filter(corrector_id = self.container.user_id)
+            else:
+                bindings = bindings.filter(user_id = self.container.user_id)
+            return list(bindings.select_related('assignment__coursecode__course', 'user', 'corrector'))
+        return self._get('uab', fetch)
+
 
@@ -2,49 +2,63 @@ import os
 import time
 
 from .fs_dirname import Dirname
+from .archiver import CODECS, extension
 from kooplex.settings import KOOPLEX
 
+def _archive(path):
+    return "%s.%s" % (path, extension())
+
+def _archive_existing(path):
+    """
+    @summary: an archive of a stable name may have been written by an other codec
+    """
+    for codec in CODECS:
+        fn = "%s.%s" % (path, extension(codec))
+        if os.path.exists(fn):
+            return fn
+    return _archive(path)
+
 class Filename:
     mountpoint = KOOPLEX.get('mountpoint', {})
 
     @staticmethod
     def userhome_garbage(user):
-        return os.path.join(Dirname.mountpoint['garbage'], "user-%s.%f.tar.gz" % (user.username, time.time()))
+        return _archive(os.path.join(Dirname.mountpoint['garbage'], "user-%s.%f" % (user.username, time.time())))
 
     @staticmethod
     def share_garbage(userprojectbinding):
-        return os.path.join(Dirname.mountpoint['garbage'], "projectshare-%s.%f.tar.gz" % (userprojectbinding.project.uniquename, time.time()))
+        return _archive(os.path.join(Dirname.mountpoint['garbage'], "projectshare-%s.%f" % (userprojectbinding.project.uniquename, time.time())))
 
     @staticmethod
     def workdir_archive(userprojectbinding):
-        return os.path.join(Dirname.mountpoint['home'], userprojectbinding.user.username, "garbage", "workdir-%s.%f.tar.gz" % (userprojectbinding.uniquename, time.time()))
+        return _archive(os.path.join(Dirname.mountpoint['home'], userprojectbinding.user.username, "garbage", "workdir-%s.%f" % (userprojectbinding.uniquename, time.time())))
 
     @staticmethod
     def vcpcache_archive(vcproject):
-        return os.path.join(Dirname.mountpoint['home'], vcproject.token.user.username, "garbage", "git-%s.%f.tar.gz" % (vcproject.uniquename, time.time()))
+        return _archive(os.path.join(Dirname.mountpoint['home'], vcproject.token.user.username, "garbage", "git-%s.%f" % (vcproject.uniquename, time.time())))
 
     @staticmethod
     def course_garbage(course):
-        return os.path.join(Dirname.mountpoint['garbage'], "course-%s.%f.tar.gz" % (course.folder, time.time()))
+        return _archive(os.path.join(Dirname.mountpoint['garbage'], "course-%s.%f" % (course.folder, time.time())))
 
     @staticmethod
     def courseworkdir_archive(usercoursebinding):
-        return os.path.join(Dirname.mountpoint['home'], usercoursebinding.user.username, "garbage", "%s.%f.tar.gz" % (usercoursebinding.course.folder, time.time()))
+        return _archive(os.path.join(Dirname.mountpoint['home'], usercoursebinding.user.username, "garbage", "%s.%f" % (usercoursebinding.course.folder, time.time())))
 
     @staticmethod
     def assignmentsnapshot(assignment):
-        return os.path.join(Dirname.mountpoint['assignment'], assignment.coursecode.course.folder, 'assignmentsnapshot-%s.%d.tar.gz' % (assignment.safename, assignment.created_at.timestamp()))
+        return _archive_existing(os.path.join(Dirname.mountpoint['assignment'], assignment.coursecode.course.folder, 'assignmentsnapshot-%s.%d' % (assignment.safename, assignment.created_at.timestamp())))
 
     @staticmethod
     def assignmentsnapshot_garbage(assignment):
-        return os.path.join(Dirname.mountpoint['garbage'], 'assignmentsnapshot-%s-%s-%s-%f.tar.gz' % (assignment.coursecode.course.folder, assignment.safename, assignment.created_at.timestamp(), time.time()))
+        return _archive(os.path.join(Dirname.mountpoint['garbage'], 'assignmentsnapshot-%s-%s-%s-%f' % (assignment.coursecode.course.folder, assignment.safename, assignment.created_at.timestamp(), time.time())))
 
     @staticmethod
     def assignmentcollection(userassignmentbinding):
         assignment = userassignmentbinding.assignment
-        return os.path.join(Dirname.mountpoint['assignment'], assignment.coursecode.course.folder, 'submitted-%s-%s.%d.tar.gz' % (assignment.safename, userassignmentbinding.user.username, userassignmentbinding.submitted_at.timestamp()))
+        return _archive_existing(os.path.join(Dirname.mountpoint['assignment'], assignment.coursecode.course.folder, 'submitted-%s-%s.%d' % (assignment.safename, userassignmentbinding.user.username, userassignmentbinding.submitted_at.timestamp())))
 
     @staticmethod
     def report_garbage(report):
-        return os.path.join(Dirname.mountpoint['garbage'], report.creator.username, "report-%s-%s.%f.tar.gz" % (report.name, report.ts_human, time.time()))
+        return _archive(os.path.join(Dirname.mountpoint['garbage'], report.creator.username, "report-%s-%s.%f" % (report.name, report.ts_human, time.time())))
 
@@ -3,7 +3,7 @@ import os
 import requests
 
 from kooplex.settings import KOOPLEX
-from kooplex.lib import keeptrying
+from kooplex.lib.retry import get_policy
 
 def jupyter_session(container):
     """
@@ -13,5 +13,5 @@ def jupyter_session(container):
         'url': os.path.join(KOOPLEX.get('spawner', {}).get('pattern_jupyterapi') % info, 'sessions'), 
         'headers': {'Authorization': 'token %s' % container.report.password, },
     }
-    return keeptrying(requests.get, 50, **kw)
+    return get_policy('notebook').call(requests.get, **kw)
  
@@ -47,6 +47,7 @@ def keeptrying(method, times, **kw):
     @param kw: keyword arguments to pass to the method
     @returns the return value of method
     @raises the last exception if calling th method fails times many times
+    @deprecated: the waiting time is unbounded, use the named policies of kooplex.lib.retry
     """
     dt = .1
     while times > 0:
@@ -0,0 +1,88 @@
+"""
+@author: Jozsef Steger
+@summary: placement policies deciding which docker engine hosts a new container
+
+A policy is a callable policy(docker, container, engines) returning the name of the chosen engine.
+KOOPLEX['docker']['placement'] names one of the built in policies or gives the dotted path of a custom one.
+"""
+import logging
+
+from django.utils.module_loading import import_string
+
+from kooplex.settings import KOOPLEX
+
+logger = logging.getLogger(__name__)
+
+def free_memory(docker, engines):
+    """
+    @summary: the memory (MB) not yet committed to running and starting containers per engine, unreachable engines are left out
+    """
+    from kooplex.lib.admission import Admission
+    free = {}
+    for engine in engines:
+        try:
+            admission = Admission(docker, engine)
+            mem_committed, _ = admission.committed()
+            free[engine] = admission.mem_capacity - mem_committed
+        except Exception as e:
+            logger.warning("engine %s is not available -- %s" % (engine, e))
+    return free
+
+def least_loaded(docker, container, engines):
+    """
+    @summary: the engine with the most uncommitted memory
+    """
+    free = free_memory(docker, engines)
+    if not free:
+        logger.error("none of the engines %s are available, falling back to %s" % (engines, docker.default_engine))
+        return docker.default_engine
+    return max(sorted(free), key = lambda engine: free[engine])
+
+def image_locality(docker, container, engines):
+    """
+    @summary: prefer engines which already hold the image of the container to avoid pulling it
+    """
+    imagename = container.image.imagename if container.image else docker.dockerconf.get('default_image', 'basic')
+    candidates = []
+    for engine in engines:
+        try:
+            if docker.has_image(imagename, engine):
+                candidates.append(engine)
+        except Exception as e:
+            logger.warning("engine %s is not available -- %s" % (engine, e))
+    logger.debug("image %s is present on engines %s" % (imagename, candidates))
+    return least_loaded(docker, container, candidates if candidates else engines)
+
+def course_affinity(docker, container, engines):
+    """
+    @summary: keep the containers of a course together on the engine already hosting most of them, as long as it has room left
+    """
+    from hub.models import CourseContainerBinding
+    course = container.course
+    if course is None:
+        return image_locality(docker, container, engines)
+    mem_limit, _ = container.resource_limits
+    free = free_memory(docker, engines)
+    engines = [ engine for engine in engines if free.get(engine, 0) >= mem_limit ]
+    counts = {}
+    for engine in CourseContainerBinding.objects.filter(course = course).exclude(container = container).values_list('container__engine', flat = True):
+        engine = engine if engine else docker.default_engine
+        if engine in engines:
+            counts[engine] = counts.get(engine, 0) + 1
+    if not counts:
+        return image_locality(docker, container, engines if engines else list(free))
+    best = max(counts.values())
+    logger.debug("course %s has containers on engines %s" % (course, counts))
+    return least_loaded(docker, container, [ engine for engine in engines if counts.get(engine) == best ])
+
+POLICIES = {
+    'least_loaded': least_loaded,
+    'image_locality': image_locality,
+    'course_affinity': course_affinity,
+}
+
+def get_policy():
+    policy = KOOPLEX.get('docker', {}).get('placement', 'least_loaded')
+    if policy in POLICIES:
+        return POLICIES[policy]
+    return import_string(policy)
@@ -5,95 +5,120 @@ import os
 import json
 import requests
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from kooplex.settings import KOOPLEX
 from hub.models import Container, Report
-from kooplex.lib import keeptrying
+from kooplex.lib.retry import get_policy
+from kooplex.lib import routemap
 
 logger = logging.getLogger(__name__)
 
+class ProxyClient:
+    """
+    @summary: talk to the REST API of the proxy through a pooled, keep-alive session,
+    the authorization header is set once for the session
+    """
+    def __init__(self, proxyconf = None):
+        proxyconf = proxyconf if proxyconf else KOOPLEX.get('proxy', {})
+        self.url_routes = os.path.join(proxyconf.get('base_url','localhost'), 'api', 'routes')
+        # (connect, read) timeouts in seconds
+        self.timeout = proxyconf.get('timeout', (3.05, 10))
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = proxyconf.get('pool_maxsize', 16))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({ 'Authorization': 'token %s' % proxyconf.get('auth_token', '') })
+        self.policy = get_policy('proxy')
+
+    def url(self, path):
+        return os.path.join(self.url_routes, path.lstrip('/')) if path else self.url_routes
+
+    def get(self, path = None):
+        return self.policy.call(self.session.get, endpoint = self.url_routes, url = self.url(path), timeout = self.timeout)
+
+    def post(self, path, target):
+        logger.debug("+ %s ---> %s" % (path, target))
+        return self.policy.call(self.session.post, endpoint = self.url_routes, url = self.url(path), data = json.dumps({ 'target': target }), timeout = self.timeout)
+
+    def delete(self, path):
+        logger.debug("- %s" % path)
+        return self.policy.call(self.session.delete, endpoint = self.url_routes, url = self.url(path), timeout = self.timeout)
+
+_client = None
+_client_lock = threading.Lock()
+
+def proxy_client():
+    """
+    @summary: the process wide proxy client, its connection pool is shared by the threads of the process
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ProxyClient()
+        return _client
+
+
 def getroutes():
-    proxyconf = KOOPLEX.get('proxy', {})
-    kw = {
-        'url': os.path.join(proxyconf.get('base_url','localhost'), 'api', 'routes'), 
-        'headers': {'Authorization': 'token %s' % proxyconf.get('auth_token', '') },
-    }
-    return keeptrying(requests.get, 50, **kw)
+    return proxy_client().get()
 
 
 def droproutes():
-    proxyconf = KOOPLEX.get('proxy', {})
+    client = proxy_client()
     resp = getroutes()
     routes = json.loads(resp.content.decode())
     for r, v in routes.items():
-        kw = {
-            'url': os.path.join(proxyconf.get('base_url','localhost'), 'api', 'routes', r[1:]), 
-            'headers': {'Authorization': 'token %s' % proxyconf.get('auth_token', '') },
-        }
-        logging.debug("- %s -/-> %s" % (kw['url'], v['target']))
-        resp_latest = keeptrying(requests.delete, 5, **kw)
+        logger.debug("- %s -/-> %s" % (r, v['target']))
+        resp_latest = client.delete(r)
 #    return resp_latest
 
 
 def _addroute_container(container, test=False):
-    proxyconf = KOOPLEX.get('proxy', {})
+    client = proxy_client()
     if test:
-        kw = {
-            'url': os.path.join(proxyconf.get('base_url','localhost'), 'api', 'routes', container.proxy_path_test), 
-            'headers': {'Authorization': 'token %s' % proxyconf.get('auth_token', '') },
-            'data': json.dumps({ 'target': container.url_test }),
-        }
-        logging.debug("+ %s ---> %s test port" % (kw['url'], container.url_test))
-    else:
-        kw = {
-            'url': os.path.join(proxyconf.get('base_url','localhost'), 'api', 'routes', container.proxy_path), 
-            'headers': {'Authorization': 'token %s' % proxyconf.get('auth_token', '') },
-            'data': json.dumps({ 'target': container.url }),
-        }
-        logging.debug("+ %s ---> %s proxy path" % (kw['url'], container.url))
-        try:
-             rc = ReportContainerBinding.objects.get(container = container)
-             report = rc.report
-             kw = {
-                 'url': os.path.join(proxyconf.get('base_url','localhost'), 'api', 'routes', 'notebook', report.proxy_path_latest), 
-                 'headers': {'Authorization': 'token %s' % proxyconf.get('auth_token', '') },
-                 'data': json.dumps({ 'target': container.url_test }),
-             }
-             logging.debug("+ %s ---> %s report proxy path latest" % (kw['url'], container.url))
-             keeptrying(requests.post, 50, **kw)
-        except: 
-             logging.debug("Container is not for report")
-
-
-    logging.debug("+ %s ---> %s" % (kw['url'], container.url))
-    return keeptrying(requests.post, 50, **kw)
-
- 
-def _addroute_report(report):
-    proxyconf = KOOPLEX.get('proxy', {})
+        return client.post(container.proxy_path_test, container.url_test)
+    try:
+         rc = ReportContainerBinding.objects.get(container = container)
+         report = rc.report
+         logger.debug("report proxy path latest of %s" % container)
+         client.post(os.path.join('notebook', report.proxy_path_latest), container.url_test)
+    except:
+         logger.debug("Container is not for report")
+    return client.post(container.proxy_path, container.url)
+
+
+def report_routes(report):
+    """
+    @summary: the routes of a report, the one of its tag first then the latest
+    @returns: a list of (route path, target)
+    """
     reportconf = KOOPLEX.get('reportserver', {})
     target_url = reportconf.get('base_url', 'localhost')
     route_prefix = 'report'
     if report.reporttype != report.TP_STATIC:
         route_prefix = 'notebook'
         target_url = report.url_external
-    kw = {
-        'url': os.path.join(proxyconf.get('base_url','localhost'), 'api', 'routes', route_prefix, report.proxy_path), 
-        'headers': {'Authorization': 'token %s' % proxyconf.get('auth_token', '') },
-        'data': json.dumps({ 'target': target_url }),
-    }
-    logging.debug("+ %s ---> %s" % (kw['url'], target_url))
-    keeptrying(requests.post, 50, **kw)
-
-    kw = {
-        'url': os.path.join(proxyconf.get('base_url','localhost'), 'api', 'routes', route_prefix, report.proxy_path_latest), 
-        'headers': {'Authorization': 'token %s' % proxyconf.get('auth_token', '') },
-        'data': json.dumps({ 'target': target_url }),
-    }
-    logging.debug("Report proxy + %s ---> %s" % (kw['url'], target_url))
-    return keeptrying(requests.post, 50, **kw)
+    return [ (os.path.join(route_prefix, report.proxy_path), target_url), (os.path.join(route_prefix, report.proxy_path_latest), target_url) ]
+
+def container_routes(container):
+    return [ (container.proxy_path, container.url), (container.proxy_path_test, container.url_test) ]
+
+def _addroute_report(report):
+    client = proxy_client()
+    (path, target_url), (path_latest, _) = report_routes(report)
+    client.post(path, target_url)
+    logger.debug("Report proxy latest of %s" % report)
+    return client.post(path_latest, target_url)
 
 def addroute(instance):
+    if routemap.enabled():
+        if isinstance(instance, Container):
+            routemap.update(add = dict(container_routes(instance)))
+        elif isinstance(instance, Report):
+            routemap.update(add = dict(report_routes(instance)))
+        if KOOPLEX.get('proxy', {}).get('backend') == 'routemap':
+            return
     if isinstance(instance, Container):
         _addroute_container(instance, test=False)
         return _addroute_container(instance, test=True)
@@ -103,29 +128,83 @@ def addroute(instance):
 
 
 def _removeroute_container(container):
-    proxyconf = KOOPLEX.get('proxy', {})
-    kw = {
-        'url': os.path.join(proxyconf.get('base_url','localhost'), 'api', 'routes', container.proxy_path), 
-        'headers': {'Authorization': 'token %s' % proxyconf.get('auth_token', '') },
-    }
-    logging.debug("- %s -/-> %s" % (kw['url'], container.url))
-    return keeptrying(requests.delete, 5, **kw)
+    return proxy_client().delete(container.proxy_path)
+
+def report_routes_removed(report):
+    """
+    @summary: the route paths to drop with a report, latest is kept while a newer version of the report exists
+    """
+    paths = [ path for path, _ in report_routes(report) ]
+    newer = Report.objects.filter(name = report.name, creator = report.creator, created_at__gt = report.created_at).exclude(id = report.id)
+    if newer.exists():
+        paths = paths[:1]
+    return sorted(set(paths))
 
 def _removeroute_report(report):
-    proxyconf = KOOPLEX.get('proxy', {})
-    reportconf = KOOPLEX.get('reportserver', {})
-    target_url = reportconf.get('base_url', 'localhost')
-    kw = {
-        'url': os.path.join(proxyconf.get('base_url','localhost'), 'api', 'routes', report.proxy_path), 
-        'headers': {'Authorization': 'token %s' % proxyconf.get('auth_token', '') },
-    }
-    logging.debug("- %s -/-> %s" % (kw['url'], target_url))
-    return keeptrying(requests.delete, 5, **kw)
+    client = proxy_client()
+    for path in report_routes_removed(report):
+        resp = client.delete(path)
+    return resp
 
 def removeroute(instance):
+    if routemap.enabled():
+        if isinstance(instance, Container):
+            routemap.update(remove = [ path for path, _ in container_routes(instance) ])
+        elif isinstance(instance, Report):
+            routemap.update(remove = report_routes_removed(instance))
+        if KOOPLEX.get('proxy', {}).get('backend') == 'routemap':
+            return
     if isinstance(instance, Container):
         return _removeroute_container(instance)
     elif isinstance(instance, Report):
         return _removeroute_report(instance)
     logger.error('Not implemented')
 
+
+def desired_routes():
+    """
+    @summary: the routing table the proxy should have, built from running containers and reports
+    @returns: a dictionary of route path -> target
+    """
+    routes = {}
+    for container in Container.objects.filter(state = Container.ST_RUNNING):
+        routes.update(container_routes(container))
+    for report in Report.objects.all().select_related('creator'):
+        routes.update(report_routes(report))
+    return dict([ (path.strip('/'), target) for path, target in routes.items() ])
+
+def diff_routes():
+    """
+    @summary: compare the current routing table of the proxy with the desired one
+    @returns: the routes to add and to change (path -> (old target, new target)), and the paths to delete
+    """
+    current = json.loads(getroutes().content.decode())
+    # the default route of the proxy is not ours
+    current = dict([ (path.strip('/'), v['target']) for path, v in current.items() if path.strip('/') ])
+    desired = desired_routes()
+    add = dict([ (path, (None, target)) for path, target in desired.items() if not path in current ])
+    change = dict([ (path, (current[path], target)) for path, target in desired.items() if path in current and current[path] != target ])
+    delete = [ path for path in current if not path in desired ]
+    return add, change, delete
+
+def reconcile_routes(workers = 16):
+    """
+    @summary: apply only the differences to the routing table of the proxy, concurrently
+    @returns: the applied differences and the number of failed operations
+    """
+    client = proxy_client()
+    add, change, delete = diff_routes()
+    tasks = [ (client.post, path, target) for path, (_, target) in list(add.items()) + list(change.items()) ]
+    tasks.extend([ (client.delete, path) for path in delete ])
+    def apply(task):
+        try:
+            method, args = task[0], task[1:]
+            method(*args)
+            return True
+        except Exception as e:
+            logger.error("Cannot apply route change %s -- %s" % (task[1:], e))
+            return False
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        n_failed = len([ ok for ok in pool.map(apply, tasks) if not ok ])
+    logger.info("routes reconciled: %d added, %d changed, %d deleted, %d failed" % (len(add), len(change), len(delete), n_failed))
+    return add, change, delete, n_failed
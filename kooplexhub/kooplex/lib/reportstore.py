@@ -0,0 +1,174 @@
+"""
+@author: Jozsef Steger
+@summary: store report versions as hardlink farms of content addressed blobs
+
+The blobs of a user live in a root only folder on the report filesystem, named by the sha256 of their content and their mode.
+A version folder, latest or a tag, only consists of hardlinks to the blobs, so unchanged files across versions share an inode.
+latest is a symbolic link to the current farm, it is swapped atomically when a new version is published.
+A blob is garbage when it has no other links than the one in the store.
+Blobs are made read only, modifying a file of a version must replace it, never write it in place.
+A new blob has a single link until it is linked into the farm, so publishing holds a shared lock of the store
+and the garbage collector an exclusive one.
+"""
+import os
+import stat
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+from collections import namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+FarmStats = namedtuple('FarmStats', [ 'files', 'unchanged', 'linked', 'copied', 'bytes_copied' ])
+
+@contextmanager
+def _locked(store, exclusive = False):
+    os.makedirs(store, exist_ok = True)
+    with open(os.path.join(store, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _blob(store, path, st):
+    """
+    @summary: the blob of a file, the content is copied into the store only if it is new
+    @returns: the path of the blob and whether it was copied
+    """
+    mode = stat.S_IMODE(st.st_mode) & ~0o222
+    digest = _hash(path)
+    blob = os.path.join(store, digest[:2], "%s-%o" % (digest, mode))
+    if os.path.exists(blob):
+        return blob, False
+    os.makedirs(os.path.dirname(blob), exist_ok = True)
+    tmp = "%s.%f.tmp" % (blob, time.time())
+    shutil.copyfile(path, tmp)
+    os.chmod(tmp, mode)
+    os.utime(tmp, ns = (st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp, blob)
+    return blob, True
+
+def build_farm(source, target, store, previous = None):
+    """
+    @summary: populate a new version folder with hardlinks to the blobs of the files in source
+    @param previous: an earlier version, its files of the same size and modification time are linked without hashing
+    @returns: FarmStats
+    """
+    n = { 'files': 0, 'unchanged': 0, 'linked': 0, 'copied': 0, 'bytes_copied': 0 }
+    for root, dirnames, filenames in os.walk(source):
+        rel = os.path.relpath(root, source)
+        dir_target = os.path.normpath(os.path.join(target, rel))
+        os.makedirs(dir_target, exist_ok = True)
+        os.chmod(dir_target, stat.S_IMODE(os.stat(root).st_mode))
+        for name in filenames + [ d for d in dirnames if os.path.islink(os.path.join(root, d)) ]:
+            path = os.path.join(root, name)
+            path_target = os.path.join(dir_target, name)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                os.symlink(os.readlink(path), path_target)
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            n['files'] += 1
+            if previous:
+                path_previous = os.path.normpath(os.path.join(previous, rel, name))
+                try:
+                    st_previous = os.lstat(path_previous)
+                    if stat.S_ISREG(st_previous.st_mode) and st_previous.st_size == st.st_size and st_previous.st_mtime_ns == st.st_mtime_ns and stat.S_IMODE(st_previous.st_mode) == stat.S_IMODE(st.st_mode) & ~0o222:
+                        os.link(path_previous, path_target)
+                        n['unchanged'] += 1
+                        continue
+                except FileNotFoundError:
+                    pass
+            blob, copied = _blob(store, path, st)
+            os.link(blob, path_target)
+            if copied:
+                n['copied'] += 1
+                n['bytes_copied'] += st.st_size
+            else:
+                n['linked'] += 1
+    return FarmStats(**n)
+
+def _remove(path):
+    if os.path.islink(path):
+        os.unlink(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
+def publish_latest(source, dir_report, store):
+    """
+    @summary: build the farm of a new version and point latest to it in a single rename
+    @returns: the new farm and FarmStats
+    """
+    dir_latest = os.path.join(dir_report, 'latest')
+    ts = time.time()
+    farm = os.path.join(dir_report, '.latest.%f' % ts)
+    previous = dir_latest if os.path.isdir(dir_latest) else None
+    with _locked(store):
+        stats = build_farm(source, farm, store, previous)
+    farm_old = os.path.realpath(dir_latest) if os.path.islink(dir_latest) else None
+    if os.path.isdir(dir_latest) and not os.path.islink(dir_latest):
+        # a plain folder written by an earlier release
+        farm_old = os.path.join(dir_report, '.latest.%f.old' % ts)
+        os.rename(dir_latest, farm_old)
+    tmp = os.path.join(dir_report, '.latest.%f.tmp' % ts)
+    os.symlink(os.path.basename(farm), tmp)
+    os.replace(tmp, dir_latest)
+    if farm_old and farm_old != farm:
+        _remove(farm_old)
+    logger.info("%s published: %s" % (dir_latest, stats))
+    return farm, stats
+
+def publish_tag(farm, dir_tag, store):
+    """
+    @summary: link a tagged version to the same blobs as the farm
+    """
+    ts = time.time()
+    tmp = "%s.%f.tmp" % (dir_tag, ts)
+    with _locked(store):
+        stats = build_farm(farm, tmp, store, farm)
+    if os.path.lexists(dir_tag):
+        old = "%s.%f.old" % (dir_tag, ts)
+        os.rename(dir_tag, old)
+        os.rename(tmp, dir_tag)
+        _remove(old)
+    else:
+        os.rename(tmp, dir_tag)
+    logger.info("%s published: %s" % (dir_tag, stats))
+    return stats
+
+def gc(store):
+    """
+    @summary: remove the blobs no version refers to
+    @returns: the number of blobs and bytes freed
+    """
+    n = 0
+    size = 0
+    if not os.path.isdir(store):
+        return n, size
+    with _locked(store, exclusive = True):
+        for prefix in os.scandir(store):
+            if not prefix.is_dir(follow_symlinks = False):
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                st = entry.stat(follow_symlinks = False)
+                if st.st_nlink == 1:
+                    os.unlink(entry.path)
+                    n += 1
+                    size += st.st_size
+    if n:
+        logger.info("%s: %d blobs, %.1f MB freed" % (store, n, size / 1e6))
+    return n, size
@@ -0,0 +1,98 @@
+"""
+@author: Jozsef Steger
+@summary: sample the resource usage of running containers from the docker stats API
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db.models import Max
+
+from kooplex.settings import KOOPLEX
+from kooplex.lib import Docker, now
+from hub.models import Container, CourseContainerBinding, ContainerResourceSample
+
+logger = logging.getLogger(__name__)
+
+def parse_stats(stats):
+    """
+    @summary: extract the figures we keep from a docker stats record
+    @returns: cpu (cores), memory (MB) and the cumulative network and block device counters (bytes)
+    """
+    cpu_stats = stats.get('cpu_stats', {})
+    precpu_stats = stats.get('precpu_stats', {})
+    cpu_delta = cpu_stats.get('cpu_usage', {}).get('total_usage', 0) - precpu_stats.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu_stats.get('system_cpu_usage', 0) - precpu_stats.get('system_cpu_usage', 0)
+    n_cpu = cpu_stats.get('online_cpus') or len(cpu_stats.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+    cpu = float(cpu_delta) / system_delta * n_cpu if cpu_delta > 0 and system_delta > 0 else 0.
+    memory_stats = stats.get('memory_stats', {})
+    # page cache is reclaimable, it is not what the container really needs
+    memory = (memory_stats.get('usage', 0) - memory_stats.get('stats', {}).get('cache', 0)) / 2**20
+    rx, tx = 0, 0
+    for network in (stats.get('networks') or {}).values():
+        rx += network.get('rx_bytes', 0)
+        tx += network.get('tx_bytes', 0)
+    read, write = 0, 0
+    for item in stats.get('blkio_stats', {}).get('io_service_bytes_recursive') or []:
+        if item.get('op') == 'Read':
+            read += item.get('value', 0)
+        elif item.get('op') == 'Write':
+            write += item.get('value', 0)
+    return cpu, memory, (rx, tx, read, write)
+
+class Collector:
+    """
+    @summary: query the stats of many containers concurrently and store them as raw samples
+    """
+    statsconf = KOOPLEX.get('stats', {})
+
+    def __init__(self, workers = None):
+        self.workers = workers if workers else self.statsconf.get('workers', 32)
+        self._local = threading.local()
+
+    def _docker(self):
+        # docker clients are not shared among threads
+        if not hasattr(self._local, 'docker'):
+            self._local.docker = Docker()
+        return self._local.docker
+
+    def stats(self, container):
+        try:
+            client = self._docker()._client(container)
+            return client.stats(self._docker()._id(container), decode = True, stream = False)
+        except Exception as e:
+            logger.warning("No stats of %s -- %s" % (container, e))
+            return None
+
+    def collect(self):
+        """
+        @summary: take a sample of each running container
+        @returns: the list of new, unsaved samples
+        """
+        containers = list(Container.objects.filter(state = Container.ST_RUNNING).select_related('image'))
+        courses = dict([ (b.container_id, b.course_id) for b in CourseContainerBinding.objects.filter(container__in = containers) ])
+        latest = ContainerResourceSample.objects.filter(resolution = ContainerResourceSample.RES_RAW, container__in = containers).values('container_id').annotate(latest = Max('id')).values_list('latest', flat = True)
+        previous = dict(ContainerResourceSample.objects.filter(id__in = list(latest)).values_list('container_id', 'counters'))
+        with ThreadPoolExecutor(max_workers = self.workers) as pool:
+            records = list(pool.map(self.stats, containers))
+        timenow = now()
+        samples = []
+        for container, stats in zip(containers, records):
+            if not stats:
+                continue
+            cpu, memory, counters = parse_stats(stats)
+            if previous.get(container.id):
+                last = [ int(x) for x in previous[container.id].split(',') ]
+                # counters start from zero again when the container is restarted
+                deltas = [ c - l if c >= l else c for c, l in zip(counters, last) ]
+            else:
+                # the first sample only sets the baseline, the counters hold the traffic since the container started
+                deltas = [ 0 ] * len(counters)
+            samples.append(ContainerResourceSample(
+                container = container, user_id = container.user_id, image = container.image, course_id = courses.get(container.id),
+                timestamp = timenow,
+                cpu = cpu, memory = memory, memory_max = memory,
+                net_rx = deltas[0], net_tx = deltas[1], blk_read = deltas[2], blk_write = deltas[3],
+                counters = ",".join([ str(c) for c in counters ]),
+            ))
+        return samples
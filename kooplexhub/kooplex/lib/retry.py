@@ -0,0 +1,197 @@
+"""
+@author: Jozsef Steger
+@summary: retry policies with a total time budget, jittered backoff and circuit breakers per endpoint
+
+A policy is looked up by its name, its parameters come from KOOPLEX['retry'][name]:
+    attempts: the maximum number of calls
+    deadline: seconds, no retry is started after the budget is used up
+    timeout: seconds, the timeout of an attempt unless the caller gives one, cut to the remaining budget
+    base_delay, max_delay: seconds, the bounds of the exponential backoff
+    jitter: sleep a random fraction of the backoff to spread the retries of concurrent callers
+    retry_status: HTTP status codes of a response to be treated as a failure
+    breaker_threshold: consecutive failed calls, each of them after all its attempts, to open the circuit of an endpoint, 0 turns the breaker off
+    breaker_reset: seconds to fail fast before a single probe call is let through
+"""
+import time
+import random
+import logging
+import threading
+
+from kooplex.settings import KOOPLEX
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpen(Exception):
+    pass
+
+class RetryableStatus(Exception):
+    def __init__(self, response):
+        self.response = response
+        Exception.__init__(self, "HTTP status %s" % response.status_code)
+
+class CircuitBreaker:
+    """
+    @summary: stop calling an unhealthy endpoint for a while after consecutive failures
+    """
+    ST_CLOSED = 'closed'
+    ST_OPEN = 'open'
+    ST_HALFOPEN = 'half-open'
+
+    def __init__(self, name, threshold, reset_timeout):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.ST_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return "<CircuitBreaker %s: %s>" % (self.name, self.state)
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.ST_CLOSED:
+                return True
+            if self.state == self.ST_OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                # let a single probe through
+                self.state = self.ST_HALFOPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != self.ST_CLOSED:
+                logger.info("%s closes" % self)
+            self.state = self.ST_CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.ST_HALFOPEN or (self.state == self.ST_CLOSED and self.failures >= self.threshold):
+                self.state = self.ST_OPEN
+                self.opened_at = time.time()
+                logger.warning("%s opens after %d failures" % (self, self.failures))
+
+class RetryStats:
+    """
+    @summary: counters of a policy, latency is measured over all the attempts of a call
+    """
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+        self.latency_total = 0.
+        self.latency_max = 0.
+        self._lock = threading.Lock()
+
+    def record(self, retries, latency, failed = False, rejected = False):
+        with self._lock:
+            self.calls += 1
+            self.retries += retries
+            self.failures += 1 if failed else 0
+            self.rejected += 1 if rejected else 0
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'failures': self.failures,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'latency_avg': self.latency_total / self.calls if self.calls else 0.,
+                'latency_max': self.latency_max,
+            }
+
+class RetryPolicy:
+    def __init__(self, name, attempts = 5, deadline = 30., timeout = 10., base_delay = .1, max_delay = 5., jitter = True, retry_status = (502, 503, 504), breaker_threshold = 5, breaker_reset = 30.):
+        self.name = name
+        self.attempts = attempts
+        self.deadline = deadline
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_status = retry_status
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.stats = RetryStats()
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return "<RetryPolicy %s>" % self.name
+
+    def breaker(self, endpoint):
+        if not self.breaker_threshold:
+            return None
+        with self._lock:
+            if not endpoint in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker("%s/%s" % (self.name, endpoint), self.breaker_threshold, self.breaker_reset)
+            return self._breakers[endpoint]
+
+    def call(self, method, endpoint = None, **kw):
+        """
+        @summary: call a method with keyword arguments, retry while the attempts and the time budget last
+        @param endpoint: the name of the backend, failures are counted separately for each of them
+        @returns: the return value of method
+        @raises CircuitOpen if the endpoint is known to be unhealthy, otherwise the last exception
+        """
+        breaker = self.breaker(endpoint)
+        t0 = time.time()
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                self.stats.record(attempt, time.time() - t0, failed = True, rejected = True)
+                raise CircuitOpen("%s is open, not calling %s" % (breaker, method))
+            attempt += 1
+            if self.timeout and not 'timeout' in kw:
+                # a hanging attempt must not outlive the budget
+                kw_attempt = dict(kw, timeout = max(min(self.timeout, self.deadline - (time.time() - t0)), .1))
+            else:
+                kw_attempt = kw
+            try:
+                result = method(**kw_attempt)
+                if getattr(result, 'status_code', None) in self.retry_status:
+                    raise RetryableStatus(result)
+                if breaker is not None:
+                    breaker.success()
+                self.stats.record(attempt - 1, time.time() - t0)
+                return result
+            except Exception as e:
+                elapsed = time.time() - t0
+                if breaker is not None and breaker.state == breaker.ST_HALFOPEN:
+                    # the probe failed, the circuit opens again
+                    breaker.failure()
+                if attempt >= self.attempts or elapsed + delay > self.deadline:
+                    if breaker is not None and breaker.state == breaker.ST_CLOSED:
+                        breaker.failure()
+                    self.stats.record(attempt - 1, elapsed, failed = True)
+                    logger.error("%s gave up %s after %d attempts in %.1f s -- %s" % (self, method, attempt, elapsed, e))
+                    if isinstance(e, RetryableStatus):
+                        return e.response
+                    raise
+                logger.warning("%s attempt %d of %s failed -- %s" % (self, attempt, method, e))
+                time.sleep(random.uniform(0, delay) if self.jitter else delay)
+                delay = min(delay * 2, self.max_delay)
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+def get_policy(name):
+    """
+    @summary: the process wide instance of a named policy, configured in KOOPLEX['retry']
+    """
+    with _policies_lock:
+        if not name in _policies:
+            _policies[name] = RetryPolicy(name, **KOOPLEX.get('retry', {}).get(name, {}))
+        return _policies[name]
+
+def retry_stats():
+    with _policies_lock:
+        return dict([ (name, policy.stats.as_dict()) for name, policy in _policies.items() ])
@@ -0,0 +1,170 @@
+"""
+@author: Jozsef Steger
+@summary: publish the routing table of the hub as a versioned file, swapped atomically
+
+The JSON route table is the source of truth, the nginx map is rendered from it if configured.
+Readers always see either the old or the new version of a file, never a partially written one.
+Route changes are collected for a short window and published together, so a burst of container starts
+rewrites the files and reloads the proxy only once.
+"""
+import os
+import re
+import json
+import fcntl
+import atexit
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from kooplex.settings import KOOPLEX
+from kooplex.lib import now, bash
+
+logger = logging.getLogger(__name__)
+
+routemapconf = KOOPLEX.get('proxy', {}).get('routemap', {})
+
+def enabled():
+    return KOOPLEX.get('proxy', {}).get('backend', 'api') in [ 'routemap', 'both' ]
+
+def _atomic_write(path, content):
+    folder = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir = folder, prefix = '.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+@contextmanager
+def _locked():
+    """
+    @summary: serialize the updates of the route table among processes
+    """
+    path = routemapconf.get('json', '/tmp/routes.json')
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def read():
+    """
+    @summary: the published route table
+    @returns: the version and the dictionary of route path -> target
+    """
+    try:
+        with open(routemapconf.get('json', '/tmp/routes.json')) as f:
+            table = json.load(f)
+        return table['version'], table['routes']
+    except FileNotFoundError:
+        return 0, {}
+
+def render_nginx(version, routes):
+    lines = [
+        "# generated by kooplex hub, version %d" % version,
+        "map $uri %s {" % routemapconf.get('nginx_variable', '$kooplex_target'),
+        "    default \"\";",
+    ]
+    # longer prefixes first, nginx picks the first matching regular expression
+    for path in sorted(routes, key = lambda p: (-len(p), p)):
+        lines.append("    \"~^/%s(/|$)\" \"%s\";" % (re.escape(path.strip('/')), routes[path]))
+    lines.append("}")
+    lines.append("")
+    return "\n".join(lines)
+
+def _write(version, routes):
+    table = {
+        'version': version,
+        'generated_at': now().isoformat(),
+        'routes': routes,
+    }
+    _atomic_write(routemapconf.get('json', '/tmp/routes.json'), json.dumps(table, indent = 1, sort_keys = True))
+    if routemapconf.get('nginx'):
+        _atomic_write(routemapconf['nginx'], render_nginx(version, routes))
+    logger.info("route table version %d published with %d routes" % (version, len(routes)))
+    if routemapconf.get('reload'):
+        # e.g. nginx -s reload
+        bash(routemapconf['reload'])
+
+def publish(routes):
+    """
+    @summary: replace the whole route table in a single step
+    @returns: the new version
+    """
+    with _locked():
+        version, _ = read()
+        _write(version + 1, routes)
+    return version + 1
+
+def _apply(add, remove):
+    with _locked():
+        version, routes = read()
+        routes.update(add)
+        for path in remove:
+            routes.pop(path, None)
+        _write(version + 1, routes)
+    return version + 1
+
+class RouteCoalescer:
+    """
+    @summary: a process-wide debouncer of route changes, the last change of a path wins
+    """
+    def __init__(self, window):
+        self.window = window
+        self._lock = threading.Lock()
+        self._add = {}
+        self._remove = set()
+        self._timer = None
+
+    def request(self, add = {}, remove = []):
+        with self._lock:
+            for path in remove:
+                self._add.pop(path, None)
+                self._remove.add(path)
+            for path, target in add.items():
+                self._remove.discard(path)
+                self._add[path] = target
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """
+        @summary: publish the changes collected so far
+        @returns: the new version or None if there was nothing to publish
+        """
+        with self._lock:
+            add, remove = self._add, self._remove
+            self._add, self._remove = {}, set()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not add and not remove:
+            return None
+        try:
+            return _apply(add, remove)
+        except Exception as e:
+            logger.error("Cannot publish %d added and %d removed routes -- %s" % (len(add), len(remove), e))
+
+route_coalescer = RouteCoalescer(window = routemapconf.get('window', 1))
+atexit.register(route_coalescer.flush)
+
+def update(add = {}, remove = [], wait = False):
+    """
+    @summary: change some routes of the published table
+    @param add: route path -> target to add or to overwrite
+    @param remove: route paths to drop
+    @param wait: publish right away, together with the changes pending
+    @returns: the new version if waited for
+    """
+    route_coalescer.request(add, remove)
+    if wait:
+        return route_coalescer.flush()
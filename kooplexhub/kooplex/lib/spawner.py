@@ -0,0 +1,59 @@
+"""
+@author: Jozsef Steger
+@summary: start containers in the background, outside the HTTP request
+"""
+import logging
+
+from django.db import connection
+
+from hub.models import Container, SpawnJob
+from kooplex.lib import Docker, now
+from kooplex.lib.proxy import addroute
+
+logger = logging.getLogger(__name__)
+
+def spawn(job, engine = None):
+    """
+    @summary: run the start pipeline of a container phase by phase, recording the progress in the job
+    @param job: the spawn job, already claimed by the caller
+    @type job: hub.models.SpawnJob
+    @param engine: the engine the job was admitted on, the container is placed by the policy if not given
+    """
+    container = job.container
+    try:
+        docker = Docker()
+        was_present = container.state != Container.ST_NOTPRESENT
+        if engine in docker.engines:
+            container.engine = engine
+        if docker.get_container(container) is None:
+            if not engine in docker.engines:
+                docker.place(container)
+            # the engine is recorded early, so that a failed start can be cleaned up on the right engine
+            Container.objects.filter(id = container.id).update(engine = container.engine)
+            if docker.claim_warmcontainer(container) is None:
+                docker.create_container(container)
+        job.set_phase(SpawnJob.PH_STARTING)
+        docker.run_container(container)
+        job.set_phase(SpawnJob.PH_ROUTING)
+        addroute(container)
+        # NOTE: queryset update bypasses the pre_save signals, which would run the synchronous start chain
+        fields = {
+            'state': Container.ST_RUNNING,
+            'docker_id': container.docker_id,
+            'engine': container.engine,
+            'last_message': container.last_message,
+            'last_message_at': now(),
+        }
+        if not was_present:
+            fields['marked_to_remove'] = False
+        Container.objects.filter(id = container.id).update(**fields)
+        job.set_phase(SpawnJob.PH_READY)
+        logger.info("%s started" % container)
+    except Exception as e:
+        logger.error("Cannot start %s -- %s" % (container, e))
+        job.set_phase(SpawnJob.PH_FAILED, str(e)[:512])
+    finally:
+        connection.close()
+
+def queued_jobs(limit = None):
+    return SpawnJob.objects.filter(phase = SpawnJob.PH_QUEUED).select_related('container').order_by('created_at')[:limit]
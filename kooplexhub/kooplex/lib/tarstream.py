@@ -0,0 +1,83 @@
+"""
+@author: Jozsef Steger
+@summary: stream several files in a single tar archive without buffering the whole archive in memory
+"""
+import os
+import time
+import tarfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ArchiveWriter:
+    """
+    @summary: collect in-memory contents and files on disk, and render them as a tar stream
+    """
+    def __init__(self):
+        self._members = []
+
+    def __len__(self):
+        return len(self._members)
+
+    @property
+    def names(self):
+        return [ name for name, _, _ in self._members ]
+
+    def add_data(self, name, content, mode = 0o644, uid = 0, gid = 0):
+        """
+        @summary: add a file from memory
+        @param name: the path of the file in the archive
+        @type name: str
+        @param content: the file content
+        @type content: bytes
+        """
+        tarinfo = tarfile.TarInfo(name = name.lstrip('/'))
+        tarinfo.size = len(content)
+        tarinfo.mtime = time.time()
+        tarinfo.mode = mode
+        tarinfo.uid = uid
+        tarinfo.gid = gid
+        self._members.append((tarinfo.name, tarinfo, content))
+
+    def add_file(self, name, path, uid = None, gid = None):
+        """
+        @summary: add a file from disk, its content is only read while streaming
+        @param name: the path of the file in the archive
+        @type name: str
+        @param path: the file to read
+        @type path: str
+        """
+        st = os.stat(path)
+        tarinfo = tarfile.TarInfo(name = name.lstrip('/'))
+        tarinfo.size = st.st_size
+        tarinfo.mtime = st.st_mtime
+        tarinfo.mode = st.st_mode & 0o7777
+        tarinfo.uid = st.st_uid if uid is None else uid
+        tarinfo.gid = st.st_gid if gid is None else gid
+        self._members.append((tarinfo.name, tarinfo, path))
+
+    def stream(self, chunk_size = 65536):
+        """
+        @summary: generate the tar archive block by block
+        """
+        for name, tarinfo, source in self._members:
+            yield tarinfo.tobuf(format = tarfile.DEFAULT_FORMAT, encoding = tarfile.ENCODING, errors = 'surrogateescape')
+            if isinstance(source, bytes):
+                yield source
+            else:
+                left = tarinfo.size
+                with open(source, 'rb') as f:
+                    while left > 0:
+                        chunk = f.read(min(chunk_size, left))
+                        if not chunk:
+                            logger.warning("%s shrank while streaming" % source)
+                            break
+                        left -= len(chunk)
+                        yield chunk
+                if left > 0:
+                    yield tarfile.NUL * left
+            remainder = tarinfo.size % tarfile.BLOCKSIZE
+            if remainder:
+                yield tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+        # end of archive marker
+        yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
@@ -1,3 +1,5 @@
+import queue
+import threading
 import requests
 import requests.auth
 import logging
@@ -7,6 +9,7 @@ from kooplex.settings import KOOPLEX
 from .vc_github import list_projects as lp_gh
 from .vc_gitlab import list_projects as lp_gl
 from .vc_gitea import list_projects as lp_gt
+from .docker import Docker
 
 
 logger = logging.getLogger(__name__)
@@ -71,3 +74,91 @@ def impersonator_removecache(vcproject):
     except Exception as e:
         logger.error('error to clone {} for user {} -- {}'.format(vcproject, vcproject.token.user.username, e))
 
+
+
+class BatchTicket:
+    """
+    @summary: the outcome of a queued project, set when the batch it belongs to is shipped
+    """
+    def __init__(self, vcproject):
+        self.vcproject = vcproject
+        self.error = None
+        self._done = threading.Event()
+
+    def resolve(self, error = None):
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout = None):
+        """
+        @returns: True if the project was shipped to the impersonator
+        """
+        if not self._done.wait(timeout):
+            self.error = "not shipped within %s seconds" % timeout
+            return False
+        return self.error is None
+
+
+class ImpersonatorBatch:
+    """
+    @summary: collect version control projects to clone and hand them over to the impersonator in a single
+    command file. The queue is flushed when it is full, when the flush interval expires or when flush() is called.
+    Another request may ship the projects put here, the returned tickets tell whether they were shipped.
+    """
+    def __init__(self, maxsize, interval):
+        self.interval = interval
+        self._queue = queue.Queue(maxsize = maxsize)
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def put(self, vcproject):
+        """
+        @returns: a BatchTicket
+        """
+        ticket = BatchTicket(vcproject)
+        while True:
+            try:
+                self._queue.put_nowait(ticket)
+                break
+            except queue.Full:
+                self.flush()
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return ticket
+
+    def flush(self):
+        """
+        @summary: ship the queued projects in one impersonator round-trip
+        @returns: the number of projects shipped
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+        if not batch:
+            return 0
+        try:
+            Docker().trigger_impersonator([ ticket.vcproject for ticket in batch ])
+            logger.info("impersonator triggered to clone %d projects" % len(batch))
+        except Exception as e:
+            logger.error("cannot trigger impersonator to clone %d projects -- %s" % (len(batch), e))
+            for ticket in batch:
+                ticket.resolve(error = str(e))
+            raise
+        for ticket in batch:
+            ticket.resolve()
+        return len(batch)
+
+impersonator_batch = ImpersonatorBatch(
+        maxsize = KOOPLEX.get('impersonator', {}).get('batch_size', 100), 
+        interval = KOOPLEX.get('impersonator', {}).get('batch_interval', 2)
+        )
@@ -211,6 +211,17 @@ KOOPLEX = {
         'volume_dir': os.getenv('DOCKER_VOLUME_DIR', None),
         'mountconf': '/tmp/mount.conf',
         'gitcommandconf': '/tmp/gitcommand.conf',
+        'environmentconf': '/tmp/environment.conf',
+        'mem_limit': 2048,
+        'cpu_limit': 4,
+        'overcommit_memory': 1.,
+        'overcommit_cpu': 2.,
+        'admission': 'queue',
+        'engines': {
+            'local': { 'base_url': os.getenv('DOCKER_HOST', ''), 'pattern_target': 'http://%(containername)s:%(port)d' },
+        },
+        'default_engine': 'local',
+        'placement': 'least_loaded',
         'impersonator': '%s-impersonator' % PREFIX, #FIXME: is it still used?
     },
     'impersonator': {
@@ -218,6 +229,9 @@ KOOPLEX = {
         'username': 'hub',
         'password': 'blabla',
         'seafile_api': 'http://%s-seafile-pw:5000' % PREFIX,
+        'batch_clone': False,
+        'batch_size': 100,
+        'batch_interval': 2,
     },
     'spawner': {
         'pattern_proxypath': 'notebook/%(containername)s',
@@ -226,10 +240,58 @@ KOOPLEX = {
         'pattern_courseproject_containername': 'course-%(projectname)s-%(username)s',
         'port': 8000,
         'port_test': 9000,
+        'workers': 8,
+    },
+    'culler': {
+        'idle_timeout': 24 * 60,
+        'pause_after': 30,
+        'workers': 32,
+        'timeout': 5,
+    },
+    'stats': {
+        'interval': 60,
+        'workers': 32,
+        'keep_raw': 1,
+        'keep_5min': 30,
+    },
+    'acl': {
+        'workers': 8,
+    },
+    'diskusage': {
+        'cache': '/var/cache/kooplex/diskusage.json',
+        # soft quotas in MB
+        'soft_quota': { 'home': 10240, 'workdir': 10240, 'share': 51200, 'report': 10240 },
+    },
+    'handout': {
+        'workers': 8,
+    },
+    'archive': {
+        'codec': 'gz',
+        'workers': 4,
+        'chunk_size': 4 * 1024 * 1024,
+        'exclude': [ '.ipynb_checkpoints', '__pycache__' ],
+    },
+    'retry': {
+        'proxy': { 'attempts': 8, 'deadline': 20., 'breaker_threshold': 5, 'breaker_reset': 30. },
+        'reportapi': { 'attempts': 8, 'deadline': 20., 'breaker_threshold': 5, 'breaker_reset': 30. },
+        # a freshly started notebook server needs some time, a failing one should not hold back the others
+        'notebook': { 'attempts': 10, 'deadline': 60., 'max_delay': 10., 'breaker_threshold': 0 },
     },
     'proxy': {
         'base_url': 'http://%s-proxy:8001' % PREFIX,
         'auth_token': os.getenv('HUBPROXY_PW'),
+        'timeout': (3.05, 10),
+        'pool_maxsize': 16,
+        # api: REST calls to the proxy, routemap: publish a routing map file only, both: do both
+        'backend': 'api',
+        'routemap': {
+            'json': '/srv/kooplex/routes/routes.json',
+            'nginx': None,
+            'nginx_variable': '$kooplex_target',
+            'reload': None,
+            # seconds to collect route changes before publishing them together
+            'window': 1,
+        },
     },
     'reportserver': {
         'base_url': 'http://%s-report-nginx' % PREFIX,